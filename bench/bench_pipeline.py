@@ -0,0 +1,231 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import contextlib
+import subprocess as sub
+import multiprocessing as mp
+import numpy as np
+import netCDF4 as nc
+from datetime   import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+ndir    = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ndir+'/sub')
+sys.path.append(ndir+'/bench')
+import download
+from common         import COCO, GLORYS12v1, HEADER, LUT
+from interpolation  import INTERP, build_mytool
+from mk_data        import CONVERT
+from gtool3         import GT3WRITER
+from bench_workers  import mk_grids
+
+#--- output variables of COCO restart file (levels : nz for 3-D ocean variables, 5 for ice categories)
+names   = [ 'UO',   'VO',   'TO',   'SO',  'SHO', 'UBTO', 'VBTO',   'WO',\
+            'AI',   'HI',   'UI',   'VI',   'TI',   'HS',   'FT','SWABS',\
+            'FW',   'FS', 'TAUX', 'TAUY',  'AMV',  'AHV', 'PTOP',  'TSI']
+ocean   = ['UO','VO','TO','SO','WO','AMV','AHV']
+ice     = ['AI','HI','TI','HS','TSI']
+
+def mk_coco(tdir,resol,nz,ymdh):
+    #--- synthetic grid file (same layout as 'COCO.set_grids')
+    coco, _ = mk_grids(resol,0,0,nz)
+    nx, ny  = coco.nx, coco.ny
+    gname   = f'{tdir}/data/GRID/grid_{resol}_z{nz}.stream'
+    if not os.path.isfile(gname) :
+        with open(gname,'wb') as fout :
+            for var in [coco.lon,coco.lat,np.zeros(nx*ny),\
+                        np.zeros((nx+1)*(ny+1)),np.zeros((nx+1)*(ny+1)),np.zeros(nx*ny),\
+                        np.zeros(nx*ny),np.zeros((nx+1)*(ny+1)),coco.lev,coco.lev] :
+                np.asarray(var,dtype='>f8').tofile(fout)
+
+    #--- synthetic restart file (only ice variables are read, so other data are left as holes)
+    rname   = f'{tdir}/data/long-run/coco_restart_{ymdh}.gt3'
+    if not os.path.isfile(rname) :
+        writer  = GT3WRITER()
+        rng     = np.random.default_rng(0)
+        with open(rname,'wb') as fout :
+            for name in names :
+                nk      = nz if name in ocean else (5 if name in ice else 1)
+                header  = ['']*64
+                header[0:3]     = ['9010',f'COCO{resol} bench',name]
+                header[26]      = f'{ymdh[:8]} {ymdh[8:]}0000'
+                header[28:37]   = ['GLON','1',str(nx),'GLAT','1',str(ny),'ZLEV','1',str(nk)]
+                header[37]      = 'UR8'
+                header[63]      = str(nx*ny*nk)
+                writer.write_header(fout,[f'{item:<16}'[:16] for item in header])
+                if name in ice :
+                    writer.write_data(fout,rng.random(nx*ny*nk))
+                else :
+                    fout.write(np.array([8*nx*ny*nk],dtype='>i4').tobytes())
+                    fout.seek(8*nx*ny*nk,1)
+                    fout.write(np.array([8*nx*ny*nk],dtype='>i4').tobytes())
+
+def mk_raw(fname,gres,nlev):
+    #--- synthetic data in the layout of 'copernicusmarine' (180W - 180E, 80S - 90N; the last level is undef)
+    if os.path.isfile(fname) :  return
+    lon     = -180+np.arange(360*gres)/gres
+    lat     = -80+np.arange(170*gres+1)/gres
+    lev     = np.geomspace(0.5,5900,nlev)
+    rlon, rlat  = np.meshgrid(np.radians(lon),np.radians(lat))
+    with nc.Dataset(fname+'.tmp','w') as fout :
+        for name, var in [('longitude',lon),('latitude',lat),('depth',lev),('time',[0])] :
+            fout.createDimension(name,len(var))
+            fout.createVariable(name,'f4',(name,))[:]   = var
+        for name in ['uo','vo','thetao','so'] :
+            fout.createVariable(name,'f4',('time','depth','latitude','longitude'),fill_value=np.float32(1e20))
+        for kz in range(nlev):
+            land    = (np.sin(4*rlon)*np.cos(3*rlat)>0.5-0.02*kz)|(rlat<np.radians(-78+kz/nlev))
+            if kz==nlev-1 : land[:]  = True
+            for name, var in [('uo',    0.1*np.sin(rlon)),\
+                              ('vo',    0.1*np.cos(rlat)),\
+                              ('thetao',20*np.cos(rlat)+np.sin(3*rlon)-20*kz/nlev),\
+                              ('so',    34+np.sin(rlon+rlat))] :
+                fout.variables[name][0,kz]  = np.ma.masked_array(var.astype(np.float32),mask=land)
+    os.replace(fname+'.tmp',fname)
+
+class STAGES :
+    def __init__(self):
+        self.result = {}
+
+    def run(self,name,func,*args):
+        #--- elapsed time & peak RSS of the process after the stage (messages of programs are hidden)
+        stime   = time.perf_counter()
+        with open(os.devnull,'w') as null, contextlib.redirect_stdout(null) :
+            res = func(*args)
+        etime   = time.perf_counter()-stime
+        self.result[name]   = { 'time'          :   round(etime,4),\
+                                'peak_rss_mb'   :   round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024,1) }
+        return res
+
+def modify_all(dl,rname):
+    #--- same as 'download.GLORYS12v1.main' after downloading
+    with nc.Dataset(rname,'r') as fin, nc.Dataset(dl.ofname,'w') as fout :
+        dl.set_basicinfo(fout,\
+            fin.variables['longitude'][:],\
+            fin.variables['latitude'][:],\
+            fin.variables['depth'][:],\
+            np.array([0]))
+        for vname in dl.vdict.keys() :
+            dl.modify_data(fin,fout,vname)
+
+def remove_undef(interp,in_data):
+    match interp.backend :
+        case 'fortran' :
+            out = np.empty(in_data.shape,dtype=np.float32)
+            for kz in range(len(in_data)):
+                interp.fill.main(in_data[kz],out=out[kz])
+            return out
+        case 'numpy' :
+            return interp.remove_undef_np(in_data)
+
+def h_interp(interp,in_data):
+    match interp.backend :
+        case 'fortran' :
+            out = np.empty((len(in_data),)+interp.dim2,dtype=np.float32)
+            for kz in range(len(in_data)):
+                interp.h_interp(in_data[kz],out[kz])
+            return out
+        case 'numpy' :
+            return interp.h_interp_np(in_data)
+
+def write_data(convert,fname,odata):
+    #--- records are written by the writer thread of 'CONVERT' (all of them are written before closing)
+    fout    = open(fname,'wb')
+    convert.write_data(fout,2,odata)
+    convert.close(fout,fname)
+
+def run_case(wdir,resol,backend,workers,nz,gres,nlev,ymdh):
+    #--- directories of one case (GLORYS12v1 data are shared by all cases)
+    tdir    = f'{wdir}/COCO{resol}'
+    for dname in ['GRID','long-run','init'] :
+        os.makedirs(f'{tdir}/data/{dname}',exist_ok=True)
+    os.makedirs(f'{wdir}/GLORYS12v1',exist_ok=True)
+    if not os.path.islink(f'{tdir}/data/GLORYS12v1') :
+        os.symlink('../../GLORYS12v1',f'{tdir}/data/GLORYS12v1')
+    mk_coco(tdir,resol,nz,ymdh)
+    rname   = f'{wdir}/raw_{gres}_{nlev}.nc'
+    mk_raw(rname,gres,nlev)
+
+    #--- each stage of 'driver.py' (levels are processed one by one in the stages of the interpolation)
+    stages  = STAGES()
+    now     = datetime.strptime(ymdh,'%Y%m%d%H')
+    dl      = download.GLORYS12v1(f'{wdir}/GLORYS12v1/',now)
+    stages.run('download.modify_data',modify_all,dl,rname)
+    header  = stages.run('HEADER',HEADER,f'{tdir}/data/long-run/',ymdh)
+    coco    = stages.run('COCO',COCO,f'{tdir}/data/GRID/',header)
+    glorys  = stages.run('GLORYS12v1',GLORYS12v1,f'{tdir}/data/GLORYS12v1/',ymdh)
+    lut     = stages.run('LUT',LUT,coco,glorys)
+    interp  = stages.run('INTERP',INTERP,coco,glorys,lut,backend,workers)
+    with nc.Dataset(dl.ofname,'r') as fin :
+        in_data = stages.run('read',lut.window.read,fin.variables['to'],0,interp.dim3_1[0])
+    filled  = stages.run('remove_undef',remove_undef,interp,in_data)
+    h_data  = stages.run('h_interp',h_interp,interp,filled)
+    v_data  = stages.run('v_interp',interp.vremap.main,h_data)
+    del in_data, filled, h_data
+
+    #--- output & all stages of INIT (LUT is cached in the first CONVERT)
+    convert = stages.run('CONVERT',CONVERT,tdir,ymdh,ymdh,backend,workers)
+    stages.run('write_data',write_data,convert,f'{tdir}/data/init/to_{ymdh}.gt3',v_data)
+    stages.run('INIT',convert.INIT)
+    if interp.pool is not None :    interp.pool.shutdown()
+
+    return {'resol'     :   resol,\
+            'backend'   :   backend,\
+            'workers'   :   workers,\
+            'coco'      :   [coco.nx,coco.ny,coco.nz],\
+            'glorys'    :   [glorys.nx,glorys.ny,glorys.nz],\
+            'window'    :   [lut.window.nx,lut.window.ny],\
+            'stages'    :   stages.result,\
+            'total'     :   round(sum(stage['time'] for stage in stages.result.values()),4),\
+            'peak_rss_mb':  round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024,1)}
+
+if __name__=='__main__' :
+    parser  = argparse.ArgumentParser(description='*** end-to-end benchmark with synthetic grids & GLORYS12v1-like data ***')
+    parser.add_argument('--resol',type=str,nargs='+',default=['100','025','010'],choices=['100','025','010'],help='COCO resolutions (default : 100 025 010)')
+    parser.add_argument('--backend',type=str,nargs='+',default=['fortran'],choices=['fortran','numpy'],help='interpolation backends (default : fortran)')
+    parser.add_argument('--workers','-W',type=int,default=1,help='number of threads for interpolation in INIT (default : 1)')
+    parser.add_argument('--nz',type=int,default=62,help='number of COCO levels (default : 62)')
+    parser.add_argument('--gres',type=int,default=12,help='GLORYS12v1-like grids per degree (default : 12)')
+    parser.add_argument('--nlev',type=int,default=12,help='number of GLORYS12v1-like levels (default : 12, 50 in GLORYS12v1)')
+    parser.add_argument('--wdir',type=str,default=ndir+'/bench/data',help='directory of synthetic data (reused in later runs)')
+    parser.add_argument('--out','-o',type=str,default='bench_pipeline.json',help='output JSON file (default : bench_pipeline.json)')
+    args    = parser.parse_args()
+
+    #--- build 'sub/mod_interp.f90' (only once for each version)
+    if 'fortran' in args.backend and build_mytool() is None :  exit('STOP: mod_interp.f90 is not built')
+
+    #--- each case runs in a new process (peak RSS is measured for each case)
+    ymdh    = '2020070100'
+    wdir    = os.path.abspath(args.wdir)
+    cases   = []
+    for resol in args.resol :
+        for backend in args.backend :
+            with ProcessPoolExecutor(max_workers=1,mp_context=mp.get_context('spawn')) as pool :
+                case    = pool.submit(run_case,wdir,resol,backend,args.workers,args.nz,args.gres,args.nlev,ymdh).result()
+            cases.append(case)
+            print(f'COCO{resol} {case["coco"][0]}x{case["coco"][1]}x{case["coco"][2]}, '\
+                  f'window {case["window"][0]}x{case["window"][1]}x{case["glorys"][2]}, {backend}')
+            print(f'{"stage":>22} {"time [s]":>10} {"peak RSS [MB]":>14}')
+            for name, stage in case['stages'].items() :
+                print(f'{name:>22} {stage["time"]:>10.3f} {stage["peak_rss_mb"]:>14.1f}')
+
+    #--- machine-readable results
+    try :
+        commit  = sub.run(['git','-C',ndir,'rev-parse','HEAD'],capture_output=True,text=True).stdout.strip()
+    except FileNotFoundError :
+        commit  = ''
+    result  = { 'date'      :   datetime.now().isoformat(timespec='seconds'),\
+                'commit'    :   commit,\
+                'host'      :   platform.node(),\
+                'python'    :   platform.python_version(),\
+                'numpy'     :   np.__version__,\
+                'cpu_count' :   os.cpu_count(),\
+                'settings'  :   vars(args),\
+                'cases'     :   cases }
+    with open(args.out,'w') as fout :
+        json.dump(result,fout,indent=1)
+    print(f'finished making {args.out}')
@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from types  import SimpleNamespace
+
+ndir    = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ndir+'/sub')
+from common         import LUT
+from interpolation  import INTERP, build_mytool
+
+def mk_grids(resol,nx,ny,nz):
+    #--- COCO-like curvilinear grid (longitude is slightly distorted)
+    dres    = int(resol)/100
+    nx      = nx if nx else int(360/dres)
+    ny      = ny if ny else int(170/dres)
+    jj, ii  = np.meshgrid(np.arange(ny),np.arange(nx),indexing='ij')
+    lon     = (ii+0.5)*360/nx+0.2*dres*np.sin(jj/37)
+    lat     = -78+(jj+0.5)*168/ny+0.1*dres*np.cos(ii/53)
+    coco    = SimpleNamespace(lon=lon,lat=lat,lev=np.linspace(1,6000,nz),nx=nx,ny=ny,nz=nz)
+
+    #--- GLORYS12v1 grid (0 - 360E & 90S - 90N, 1/12 degree)
+    glon    = np.arange(4320)/12
+    glat    = np.linspace(-90,90,2161)
+    glev    = np.geomspace(0.5,5900,50)
+    glorys  = SimpleNamespace(lon=glon,lat=glat,lev=glev,nx=len(glon),ny=len(glat),nz=len(glev))
+
+    return coco, glorys
+
+def mk_level(glorys,nlev):
+    #--- one GLORYS12v1-like level (land is masked) repeated for all levels without copies
+    lon, lat    = np.meshgrid(np.radians(glorys.lon),np.radians(glorys.lat))
+    var         = (20*np.cos(lat)+np.sin(3*lon)).astype(np.float32)
+    land        = (np.sin(4*lon)*np.cos(3*lat)>0.5)|(lat<np.radians(-78))|(lat>np.radians(89))
+    return np.ma.masked_array(\
+        np.broadcast_to(var,(nlev,)+var.shape),\
+        mask=np.broadcast_to(land,(nlev,)+land.shape))
+
+if __name__=='__main__' :
+    parser  = argparse.ArgumentParser(description='*** benchmark of thread-parallel horizontal interpolation ***')
+    parser.add_argument('--resol',type=str,default='010',choices=['100','025','010'],help='COCO resolution (default : 010)')
+    parser.add_argument('--nx',type=int,default=0,help='number of COCO grids in longitude (default : 360/resolution)')
+    parser.add_argument('--ny',type=int,default=0,help='number of COCO grids in latitude (default : 170/resolution)')
+    parser.add_argument('--nlev',type=int,default=49,help='number of GLORYS12v1 levels (default : 49)')
+    parser.add_argument('--backend',type=str,default='fortran',choices=['fortran','numpy'],help='interpolation backend (default : fortran)')
+    parser.add_argument('--workers',type=int,nargs='+',default=None,help='numbers of threads (default : 1, 2, 4, ... up to the core count)')
+    args    = parser.parse_args()
+
+    #--- build 'sub/mod_interp.f90' (only once for each version)
+    if args.backend=='fortran' and build_mytool() is None :  exit('STOP: mod_interp.f90 is not built')
+
+    ncore   = os.cpu_count()
+    workers = args.workers if args.workers else [2**ii for ii in range(int(np.log2(ncore))+1)]
+    coco, glorys    = mk_grids(args.resol,args.nx,args.ny,62)
+    lut     = LUT(coco,glorys)
+    # GLORYS12v1 grids in the window covering COCO grids
+    in_data = mk_level(lut.window,args.nlev)
+    print(f'COCO {coco.nx}x{coco.ny}, GLORYS12v1 {lut.window.nx}x{lut.window.ny}x{args.nlev}, {args.backend}, {ncore} cores')
+
+    #--- remove_undef & h_interp for all levels
+    print(f'{"workers":>8} {"time [s]":>10} {"speedup":>8} {"efficiency":>10}')
+    for nw in workers :
+        interp  = INTERP(coco,glorys,lut,args.backend,nw)
+        out     = np.zeros((args.nlev,coco.ny,coco.nx),dtype=np.float32)
+        stime   = time.perf_counter()
+        for future in interp.h_slab(in_data,out) :
+            future.result()
+        etime   = time.perf_counter()-stime
+        if nw==workers[0] : base = etime
+        # speedup & efficiency relative to the first number of threads
+        print(f'{nw:>8} {etime:>10.3f} {base/etime:>8.2f} {base/etime*workers[0]/nw:>10.2f}')
+        if interp.pool is not None :    interp.pool.shutdown()
@@ -1,54 +1,163 @@
 import os
 import sys
+import atexit
 import argparse
-import subprocess as sub
 from datetime   import datetime, timedelta
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from sub    import download, mk_data
+from sub    import download, mk_data, scheduler
+# spans of all modules in sub/ (imported with sub/ in the path)
+sys.path.append(os.path.dirname(os.path.abspath(__file__))+'/sub')
+import spans
+import serve
+from interpolation  import build_mytool
 
 if __name__=='__main__' :
+    #--- long-lived server with warm grids & interpolation tables, and its client
+    # python driver.py serve (--socket [file]) ... : run the server (jobs are run one by one)
+    # python driver.py submit [stime ...] (--wait) ... / status ([id]) / shutdown : requests to the server
+    if len(sys.argv)>1 and sys.argv[1] in ['serve','submit','status','shutdown'] :
+        serve.main(os.path.dirname(os.path.abspath(__file__)),sys.argv[1],sys.argv[2:])
+        exit()
+
     parser  = argparse.ArgumentParser(description='*** make data for NICOCO-initialization ***')
-    parser.add_argument('stime',type=str,help='initialized time (yyyymmddHH)')
+    parser.add_argument('stime',type=str,nargs='*',help='initialized time(s) (yyyymmddHH)')
+    parser.add_argument('--from',dest='sfrom',type=str,default=None,help='first initialized time of a range (yyyymmddHH)')
+    parser.add_argument('--to',dest='sto',type=str,default=None,help='last initialized time of a range (yyyymmddHH)')
+    parser.add_argument('--every',type=int,default=24,help='interval of initialized times in a range [hours] (default : 24)')
     parser.add_argument('--tspan','-T',type=int,default=10,help='spin-up span [days] (default : 10)')
     parser.add_argument('--check',action='store_true',help='check flag for interpolation')
+    parser.add_argument('--backend',type=str,default='fortran',choices=['fortran','numpy'],help='interpolation backend (default : fortran)')
+    parser.add_argument('--workers','-W',type=int,default=1,help='number of threads for interpolation (default : 1)')
+    parser.add_argument('--nudge-every',dest='nudge_every',type=int,default=0,help='interval of time-interpolated nudging data [hours] (default : 0, only at the end of spin-up)')
+    parser.add_argument('--bottom',action='store_true',help='continue the deepest value of GLORYS12v1 below its bottom in each column')
+    parser.add_argument('--grids',type=str,nargs='+',default=None,metavar='GRID',help='resolutions of COCO made in one pass (e.g. 100 025 010; restart files in data/long-run/GRID/)')
+    parser.add_argument('--depth',type=int,default=2,help='number of levels read ahead & records waiting to be written (default : 2, 0 : not pipelined)')
+    parser.add_argument('--tile',type=float,default=0,help='limit of the buffers of interpolation in the tiled mode [GB] (default : 0, not tiled)')
+    parser.add_argument('--cache-size',dest='csize',type=float,default=0,help='limit of the cache of interpolated data in data/cache/ [GB] (default : 0, not used)')
+    parser.add_argument('--compress',action='store_true',help='store downloaded data with zlib compression (chunked by level)')
+    parser.add_argument('--pack',action='store_true',help='store downloaded data as int16 with scale_factor & add_offset')
+    parser.add_argument('--stream',action='store_true',help='convert data level by level from the lazily opened dataset (no temporary file)')
+    parser.add_argument('--download-jobs',dest='djobs',type=int,default=4,help='number of processes for downloading data of all times (default : 4)')
+    parser.add_argument('--jobs','-j',type=int,default=1,help='number of processes for download, interpolation & output tasks (default : 1)')
+    parser.add_argument('--profile',type=str,nargs='?',const='',default=None,metavar='TRACE',help='print time, bytes & peak allocation of each stage (Chrome trace is written in TRACE if given)')
     args    = parser.parse_args()
-    symdh   = args.stime
+    symdhs  = args.stime
     tspan   = args.tspan
     check   = args.check
+    backend = args.backend
+    workers = args.workers
+    jobs    = args.jobs
+    zlib    = args.compress
+    pack    = args.pack
+    stream  = args.stream
+    bottom  = args.bottom
+    nevery  = args.nudge_every
+    csize   = args.csize
+    depth   = args.depth
+    tile    = args.tile
+    djobs   = args.djobs
+    grids   = args.grids
+
+    #--- profile of each stage (printed at the end of the run)
+    if args.profile is not None :
+        spans.enable()
+        atexit.register(spans.report,args.profile)
 
-    if len(symdh)!=10   : exit('STOP: \'stime\' must be yyyymmddHH')
+    #--- initialized times (list and/or range)
+    if (args.sfrom is None)!=(args.sto is None) :   exit('STOP: \'--from\' and \'--to\' must be set together')
+    if args.sfrom is not None :
+        symdhs  = symdhs+[args.sfrom,args.sto]
+    for symdh in symdhs :
+        if len(symdh)!=10   : exit('STOP: \'stime\' must be yyyymmddHH')
+    if len(symdhs)==0   : exit('STOP: \'stime\' or \'--from\' & \'--to\' must be set')
+    if tile>0 and (nevery>0 or grids is not None) : exit('STOP: \'--tile\' cannot be used with \'--nudge-every\' or \'--grids\'')
 
     ndir    = os.path.dirname(os.path.abspath(__file__))
-    time1   = datetime.strptime(symdh,'%Y%m%d%H')
-    time2   = time1+timedelta(days=tspan)
-    ymdh1   = datetime.strftime(time1,'%Y%m%d%H')
-    ymdh2   = datetime.strftime(time2,'%Y%m%d%H')
-
-    #--- compile 'sub/mod_interp.f90'
-    prgname = ndir+'/sub/mod_interp.f90'
-    exename = ndir+'/sub/mod_interp.so'
-    if not os.path.isfile(exename) :
-        sub.run(['gfortran','-Ofast','-O3','-shared','-fPIC',prgname,'-o',exename])
-
-    #--- download necessary data
-    # download.GLORYS12v1(topdir,now).main()
+    time1s  = [datetime.strptime(symdh,'%Y%m%d%H') for symdh in args.stime]
+    if args.sfrom is not None :
+        now = datetime.strptime(args.sfrom,'%Y%m%d%H')
+        while now<=datetime.strptime(args.sto,'%Y%m%d%H') :
+            time1s.append(now)
+            now += timedelta(hours=args.every)
+    time1s  = sorted(set(time1s))
+    time2s  = [time1+timedelta(days=tspan) for time1 in time1s]
+    ymdh1s  = [datetime.strftime(time1,'%Y%m%d%H') for time1 in time1s]
+    ymdh2s  = [datetime.strftime(time2,'%Y%m%d%H') for time2 in time2s]
+
+    #--- build 'sub/mod_interp.f90' only once for each version (not necessary for numpy backend)
+    # the shared object is cached in sub/build/ (also made by 'make build')
+    if backend=='fortran' and build_mytool() is None :
+        print('WARN: numpy backend is used')
+        backend = 'numpy'
+
+    #--- region of GLORYS12v1 data covering COCO grids (west, east, south, north)
+    # all longitudes are downloaded if regions of resolutions are different in longitude
+    ldirs   = [ndir+'/data/long-run/'] if grids is None else [f'{ndir}/data/long-run/{grid}/' for grid in grids]
+    bboxes  = [mk_data.COCO(ndir+'/data/GRID/',mk_data.HEADER(ldir,ymdh1s[0])).get_bbox() for ldir in ldirs]
+    bbox    = bboxes[0]
+    if len(bboxes)>1 :
+        west, east  = bbox[:2] if all([box[:2]==bbox[:2] for box in bboxes]) else (None,None)
+        bbox    = (west,east,min([box[2] for box in bboxes]),max([box[3] for box in bboxes]))
+
+    #--- run all tasks with processes (download, interpolation of each variable & output of each file)
+    # scheduler.SCHEDULER(topdir,ymdhs,tspan=10,backend='fortran',jobs=1,zlib=False,bbox=None,bottom=False,csize=0,pack=False,stream=False).main(uv_on=True,dt=72,check=False,every=0)
+    #   jobs    : number of processes
+    if jobs>1 and grids is not None :
+        print('WARN: \'--grids\' is made without processes')
+    elif jobs>1 :
+        if tile>0 : print('WARN: \'--tile\' is not used with processes')
+        scheduler.SCHEDULER(ndir,ymdh1s,tspan,backend,jobs,zlib,bbox,bottom,csize,pack,stream).main(check=check,every=nevery)
+        exit()
+
+    #--- download necessary data (data of all times are downloaded & converted with processes)
+    # download.prefetch(topdir,nows,zlib=False,bbox=None,jobs=4,pack=False,stream=False)
+    #   = download.GLORYS12v1(topdir,now,zlib=False,kchunk=0,bbox=None,pack=False,stream=False).main() for each time
     #   topdir  : top-level directory for storing downloaded data
+    #   nows    : list of target times
     #   now     : target time (yyyymmddHH)
-    download.GLORYS12v1(ndir+'/data/GLORYS12v1/',time1).main()
-    download.GLORYS12v1(ndir+'/data/GLORYS12v1/',time2).main()
+    #   zlib    : flag for zlib compression
+    #   kchunk  : number of levels in a chunk (0 : contiguous, or 1 level if compressed)
+    #   bbox    : target region (west, east, south, north; None : global)
+    #   jobs    : number of processes
+    #   pack    : flag for int16 packing (scale_factor & add_offset)
+    #   stream  : flag for streaming conversion (copernicusmarine.open_dataset instead of a temporary file)
+    # daily data from ymdh1 to ymdh2 are necessary for time-interpolated nudging data
+    nows    = set(time1s)|set(time2s) if nevery==0 else set(time1s)
+    if nevery>0 :
+        for ymdh1, ymdh2 in zip(ymdh1s,ymdh2s) :
+            nows    |= set(mk_data.get_days(ymdh1,ymdh2))
+    download.prefetch(ndir+'/data/GLORYS12v1/',nows,zlib,bbox,djobs,pack,stream)
 
     #--- main program
-    # mk_data.CONVERT(topdir,ymdh1,ymdh2)
+    # mk_data.CONVERT(topdir,ymdh1,ymdh2,backend='fortran',workers=1,bottom=False,csize=0,depth=2,tile=0)
+    #   .BATCH(ymdhs,tspan=10,uv_on=True,dt=72,check=False,every=0)
+    #       : INIT & NUDGE for all initialized times (each GLORYS12v1 file is interpolated only once)
+    #   .SERIES(every=6,dt=72,times=None)
+    #       : time-interpolated nudging data from ymdh1 to ymdh2 (blended daily data; times : list of (ymdh1, ymdh2) made together)
     #   .INIT(uv_on=True,check=False)
     #   .NUDGE(dt=72,check=False)
     #       topdir  : directory of this program
+    #       ymdhs   : list of initialized times (yyyymmddHH)
     #       ymdh1   : initialized time (yyyymmddHH)
     #       ymdh2   : initialized time + spin-up time (yyyymmddHH)
+    #       backend : interpolation backend ('fortran' : mod_interp.so, 'numpy' : NumPy & SciPy)
+    #       workers : number of threads for interpolating levels
+    #       bottom  : flag for continuing the deepest value of GLORYS12v1 below its bottom
+    #       csize   : limit of the cache of interpolated data [GB] (0 : not used)
+    #       depth   : number of levels read ahead & records waiting to be written (0 : read, interpolated & written in turn)
+    #       tile    : limit of the buffers of the tiled mode [GB] (0 : not tiled; horizontally interpolated bands are kept in temporary files)
     #       uv_on   : flag for interpolating U & V
     #       check   : flag for checking interpolation (if True, figures are made)
     #       dt      : relaxation time [hours]
-    main    = mk_data.CONVERT(ndir,ymdh1,ymdh2)
-    main.INIT(check=check)
-    main.NUDGE(check=check)
+    #       every   : interval of time-interpolated nudging data [hours] (0 : only at ymdh2)
+    # mk_data.MULTI(topdir,ymdh1,ymdh2,grids,backend='fortran',workers=1,bottom=False,csize=0,depth=2)
+    #   .BATCH(ymdhs,tspan=10,uv_on=True,dt=72,check=False,every=0)
+    #       : same as CONVERT(...).BATCH(...) for all resolutions (each level of GLORYS12v1 data is read & filled only once)
+    #       grids   : resolutions of COCO (data/long-run/[grid]/ -> data/init/[grid]/ & data/nudge/[grid]/)
+    if grids is None :
+        main    = mk_data.CONVERT(ndir,ymdh1s[0],ymdh2s[0],backend,workers,bottom,csize,depth=depth,tile=tile)
+    else :
+        main    = mk_data.MULTI(ndir,ymdh1s[0],ymdh2s[0],grids,backend,workers,bottom,csize,depth)
+    main.BATCH(ymdh1s,tspan,check=check,every=nevery)
 
@@ -0,0 +1,86 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+
+class CACHE :
+    def __init__(self,cdir,limit):
+        #--- cache of interpolated data (cdir : directory of cached data, limit : total size [byte])
+        self.tdir       = f'{cdir}interp/'
+        self.limit      = limit
+        self.version    = 1     # change if interpolated data change with the same settings
+        self.sha1       = {}    # keys of source files (path -> (size & modified time, key))
+        self.lock       = threading.Lock()
+        os.makedirs(self.tdir,exist_ok=True)
+        self.evict()
+
+    def source_key(self,fname,bsize=1<<20):
+        #--- key of a source file without reading the whole file
+        # sha1 in the manifest of 'download.py' (if it is made for the current file),
+        # or path, size, modified time & the first/last blocks (incl. the header of netCDF)
+        fname   = os.path.abspath(fname)
+        stat    = os.stat(fname)
+        ident   = [stat.st_size,stat.st_mtime_ns]
+        if fname in self.sha1 and self.sha1[fname][0]==ident :  return self.sha1[fname][1]
+
+        meta    = {}
+        mname   = os.path.splitext(fname)[0]+'.json'
+        if os.path.isfile(mname) :
+            try :
+                with open(mname,'r') as fin :
+                    meta    = json.load(fin)
+            except ValueError :
+                pass
+        if [meta.get('size'),meta.get('mtime')]==ident and 'sha1' in meta :
+            key     = meta['sha1']
+        else :
+            sha     = hashlib.sha1(json.dumps([fname]+ident).encode())
+            with open(fname,'rb') as fin :
+                sha.update(fin.read(bsize))
+                if stat.st_size>bsize :
+                    fin.seek(max(stat.st_size-bsize,bsize))
+                    sha.update(fin.read(bsize))
+            key     = sha.hexdigest()
+
+        with self.lock :    self.sha1[fname]    = (ident,key)
+        return key
+
+    def key(self,ifname,varname,settings):
+        #--- key : contents of the source file, variable & interpolation settings (incl. COCO grid)
+        items   = [self.version,self.source_key(ifname),varname]+list(settings)
+        return hashlib.sha1(json.dumps(items).encode()).hexdigest()[:24]
+
+    def get(self,key):
+        #--- memory-mapped data (None if not cached); the access time is recorded in mtime
+        fname   = f'{self.tdir}{key}.npy'
+        try :
+            os.utime(fname)
+            return np.load(fname,mmap_mode='r')
+        except (FileNotFoundError,ValueError) :
+            return None
+
+    def put(self,key,data):
+        #--- write into a temporary file, then rename it (safe for concurrent runs)
+        fname   = f'{self.tdir}{key}.npy'
+        tmpname = f'{self.tdir}{key}.tmp{os.getpid()}_{threading.get_ident()}.npy'
+        np.save(tmpname,np.asarray(data,dtype=np.float32))
+        os.replace(tmpname,fname)
+        self.evict()
+
+    def evict(self):
+        #--- remove least recently used data until the total size is within the limit
+        files   = []
+        for entry in os.scandir(self.tdir) :
+            if entry.name.endswith('.npy') and '.tmp' not in entry.name :
+                stat    = entry.stat()
+                files.append((stat.st_mtime_ns,stat.st_size,entry.path))
+        total   = sum(size for _, size, _ in files)
+        for _, size, fname in sorted(files) :
+            if total<=self.limit :  break
+            try :
+                os.remove(fname)
+                print(f'removed {fname} from the cache')
+            except FileNotFoundError :
+                pass
+            total   -= size
@@ -1,8 +1,44 @@
 import os
 import sys
+import json
+import shutil
+import hashlib
 import numpy as np
 import netCDF4 as nc
-import matplotlib.pyplot as plt
+from gtool3 import GT3READER, GT3WRITER
+from spans  import span
+from concurrent.futures import ProcessPoolExecutor
+
+def checksum(fname,bsize=1<<24):
+    #--- sha1 of a file (read in blocks to bound memory)
+    sha = hashlib.sha1()
+    with open(fname,'rb') as fin :
+        for block in iter(lambda: fin.read(bsize),b'') :
+            sha.update(block)
+    return sha.hexdigest()
+
+def axes_key(glorys):
+    #--- key of GLORYS12v1 axes for cached data
+    sha = hashlib.sha1()
+    for axis in [glorys.lon,glorys.lat,glorys.lev] :
+        sha.update(np.ascontiguousarray(axis,dtype='f8').tobytes())
+    return sha.hexdigest()[:16]
+
+def is_global(lon):
+    #--- True if regular longitudes wrap around 360 degrees (tolerance : half a grid, float32 axes are not exact)
+    dlon    = float(lon[1])-float(lon[0])
+    return abs(len(lon)*dlon-360)<0.5*abs(dlon)
+
+def circular_span(occ,halo=0):
+    #--- shortest circular range of bins covering all occupied bins (first bin & number of bins)
+    # None if the range (+ halo bins on both sides) covers all bins
+    nbin    = len(occ)
+    idx     = np.flatnonzero(occ)
+    gaps    = np.diff(np.append(idx,idx[0]+nbin))-1
+    kk      = int(np.argmax(gaps))
+    nspan   = nbin-int(gaps[kk])+2*halo
+    if nspan>=nbin :    return None
+    return int(idx[(kk+1)%len(idx)]-halo)%nbin, nspan
 
 class COCO :
     def __init__(self,ddir,header):
@@ -31,6 +67,7 @@ class COCO :
         fin.close()
 
         #--- object variables
+        self.gname  = gname
         self.lon    = lon
         self.lat    = lat
         self.lev    = z_T
@@ -38,6 +75,22 @@ class COCO :
         self.ny     = ny
         self.nz     = nz
 
+    def get_bbox(self,halo=0.5,dres=0.5):
+        #--- range of COCO grids [degree] (west, east, south, north; west & east are None for all longitudes)
+        nbin    = int(360/dres)
+        occ     = np.zeros(nbin,dtype=bool)
+        occ[(np.mod(self.lon,360)/dres).astype(int)%nbin]   = True
+        south   = max(float(np.min(self.lat))-halo,-90.0)
+        north   = min(float(np.max(self.lat))+halo, 90.0)
+
+        span    = circular_span(occ,int(np.ceil(halo/dres)))
+        if span is None :   return None, None, south, north
+        # longitude of original data is 180W - 180E, so a range crossing 180E is not requested
+        west    = (span[0]*dres+180)%360-180
+        east    = west+span[1]*dres
+        if east>180 :       return None, None, south, north
+        return west, east, south, north
+
 class GLORYS12v1 :
     def __init__(self,ddir,ymdh):
         gname   = f'{ddir}{ymdh[:4]}/uvts_{ymdh}.nc'
@@ -49,7 +102,13 @@ class GLORYS12v1 :
         lon = fin.variables['lon'][:]
         lat = fin.variables['lat'][:]
         lev = fin.variables['lev'][:]
+        # padded grids in the south are implicit in compact files (number of grids in 'npad_south')
+        npad    = int(getattr(fin,'npad_south',0))
         fin.close()
+        # padded latitudes are made with the grid interval (data may not reach the North Pole)
+        if npad>0 :
+            dlat    = (float(lat[-1])-float(lat[0]))/(len(lat)-1)
+            lat     = np.concatenate([(float(lat[0])-dlat*np.arange(npad,0,-1)).astype(lat.dtype),lat])
 
         #--- object variables
         self.lon    = lon
@@ -58,14 +117,106 @@ class GLORYS12v1 :
         self.nx     = len(lon)
         self.ny     = len(lat)
         self.nz     = len(lev)
+        self.npad   = npad
+
+class WINDOW :
+    def __init__(self,glorys,ix0,nx,jy0,ny,periodic=False):
+        #--- GLORYS12v1 grids in a window (ix0+nx can exceed glorys.nx : wrapped around 360E)
+        idx = ix0+np.arange(nx)
+        lon = np.asarray(glorys.lon)[idx%glorys.nx]
+
+        #--- object variables (longitude is continuous in the window)
+        self.lon        = np.where(idx>=glorys.nx,lon+360,lon)
+        self.lat        = np.asarray(glorys.lat)[jy0:jy0+ny]
+        self.lev        = glorys.lev
+        # grid intervals of the whole data (used for bilinear weights)
+        self.dlon       = float(glorys.lon[1])-float(glorys.lon[0])
+        self.dlat       = float(glorys.lat[1])-float(glorys.lat[0])
+        self.nx         = nx
+        self.ny         = ny
+        self.nz         = glorys.nz
+        self.ix0        = ix0
+        self.jy0        = jy0
+        self.gnx        = glorys.nx
+        self.npad       = getattr(glorys,'npad',0)
+        self.periodic   = periodic
+
+    def wrap(self,lon):
+        #--- longitude in the range of the window
+        lon0    = float(self.lon[0])
+        return lon0+np.mod(lon-lon0,360)
+
+    def read(self,var,kz1,kz2):
+        #--- levels of a netCDF variable in the window (two parts if wrapped around 360E)
+        # implicit padded grids (not stored) are undef
+        npad    = min(max(self.npad-self.jy0,0),self.ny)
+        jy  = slice(self.jy0+npad-self.npad,self.jy0+self.ny-self.npad)
+        ix2 = self.ix0+self.nx
+        if ix2<=self.gnx :
+            data    = var[0,kz1:kz2,jy,self.ix0:ix2]
+        else :
+            data    = np.ma.concatenate([\
+                var[0,kz1:kz2,jy,self.ix0:],\
+                var[0,kz1:kz2,jy,:ix2-self.gnx]],axis=-1)
+        if npad==0 :    return data
+        pad = np.ma.masked_all(data.shape[:-2]+(npad,data.shape[-1]),dtype=data.dtype)
+        return np.ma.concatenate([pad,data],axis=-2)
 
 class LUT :
-    def __init__(self,coco,glorys):
+    def __init__(self,coco,glorys,cdir=None,halo=2,cover=None):
+        #--- reuse the cached window, table & weights (cdir : directory of COCO grid data)
+        # cover : COCO grids covered by the window (None : coco only; the same window is shared by all of them)
+        cover   = [coco] if cover is None else cover
+        if cdir is not None :
+            tdir    = self.cache_dir(cdir,coco,glorys,halo,cover)
+            if self.load(tdir,coco,glorys) :    return
+
+        self.set_window(cover,glorys,halo)
+        self.set_table(coco,self.window)
+        self.set_weight(coco,self.window)
+        if cdir is not None :   self.save(tdir,coco)
+
+    def set_window(self,cover,glorys,halo=2):
+        #--- the smallest window of GLORYS12v1 grids covering COCO grids of all resolutions in 'cover' (+ halo grids)
+        cyclic  = is_global(glorys.lon)
+        lon0    = float(glorys.lon[0])
+        lon     = np.concatenate([coco.lon.ravel() for coco in cover])
+        lat     = np.concatenate([coco.lat.ravel() for coco in cover])
+        ix1     = np.searchsorted(glorys.lon,lon0+np.mod(lon-lon0,360),side='left')-1
+        jy1     = np.searchsorted(glorys.lat,lat,side='left')-1
+
+        #--- check the domain of GLORYS12v1 data
+        if jy1.min()<0 or (jy1.max()>=glorys.ny-1 and glorys.lat[-1]<90) or \
+           (not cyclic and (ix1.min()<0 or ix1.max()>=glorys.nx-1)) :
+            exit('STOP: COCO grids are out of GLORYS12v1 data')
+
+        #--- latitude
+        jy0 = max(int(jy1.min())-halo,0)
+        ny  = min(int(jy1.max())+1+halo,glorys.ny-1)-jy0+1
+
+        #--- longitude (connect 0 ~ 360 if GLORYS12v1 data is global)
+        occ = np.zeros(glorys.nx,dtype=bool)
+        occ[ix1%glorys.nx]      = True
+        occ[(ix1+1)%glorys.nx]  = True
+        span    = circular_span(occ,halo) if cyclic else None
+        # global COCO grids (the gap is narrower than two COCO grids) use all longitudes wrapped around
+        dcoco   = max([360/coco.nx for coco in cover])
+        if not cyclic :
+            ix0 = max(int(ix1.min())-halo,0)
+            nx  = min(int(ix1.max())+1+halo,glorys.nx-1)-ix0+1
+        elif span is None or (glorys.nx-span[1])*abs(float(glorys.lon[1])-float(glorys.lon[0]))<2*dcoco :
+            ix0, nx = 0, glorys.nx
+        else :
+            ix0, nx = span
+
+        self.window = WINDOW(glorys,ix0,nx,jy0,ny,bool(cyclic and nx==glorys.nx))
+
+    def set_table(self,coco,glorys):
         #--- get latitude & longitude in reanalysis data & COCO
-        lon_in  = glorys.lon        # [glorys.nx]
-        lat_in  = glorys.lat        # [glorys.ny]
-        lon_out = coco.lon.ravel()  # [coco.nx*coco.ny]
-        lat_out = coco.lat.ravel()  # [coco.nx*coco.ny]
+        lon_in  = glorys.lon                    # [glorys.nx]
+        lat_in  = glorys.lat                    # [glorys.ny]
+        lon_out = glorys.wrap(coco.lon).ravel() # [coco.nx*coco.ny]
+        lat_out = coco.lat.ravel()              # [coco.nx*coco.ny]
 
         #--- search the nearest grid index in longitude
         # glorys.lon[0] = 0.0
@@ -82,7 +233,81 @@ class LUT :
         # coco.lat[0]    > -90.0
         jy2 = np.where(jy2>=glorys.ny,jy1,jy2)
 
-        self.lut    = np.stack([ix1,ix2,jy1,jy2]).reshape(4,coco.ny,coco.nx)
+        self.lut    = np.stack([ix1,ix2,jy1,jy2]).reshape(4,coco.ny,coco.nx).astype(np.int32)
+
+    def set_weight(self,coco,glorys):
+        #--- bilinear weights for (ix1,jy1), (ix1,jy2), (ix2,jy1), (ix2,jy2)
+        lon_in  = np.array(glorys.lon,dtype='f8')
+        lat_in  = np.array(glorys.lat,dtype='f8')
+        ix1, ix2, jy1, jy2  = self.lut
+        dlon    = glorys.dlon
+        dlat    = glorys.dlat
+
+        #--- distances [degree]
+        lon_out = glorys.wrap(coco.lon)
+        dlon_1c = lon_out-lon_in[ix1]
+        dlon_2c = lon_in[ix2]-lon_out
+        dlon_2c = np.where(dlon_2c<0,dlon_2c+360,dlon_2c)
+        dlat_1c = coco.lat-lat_in[jy1]
+        dlat_2c = lat_in[jy2]-coco.lat
+
+        self.wgt    = np.stack([\
+            dlon_2c*dlat_2c,\
+            dlon_2c*dlat_1c,\
+            dlon_1c*dlat_2c,\
+            dlon_1c*dlat_1c])/(dlon*dlat)
+        self.wgt    = self.wgt.astype(np.float32)
+
+    def cache_dir(self,cdir,coco,glorys,halo=2,cover=[]):
+        #--- key : GLORYS12v1 axes, halo & other COCO grids in the window (the COCO grid file is checked in 'load')
+        gname   = os.path.basename(coco.gname).replace('.stream','')
+        others  = sorted({os.path.basename(grid.gname) for grid in cover}-{os.path.basename(coco.gname)})
+        wkey    = '_w'+hashlib.sha1(' '.join(others).encode()).hexdigest()[:8] if len(others)>0 else ''
+        # v2 : global COCO grids use all longitudes wrapped around
+        return f'{cdir}cache/lut_{gname}_{axes_key(glorys)}_h{halo}{wkey}_v2/'
+
+    def load(self,tdir,coco,glorys):
+        if not os.path.isfile(tdir+'meta.json') :   return False
+        with open(tdir+'meta.json','r') as fin :
+            meta    = json.load(fin)
+        self.window = WINDOW(glorys,*meta['window'])
+
+        #--- compare the contents only if the grid file was touched
+        stat    = os.stat(coco.gname)
+        if [stat.st_size,stat.st_mtime_ns]!=[meta['size'],meta['mtime']] :
+            if checksum(coco.gname)!=meta['sha1'] :
+                print(f'WARN: {tdir} is stale and removed')
+                shutil.rmtree(tdir,ignore_errors=True)
+                return False
+            self.write_meta(tdir,coco,meta['sha1'])
+
+        self.lut    = np.load(tdir+'lut.npy',mmap_mode='r')
+        self.wgt    = np.load(tdir+'wgt.npy',mmap_mode='r')
+        return True
+
+    def save(self,tdir,coco):
+        #--- write into a temporary directory, then rename it (safe for concurrent runs)
+        tmpdir  = tdir.rstrip('/')+f'.tmp{os.getpid()}/'
+        os.makedirs(tmpdir,exist_ok=True)
+        np.save(tmpdir+'lut.npy',self.lut)
+        np.save(tmpdir+'wgt.npy',self.wgt)
+        self.write_meta(tmpdir,coco,checksum(coco.gname))
+        try :
+            os.rename(tmpdir,tdir)
+            print(f'finished making {tdir}')
+        except OSError :
+            shutil.rmtree(tmpdir,ignore_errors=True)
+
+    def write_meta(self,tdir,coco,sha1):
+        stat    = os.stat(coco.gname)
+        meta    = { 'gname' :   os.path.abspath(coco.gname),\
+                    'size'  :   stat.st_size,\
+                    'mtime' :   stat.st_mtime_ns,\
+                    'sha1'  :   sha1,\
+                    'window':   [int(self.window.ix0),int(self.window.nx),\
+                                 int(self.window.jy0),int(self.window.ny),bool(self.window.periodic)] }
+        with open(tdir+'meta.json','w') as fout :
+            json.dump(meta,fout,indent=1)
 
 class HEADER :
     def __init__(self,ddir,ymdh):
@@ -97,36 +322,21 @@ class HEADER :
             'MEMO8', 'MEMO9','MEMO10', 'CDATE', 'CSIGN', 'MDATE', 'MSIGN',  'SIZE',\
             ]
         self.length = len(self.name)
+        self.writer = GT3WRITER()
         self.get_all(f'{ddir}coco_restart_{ymdh}.gt3')
 
     def get_all(self,tfname):
-        self.value  = []
-
-        fin = open(tfname,'rb')
-        for ii in range(24):
-            #--- header
-            top = np.fromfile(fin,dtype='>i4',count=1)[0]
-            tmp = np.fromfile(fin,dtype='>i1',count=np.int32(top))
-            bot = np.fromfile(fin,dtype='>i4',count=1)[0]
-            assert top==bot
-            res = [''.join([chr(jj) for jj in tmp[jj*16:(jj+1)*16]]) for jj in range(self.length)]
-
-            #--- data
-            top = np.fromfile(fin,dtype='>i4',count=1)[0]
-            tmp = np.fromfile(fin,dtype='>f8',count=int(top/8))
-            bot = np.fromfile(fin,dtype='>i4',count=1)[0]
-            assert top==bot
-
-            self.value.append(res)
-        fin.close()
+        #--- headers only (data are read lazily through 'reader')
+        with span('HEADER.get_all',file=os.path.basename(tfname)) :
+            self.reader = GT3READER(tfname)
+        self.value  = [record['header'] for record in self.reader.records]
 
-    def write(self,tfout,num):
-        out_val = self.value[num]
+    def write(self,tfout,num,out_val=None):
+        #--- out_val : header values copied before (default : current values)
+        out_val = self.value[num] if out_val is None else out_val
 
         #--- write header to output file
-        np.array([int(self.length*16)],dtype='>i4').tofile(tfout)
-        np.array([ord(s) for h in out_val for s in h],dtype='>i1').tofile(tfout)
-        np.array([int(self.length*16)],dtype='>i4').tofile(tfout)
+        self.writer.write_header(tfout,out_val)
 
         #--- write header on the terminal
         print('')
@@ -139,69 +349,106 @@ class HEADER :
             print(f'   {i+1: >2} {head1: >5}  ({val1})     {i+33: >2} {head2: >6}  ({val2})')
 
 class CHECK :
-    def __init__(self,ifname,ofname,varname,grid1,grid2,tlev):
-        #--- figure setting
-        vmin        = { 'to':0,  'so':10 }[varname]
-        vmax        = { 'to':30, 'so':40 }[varname]
-        self.pdict  = { 'vmin'  :   vmin,\
-                        'vmax'  :   vmax,\
-                        's'     :   20 }
-
-        #--- original data
-        fin = nc.Dataset(ifname,'r')
-        var = fin.variables[varname][0]
-        fin.close()
+    def __init__(self,ifname,ofname,varname,grid1,grid2,tlev,dres=0):
+        #--- figure setting (dres : resolution of the raster [degree], 0 : twice the coarser grids, at least 0.25)
+        self.varname    = varname
+        self.vmin       = { 'to':0,  'so':10 }[varname]
+        self.vmax       = { 'to':30, 'so':40 }[varname]
+        self.dres       = self.resolution(grid1,grid2,dres)
+        self.nlon       = int(np.ceil(360/self.dres))
+        self.nlat       = int(np.ceil(180/self.dres))
 
+        #--- original data (target level only)
+        fin = nc.Dataset(ifname,'r')
         self.grid1  = grid1
-        self.var1   = var[np.argmin(abs(grid1.lev-tlev))]
-
-        #--- created data
-        fin = open(ofname,'rb')
-        while True :
-            # header
-            top = np.fromfile(fin,dtype='>i4',count=1)[0]
-            tmp = np.fromfile(fin,dtype='>i1',count=np.int32(top))
-            bot = np.fromfile(fin,dtype='>i4',count=1)[0]
-            assert top==bot
-
-            # data size
-            header  = [''.join([chr(ii) for ii in tmp[jj*16:(jj+1)*16]]) for jj in range(64)]
-            nx      = int(header[30])
-            ny      = int(header[33])
-            nz      = int(header[36])
-
-            # data
-            top = np.fromfile(fin,dtype='>i4',count=1)[0]
-            var = np.fromfile(fin,dtype='>f8',count=int(top/8)).reshape(nz,ny,nx)
-            bot = np.fromfile(fin,dtype='>i4',count=1)[0]
-            assert top==bot
-            if header[2].replace(' ','')==varname.upper()   : break
+        kz          = int(np.argmin(abs(grid1.lev-tlev)))
+        self.var1   = WINDOW(grid1,0,grid1.nx,0,grid1.ny).read(fin.variables[varname],kz,kz+1)[0]
         fin.close()
 
+        #--- created data (target level only; the record is found from the index of the file)
         self.grid2  = grid2
-        self.var2   = var[np.argmin(abs(grid2.lev-tlev))]
-
-    def plot(self,tax,pvar,grid,title,dskip):
-        pvar        = np.ma.masked_array(pvar,mask=(pvar==-32767))
-        vmin, vmax  = np.min(pvar), np.max(pvar)
-
-        lon = grid.lon
-        lat = grid.lat
-        if np.ndim(lon)==1  :   lon, lat = np.meshgrid(lon,lat)
-        lon = lon[::dskip,::dskip]
-        lat = lat[::dskip,::dskip]
-        var = pvar[::dskip,::dskip]
-        tax.set_title(f'{title}\n(min={vmin:.2f}, max={vmax:.2f})',fontsize=24)
-        tax.set_xlim(0,360)
-        tax.set_ylim(-90,90)
-        cs  = tax.scatter(lon,lat,c=var,**self.pdict)
-        plt.colorbar(cs,ax=tax,location='right')
-
-    def main(self,figname,dskip=10):
-        fig, axs    = plt.subplots(nrows=2,figsize=(12,16),dpi=100)
-        fig.suptitle(f'scatter plot (interval={dskip})',fontsize=32)
-        self.plot(axs[0],self.var1,self.grid1,'original data; land is masked',dskip)
-        self.plot(axs[1],self.var2,self.grid2,'interpolated data; land is not masked',dskip)
-        plt.savefig(figname,bbox_inches='tight',pad_inches=0.1)
-        print(f'finished making {figname}')
+        self.var2   = GT3READER(ofname)[varname.upper()][np.argmin(abs(grid2.lev-tlev))]
+
+    def resolution(self,grid1,grid2,dres=0):
+        #--- cells as fine as curvilinear grids are left empty where grids are sparser than the average,
+        # and dres is rounded to divide 360 degrees (no narrow column at the date line)
+        dres    = dres if dres>0 else max(0.25,2*self.spacing(grid1),2*self.spacing(grid2))
+        return 360/max(1,int(np.floor(360/dres+1e-6)))
+
+    def spacing(self,grid):
+        #--- typical grid interval [degree]
+        if np.ndim(grid.lon)==1 :
+            return max(abs(float(grid.lon[1]-grid.lon[0])),abs(float(grid.lat[1]-grid.lat[0])))
+        return max(np.ptp(grid.lon)/grid.lon.shape[1],np.ptp(grid.lat)/grid.lat.shape[0])
+
+    def raster(self,pvar,valid,grid):
+        #--- average of data in each cell of the raster (scipy is imported only for figures)
+        from scipy  import sparse
+        ix  = (np.mod(grid.lon,360)/self.dres).astype(np.int64)%self.nlon
+        jy  = np.clip(((grid.lat+90)/self.dres).astype(np.int64),0,self.nlat-1)
+        var = np.where(valid,pvar,0.0)
+        if np.ndim(grid.lon)==1 :
+            #--- regular grids : sums over cells with sparse matrices (2-D coordinates are not made)
+            pi      = sparse.csr_matrix((np.ones(len(ix)),(ix,np.arange(len(ix)))),shape=(self.nlon,len(ix)))
+            pj      = sparse.csr_matrix((np.ones(len(jy)),(jy,np.arange(len(jy)))),shape=(self.nlat,len(jy)))
+            total   = pj@(pi@var.T).T
+            count   = pj@(pi@valid.T.astype(np.float64)).T
+        else :
+            idx     = (jy*self.nlon+ix).ravel()
+            total   = np.bincount(idx,weights=var.ravel(),minlength=self.nlat*self.nlon).reshape(self.nlat,self.nlon)
+            count   = np.bincount(idx,weights=valid.ravel(),minlength=self.nlat*self.nlon).reshape(self.nlat,self.nlon)
+        return np.ma.masked_array(total/np.maximum(count,1),mask=(count==0))
+
+    def figure(self,diff=True):
+        #--- panels of the figure (original & created data, and their difference if diff)
+        valid1  = ~np.ma.getmaskarray(self.var1)&np.isfinite(np.ma.getdata(self.var1))
+        valid2  = np.asarray(self.var2)!=-32767
+        var1    = np.ma.getdata(self.var1)
+        var2    = np.asarray(self.var2)
+        ras1    = self.raster(var1,valid1,self.grid1)
+        ras2    = self.raster(var2,valid2,self.grid2)
+        minmax  = lambda var, valid: f'min={np.min(var[valid]):.2f}, max={np.max(var[valid]):.2f}'
+        panels  = [ {'data':ras1,'title':f'original data; land is masked\n({minmax(var1,valid1)})',\
+                     'vmin':self.vmin,'vmax':self.vmax,'cmap':'viridis'},\
+                    {'data':ras2,'title':f'interpolated data; land is not masked\n({minmax(var2,valid2)})',\
+                     'vmin':self.vmin,'vmax':self.vmax,'cmap':'viridis'} ]
+
+        #--- difference in cells of ocean in both data
+        if diff :
+            dvar    = ras2-ras1
+            dval    = dvar.compressed()
+            if len(dval)>0 :
+                dmax    = max(float(np.percentile(abs(dval),99)),1e-6)
+                stats   = f'bias={np.mean(dval):.3f}, rmse={np.sqrt(np.mean(dval**2)):.3f}, max|diff|={np.max(abs(dval)):.3f}'
+                panels.append({'data':dvar,'title':f'interpolated - original\n({stats})',\
+                               'vmin':-dmax,'vmax':dmax,'cmap':'RdBu_r'})
+        return f'{self.varname} (raster : {self.dres:.2f} degree)', panels
+
+    def main(self,figname,diff=True):
+        render(figname,*self.figure(diff))
+
+def render(figname,title,panels):
+    #--- figure of raster panels (object-oriented API without pyplot; only small rasters are passed to processes)
+    # matplotlib is imported only if figures are made
+    from matplotlib.figure  import Figure
+    from matplotlib.backends.backend_agg    import FigureCanvasAgg
+    fig = Figure(figsize=(12,6*len(panels)),dpi=100,layout='constrained')
+    FigureCanvasAgg(fig)
+    axs = fig.subplots(nrows=len(panels),squeeze=False)[:,0]
+    fig.suptitle(title,fontsize=28)
+    for tax, panel in zip(axs,panels) :
+        im  = tax.imshow(panel['data'],origin='lower',extent=(0,360,-90,90),aspect='auto',\
+                         interpolation='nearest',vmin=panel['vmin'],vmax=panel['vmax'],cmap=panel['cmap'])
+        tax.set_title(panel['title'],fontsize=20)
+        fig.colorbar(im,ax=tax,location='right')
+    fig.savefig(figname,bbox_inches='tight',pad_inches=0.1)
+    print(f'finished making {figname}')
 
+def check_all(checks,workers=0):
+    #--- make figures of all variables in parallel (checks : list of (CHECK arguments, figname))
+    # data are read & averaged in the main process (HDF5 is not thread-safe), and figures are drawn in processes
+    workers = min(len(checks),workers if workers>0 else os.cpu_count())
+    figures = [(figname,*CHECK(*args).figure()) for args, figname in checks]
+    with ProcessPoolExecutor(max_workers=max(workers,1)) as pool :
+        futures = [pool.submit(render,*figure) for figure in figures]
+        for future in futures : future.result()
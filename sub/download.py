@@ -1,13 +1,53 @@
 import os
 import sys
+import json
 import numpy as np
 import netCDF4 as nc
 import subprocess as sub
 import copernicusmarine as cm
 from datetime   import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from spans  import span, flush, merge
+from common import checksum, is_global
+
+def fetch(topdir,now,zlib=False,bbox=None,pack=False,stream=False):
+    #--- returns spans recorded in this process (empty if not profiled)
+    GLORYS12v1(topdir,now,zlib,bbox=bbox,pack=pack,stream=stream).main()
+    return flush()
+
+def prefetch(topdir,nows,zlib=False,bbox=None,jobs=4,pack=False,stream=False):
+    #--- download & convert data of all times with processes (jobs : number of processes)
+    nows    = sorted(set(nows))
+    jobs    = max(1,min(jobs,len(nows)))
+    if jobs==1 :
+        for now in nows :   fetch(topdir,now,zlib,bbox,pack,stream)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool :
+        futures = [pool.submit(fetch,topdir,now,zlib,bbox,pack,stream) for now in nows]
+        for future in futures : merge(future.result())
+
+class REMOTE :
+    def __init__(self,ds):
+        #--- dataset opened lazily by 'copernicusmarine.open_dataset' (read like netCDF4.Dataset)
+        self.ds         = ds
+        self.variables  = {name: REMOTEVAR(ds[name]) for name in ds.variables}
+
+    def close(self):
+        self.ds.close()
+
+class REMOTEVAR :
+    def __init__(self,var):
+        #--- only the indexed part is transferred (missing values are NaN -> masked)
+        self.var    = var
+        self.shape  = var.shape
+
+    def __getitem__(self,idx):
+        return np.ma.masked_invalid(np.asarray(self.var[idx].values))
 
 class GLORYS12v1 :
-    def __init__(self,topdir,now):
+    def __init__(self,topdir,now,zlib=False,kchunk=0,bbox=None,pack=False,stream=False):
         #--- output file setting
         ymdh    = datetime.strftime(now,'%Y%m%d%H')
         tdir    = f'{topdir}/{now.year}/'
@@ -22,10 +62,31 @@ class GLORYS12v1 :
                             'thetao'    :   'to',\
                             'so'        :   'so' }
         self.now        = now
-        self.tmpname    = f'{tdir}/uvts_{ymdh}_tmp.nc'
+        # target region (west, east, south, north [degree]; west & east are None for all longitudes)
+        self.bbox       = (None,None,-90.0,90.0) if bbox is None else bbox
+        # output chunking & compression (kchunk : levels in a chunk, 0 : contiguous if not compressed)
+        self.zlib       = zlib
+        self.kchunk     = kchunk if kchunk>0 else (1 if zlib else 0)
+        # int16 packing with scale_factor & add_offset (range of each variable; values are clipped)
+        self.pack       = pack
+        self.vrange     = { 'uo'        :   (-10.0,10.0),\
+                            'vo'        :   (-10.0,10.0),\
+                            'to'        :   (-10.0,50.0),\
+                            'so'        :   (  0.0,60.0) }
+        # padded grids in the south are not stored in compact (compressed or packed) files
+        self.compact    = zlib or pack
+        # streaming conversion (levels are read from the lazily opened dataset, no temporary file)
+        self.stream     = stream
+        # levels in a block written at once (a multiple of kchunk)
+        self.nblock     = self.kchunk*max(1,8//self.kchunk) if self.kchunk>0 else 8
+        # temporary files are unique for each process (e.g. 'driver.py' & 'serve.py' downloading the same time)
+        self.tmpname    = f'{tdir}/uvts_{ymdh}_tmp{os.getpid()}.nc'
         self.ofname     = f'{tdir}/uvts_{ymdh}.nc'
+        # converted data are written into 'partname', then renamed with the manifest (shapes & checksum)
+        self.partname   = f'{tdir}/uvts_{ymdh}.nc.part{os.getpid()}'
+        self.mfname     = f'{tdir}/uvts_{ymdh}.json'
 
-    def download(self):
+    def request(self):
         #--- data ID setting
         if self.now<datetime(1993,1,1) :
             exit('STOP: data is available after 1993-01-01')
@@ -34,14 +95,81 @@ class GLORYS12v1 :
         else :
             data_id = 'cmems_mod_glo_phy_myint_0.083deg_P1D-m'
 
-        #--- download data via liblary 'copernicusmarine'
-        print(f'WARN: download may take a while')
+        #--- target variables, time & region
         ymd = datetime.strftime(self.now,'%Y-%m-%d')
-        cm.subset(  dataset_id      = data_id,\
+        west, east, south, north    = self.bbox
+        region  = { 'minimum_latitude'  :   south,\
+                    'maximum_latitude'  :   north }
+        if west is not None :
+            region.update({ 'minimum_longitude' :   west,\
+                            'maximum_longitude' :   east })
+        return dict(dataset_id      = data_id,\
                     variables       = list(self.vdict.keys()),\
                     start_datetime  = ymd,\
                     end_datetime    = ymd,\
-                    output_filename = self.tmpname)
+                    **region)
+
+    def download(self):
+        #--- download data via liblary 'copernicusmarine'
+        print(f'WARN: download may take a while')
+        cm.subset(output_filename=self.tmpname,**self.request())
+
+    def open(self):
+        #--- open data lazily via liblary 'copernicusmarine' (data are transferred level by level in 'modify_data')
+        return REMOTE(cm.open_dataset(**self.request()))
+
+    def covers(self,fname):
+        #--- check if the existing data covers the target region (tolerance : one grid)
+        fin = nc.Dataset(fname,'r')
+        lon = np.array(fin.variables['lon'][:],dtype='f8')
+        lat = np.array(fin.variables['lat'][:],dtype='f8')
+        fin.close()
+        dlon    = lon[1]-lon[0]
+        dlat    = lat[1]-lat[0]
+        west, east, south, north    = self.bbox
+
+        if lat[0]>max(south,-80.0)+dlat or lat[-1]<north-dlat :  return False
+        if is_global(lon) :                                     return True
+        if west is None :                                       return False
+        lon1    = lon[0]+np.mod(west-lon[0]+dlon,360)-dlon
+        return lon1+(east-west)<=lon[-1]+dlon
+
+    def write_manifest(self,sha1=None):
+        #--- sidecar of the output (written into a temporary file, then renamed)
+        stat    = os.stat(self.ofname)
+        with nc.Dataset(self.ofname,'r') as fin :
+            shape   = {vname: list(fin.variables[vname].shape) for vname in self.vdict.values()}
+        meta    = { 'fname' :   os.path.basename(self.ofname),\
+                    'size'  :   stat.st_size,\
+                    'mtime' :   stat.st_mtime_ns,\
+                    'sha1'  :   checksum(self.ofname) if sha1 is None else sha1,\
+                    'shape' :   shape }
+        with open(f'{self.mfname}.tmp{os.getpid()}','w') as fout :
+            json.dump(meta,fout,indent=1)
+        os.replace(f'{self.mfname}.tmp{os.getpid()}',self.mfname)
+
+    def check(self):
+        #--- True if the output is complete (same as its manifest)
+        if not os.path.isfile(self.ofname) :    return False
+        if not os.path.isfile(self.mfname) :
+            # data made before manifests : complete if the deepest level of all variables can be read
+            try :
+                with nc.Dataset(self.ofname,'r') as fin :
+                    for vname in self.vdict.values() :  fin.variables[vname][0,-1]
+            except (OSError,RuntimeError,KeyError,IndexError) :
+                return False
+            self.write_manifest()
+            return True
+
+        with open(self.mfname,'r') as fin :
+            meta    = json.load(fin)
+        stat    = os.stat(self.ofname)
+        if meta['size']!=stat.st_size :     return False
+        # the checksum is compared only if the file was touched after the manifest was made
+        if meta['mtime']!=stat.st_mtime_ns :
+            if checksum(self.ofname)!=meta['sha1'] :    return False
+            self.write_manifest(meta['sha1'])
+        return True
 
     def set_basicinfo(self,tfout,lon_tmp,lat_tmp,lev,time):
         def mk_axis(name,var,lname,units):
@@ -52,15 +180,34 @@ class GLORYS12v1 :
             tfout.variables[name].units     = units
 
         def mk_varinfo(name,lname,units):
-            tfout.createVariable(name,self.byte,self.dim4,fill_value=self.undef)
+            if self.kchunk>0 :
+                chunk   = {'chunksizes':(1,min(self.kchunk,len(lev)),len(lat),len(lon)),'zlib':self.zlib,'shuffle':self.zlib}
+            else :
+                chunk   = {'contiguous':True}
+            if self.pack :
+                vmin, vmax  = self.vrange[name]
+                tfout.createVariable(name,'i2',self.dim4,fill_value=np.int16(-32768),**chunk)
+                tfout.variables[name].scale_factor  = np.float32((vmax-vmin)/65534)
+                tfout.variables[name].add_offset    = np.float32((vmax+vmin)/2)
+            else :
+                tfout.createVariable(name,self.byte,self.dim4,fill_value=self.undef,**chunk)
             tfout.variables[name].long_name = lname
             tfout.variables[name].units     = units
 
         #--- change longitude (180W - 0 - 180E) -> (0 - 360E)
+        # a region is not rotated, but its longitude is made continuous (e.g. 350 - 370E)
         nx  = len(lon_tmp)
-        lon = np.concatenate([lon_tmp,lon_tmp+360])[int(nx/2):int(3*nx/2)]
-        #--- extend latitude (80S - 90N) -> (90S - 90N)
-        lat = np.concatenate([-lat_tmp[-120:][::-1],lat_tmp])
+        cyclic  = is_global(lon_tmp)
+        self.ix = int(np.argmin(np.mod(lon_tmp,360))) if cyclic else 0
+        lon = np.mod(lon_tmp[self.ix],360)+np.mod(np.roll(lon_tmp,-self.ix)-lon_tmp[self.ix],360)
+        #--- extend latitude (80S - 90N) -> (90S - 90N), only if data reaches 80S
+        # compact files keep only the data (the number of padded grids is in 'npad_south')
+        npad        = 120 if lat_tmp[0]<-79.9 else 0
+        self.nsouth = 0 if self.compact else npad       # number of padded grids in latitude
+        if self.compact :   tfout.setncattr('npad_south',np.int32(npad))
+        # padded latitudes are made with the grid interval (data may not reach the North Pole)
+        dlat    = (float(lat_tmp[-1])-float(lat_tmp[0]))/(len(lat_tmp)-1)
+        lat = np.concatenate([float(lat_tmp[0])-dlat*np.arange(self.nsouth,0,-1),lat_tmp])
 
         #--- make axes
         mk_axis('lon', lon, 'longitude','degrees_east')
@@ -74,46 +221,78 @@ class GLORYS12v1 :
         mk_varinfo('so','salinity',          'psu')
 
     def modify_data(self,tfin,tfout,iname):
-        nx  = tfin.dimensions['longitude'].size
-        ny  = tfin.dimensions['latitude'].size+120
-        nz  = tfin.dimensions['depth'].size
+        _, nz, ny, nx   = tfin.variables[iname].shape
+        ny  += self.nsouth
+        ix  = self.ix
 
-        for kz in range(nz):
-            var_in  = tfin.variables[iname][0,kz]
-            var_tmp = np.ma.masked_array(np.zeros((ny,nx)),mask=True)
+        #--- preallocated block (padded grids in the south stay undef)
+        var_out = np.full((self.nblock,ny,nx),self.undef,dtype=self.byte)
+        for kz in range(0,nz,self.nblock):
+            nk      = min(self.nblock,nz-kz)
+            with span('netcdf_read',var=iname,level=kz) as info :
+                var_in  = tfin.variables[iname][0,kz:kz+nk]
+                info['bytes_read']  = var_in.nbytes
+            data    = np.ma.getdata(var_in)
+            undef   = np.ma.getmaskarray(var_in)|~np.isfinite(data)
 
             #--- extend latitude (80S - 90N) -> (90S - 90N)
-            var_tmp[120:,:] = var_in[:]
             #--- change longitude (180W - 0 - 180E) -> (0 - 360E)
-            var_out = np.concatenate([var_tmp,var_tmp],axis=1)[:,int(nx/2):int(3*nx/2)]
+            out     = var_out[:nk,self.nsouth:]
+            out[:,:,:nx-ix] = data[:,:,ix:]
+            out[:,:,nx-ix:] = data[:,:,:ix]
+            np.copyto(out[:,:,:nx-ix],self.undef,where=undef[:,:,ix:])
+            np.copyto(out[:,:,nx-ix:],self.undef,where=undef[:,:,:ix])
+
+            #--- packed data are clipped to the range (undef -> _FillValue)
+            block   = var_out[:nk]
+            if self.pack :
+                vmin, vmax  = self.vrange[self.vdict[iname]]
+                block   = np.ma.masked_array(np.clip(block,vmin,vmax),mask=block==self.undef)
 
-            tfout.variables[self.vdict[iname]][0,kz]    = var_out
+            with span('netcdf_write',var=self.vdict[iname],level=kz) as info :
+                tfout.variables[self.vdict[iname]][0,kz:kz+nk] = block
+                info['bytes_written']   = var_out[:nk].nbytes
 
         print(f'finished outputting {iname}')
 
     def main(self):
-        #--- skip downloading if the target data already exsits
-        if os.path.isfile(self.ofname) :
-            print(f'SKIP: {self.ofname} already exists!')
-            return
-        else :
-            self.download()
-            fin     = nc.Dataset(self.tmpname,'r')
-            fout    = nc.Dataset(self.ofname,'w')
-
-            #--- set grids
-            self.set_basicinfo(fout,\
-                fin.variables['longitude'][:],\
-                fin.variables['latitude'][:],\
-                fin.variables['depth'][:],\
-                np.array([0]))
-
-            #--- output variables
-            for vname in self.vdict.keys() :
-                self.modify_data(fin,fout,vname)
-
-            fin.close()
+        with span('download.main',time=str(self.now)) :
+            #--- skip downloading if the target data already exsits, is complete & covers the target region
+            if self.check() and self.covers(self.ofname) :
+                print(f'SKIP: {self.ofname} already exists!')
+                return
+            if os.path.isfile(self.ofname) :
+                print(f'WARN: {self.ofname} is incomplete or does not cover the target region and is downloaded again')
+            if self.stream :
+                with span('download.open',time=str(self.now)) :
+                    fin = self.open()
+            else :
+                with span('download.subset',time=str(self.now)) :
+                    self.download()
+                fin = nc.Dataset(self.tmpname,'r')
+            fout    = nc.Dataset(self.partname,'w')
+            try :
+                #--- set grids
+                self.set_basicinfo(fout,\
+                    fin.variables['longitude'][:],\
+                    fin.variables['latitude'][:],\
+                    fin.variables['depth'][:],\
+                    np.array([0]))
+
+                #--- output variables
+                for vname in self.vdict.keys() :
+                    with span('download.modify_data',var=vname) :
+                        self.modify_data(fin,fout,vname)
+            except BaseException :
+                # an interrupted output is removed (downloaded again in the next run)
+                fout.close()
+                os.remove(self.partname)
+                raise
+            finally :
+                fin.close()
+                if not self.stream :    os.remove(self.tmpname)
             fout.close()
-            sub.run(['rm','-f',self.tmpname])
+            #--- complete data & its manifest
+            os.replace(self.partname,self.ofname)
+            self.write_manifest()
             print(f'finished making {self.ofname}')
-
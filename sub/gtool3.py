@@ -0,0 +1,113 @@
+import os
+import sys
+import numpy as np
+
+class GT3READER :
+    def __init__(self,fname):
+        #--- shared variables
+        self.fname      = fname
+        self.nhead      = 64    # number of header items (16 characters for each)
+        self.dtype      = { 'UR4'   :   '>f4',\
+                            'UR8'   :   '>f8' }
+        self.set_index()
+
+    def set_index(self):
+        #--- one pass over the file : read headers only and skip data
+        self.records    = []
+        self.index      = {}
+        fsize   = os.path.getsize(self.fname)
+        fin     = open(self.fname,'rb')
+        while fin.tell()<fsize :
+            #--- header
+            top = int(np.frombuffer(fin.read(4),dtype='>i4')[0])
+            raw = fin.read(top)
+            bot = int(np.frombuffer(fin.read(4),dtype='>i4')[0])
+            assert top==bot
+            header  = self.decode(raw)
+
+            #--- data (record markers can overflow for large data, so the size is taken from header)
+            dtype   = np.dtype(self.dtype[header[37].strip()])
+            shape   = (int(header[36]),int(header[33]),int(header[30]))
+            nbyte   = int(header[63])*dtype.itemsize
+            top     = int(np.frombuffer(fin.read(4),dtype='>i4')[0])
+            offset  = fin.tell()
+            fin.seek(nbyte,1)
+            bot     = int(np.frombuffer(fin.read(4),dtype='>i4')[0])
+            assert top==bot
+
+            record  = { 'name'      :   header[2].strip(),\
+                        'header'    :   header,\
+                        'offset'    :   offset,\
+                        'shape'     :   shape,\
+                        'dtype'     :   dtype }
+            self.records.append(record)
+            self.index.setdefault(record['name'],record)
+        fin.close()
+
+    def decode(self,raw):
+        text    = raw.decode('latin-1')
+        return [text[ii*16:(ii+1)*16] for ii in range(self.nhead)]
+
+    def read(self,name):
+        #--- lazy view of the data (only touched bytes are read)
+        record  = self.index[name]
+        return np.memmap(self.fname,dtype=record['dtype'],mode='r',\
+                         offset=record['offset'],shape=record['shape'])
+
+    def __getitem__(self,name):
+        return self.read(name)
+
+    def __contains__(self,name):
+        return name in self.index
+
+class GT3WRITER :
+    def __init__(self,bsize=1<<22):
+        #--- shared variables (bsize : buffer size [byte])
+        self.buf    = np.empty(bsize//8,dtype='>f8')
+        self.const  = {}
+
+    def write_header(self,tfout,header):
+        raw = ''.join(header).encode('latin-1')
+        tfout.write(np.array([len(raw)],dtype='>i4').tobytes())
+        tfout.write(raw)
+        tfout.write(np.array([len(raw)],dtype='>i4').tobytes())
+
+    def write_data(self,tfout,odata):
+        flat    = np.ravel(odata)
+        tfout.write(np.array([8*flat.size],dtype='>i4').tobytes())
+        self.write_flat(tfout,flat)
+        tfout.write(np.array([8*flat.size],dtype='>i4').tobytes())
+
+    def write_flat(self,tfout,flat):
+        #--- convert to big-endian 8-byte float in a bounded buffer (no full-size copies)
+        nbuf    = len(self.buf)
+        for ii in range(0,flat.size,nbuf):
+            chunk   = flat[ii:ii+nbuf]
+            buf     = self.buf[:chunk.size]
+            np.copyto(buf,chunk,casting='unsafe')
+            tfout.write(buf)
+
+    def write_bands(self,tfout,bands):
+        #--- bands : iterable of (j1, j2, data of rows j1:j2 [nz, j2-j1, nx]) with bands.shape = (nz, ny, nx)
+        # rows of each band are written into their place in the record (seek), so the whole data is never in memory
+        nz, ny, nx  = bands.shape
+        dsize   = nz*ny*nx
+        tfout.write(np.array([8*dsize],dtype='>i4').tobytes())
+        offset  = tfout.tell()
+        for j1, j2, data in bands :
+            for kz in range(nz):
+                tfout.seek(offset+8*(kz*ny+j1)*nx)
+                self.write_flat(tfout,np.ravel(data[kz]))
+        tfout.seek(offset+8*dsize)
+        tfout.write(np.array([8*dsize],dtype='>i4').tobytes())
+
+    def write_const(self,tfout,value,dsize):
+        #--- repeat one pre-encoded buffer for constant data
+        nbuf    = len(self.buf)
+        if value not in self.const :
+            self.const[value]   = np.full(nbuf,value,dtype='>f8')
+        buf     = self.const[value]
+        tfout.write(np.array([8*dsize],dtype='>i4').tobytes())
+        for ii in range(0,dsize,nbuf):
+            tfout.write(buf[:min(nbuf,dsize-ii)])
+        tfout.write(np.array([8*dsize],dtype='>i4').tobytes())
@@ -1,112 +1,670 @@
 import os
 import sys
+import shutil
+import hashlib
+import queue
+import tempfile
+import copy
+import functools
+import threading
+import subprocess as sub
 import numpy as np
 import netCDF4 as nc
 from ctypes import *
+from concurrent.futures import ThreadPoolExecutor, wait
+from common import axes_key
+from spans  import span
+
+#--- compiler & flags of 'mod_interp.f90' (the shared object is rebuilt if they or the source change)
+FC      = os.environ.get('FC','gfortran')
+FFLAGS  = ['-Ofast','-O3','-shared','-fPIC']
+
+def lib_name(ndir=os.path.dirname(os.path.abspath(__file__))):
+    #--- versioned shared object (sha1 of the source, compiler & flags)
+    sha = hashlib.sha1()
+    with open(f'{ndir}/mod_interp.f90','rb') as fin :
+        sha.update(fin.read())
+    sha.update(' '.join([FC]+FFLAGS).encode())
+    return f'{ndir}/build/mod_interp_{sha.hexdigest()[:12]}.so'
+
+def build_mytool(ndir=os.path.dirname(os.path.abspath(__file__))):
+    #--- compile 'mod_interp.f90' only if its version is not built yet (None if not available)
+    exename = lib_name(ndir)
+    if os.path.isfile(exename) :    return exename
+    if shutil.which(FC) is None :
+        print(f'WARN: {FC} is not found')
+        return None
+
+    # compile into a temporary file, then rename it (safe for concurrent builds)
+    os.makedirs(os.path.dirname(exename),exist_ok=True)
+    tmpname = f'{exename}.tmp{os.getpid()}.so'
+    res     = sub.run([FC]+FFLAGS+[f'{ndir}/mod_interp.f90','-o',tmpname])
+    if res.returncode!=0 :
+        print(f'WARN: failed to compile {ndir}/mod_interp.f90')
+        if os.path.isfile(tmpname) :    os.remove(tmpname)
+        return None
+    os.replace(tmpname,exename)
+    print(f'finished making {exename}')
+    return exename
+
+@functools.cache
+def load_mytool(ndir):
+    #--- load the shared object & set argument types only once per process (None if not built)
+    exename = lib_name(ndir)
+    if not os.path.isfile(exename) :    return None
+    mytool  = CDLL(exename)
+    f4_arr  = np.ctypeslib.ndpointer(dtype=np.float32,flags='C_CONTIGUOUS')
+    i4_arr  = np.ctypeslib.ndpointer(dtype=np.int32,flags='C_CONTIGUOUS')
+
+    mytool.h_interp_wgt.argtypes    = [f4_arr,f4_arr,i4_arr,f4_arr]+[POINTER(c_int32)]*4
+    mytool.h_interp_wgt.restype     = None
+
+    return mytool
+
+def prefetch(iterator,depth=0):
+    #--- items of an iterator made ahead in a thread (depth : number of items made ahead, 0 : made in the caller)
+    if depth<=0 :
+        yield from iterator
+        return
+
+    items   = queue.Queue(maxsize=depth)
+    stop    = threading.Event()
+    def put(kind,item):
+        #--- False if the caller stopped
+        while not stop.is_set() :
+            try :
+                items.put((kind,item),timeout=0.1)
+                return True
+            except queue.Full :
+                pass
+        return False
+
+    def run():
+        try :
+            for item in iterator :
+                if not put('item',item) :  return
+            put('end',None)
+        except BaseException as err :
+            put('error',err)
+
+    thread  = threading.Thread(target=run,daemon=True)
+    thread.start()
+    try :
+        while True :
+            kind, item  = items.get()
+            if kind=='end' :    break
+            if kind=='error' :  raise item
+            yield item
+    finally :
+        #--- the thread stops even if the caller stops in the middle
+        stop.set()
+        thread.join()
+
+class BUFFERS :
+    def __init__(self,shape,count):
+        #--- pool of buffers of interpolated data (get() waits until a buffer is released; pages are allocated when used)
+        self.bufs   = [np.empty(shape,dtype=np.float32) for _ in range(count)]
+        self.free   = queue.Queue()
+        for buf in self.bufs :  self.free.put(buf)
+
+    def get(self):
+        return self.free.get()
+
+    def release(self,buf):
+        #--- only buffers of this pool are returned (e.g. not cached data)
+        if any([buf is pbuf for pbuf in self.bufs]) :  self.free.put(buf)
+
+class BANDS :
+    def __init__(self,interp,varname):
+        #--- interpolated data made band by band of latitude when iterated (tiled mode of 'INTERP')
+        # horizontally interpolated data of each band [nz_in, rows of the band, nx] are written into a temporary file
+        # bands are written & read explicitly (not memory-mapped), so only buffers of bands are in memory
+        self.interp     = interp
+        self.varname    = varname
+        self.nwet       = None
+        self.shape      = interp.dim3_2
+        self.size       = int(np.prod(self.shape))
+        self.file       = tempfile.TemporaryFile(prefix='hbuf_')
+        self.kz0        = 0
+
+    def __getitem__(self,levels):
+        #--- levels from kz0 (used like a buffer of levels in 'h_slab'; the file is shared)
+        view        = copy.copy(self)
+        view.kz0    = self.kz0+(levels.start if isinstance(levels,slice) else levels)
+        return view
+
+    def put(self,kz,j1,j2,data):
+        #--- one level of a band (all levels of the bands before it are stored before the band)
+        nz, nx  = self.interp.dim3_1[0], self.shape[2]
+        os.pwrite(self.file.fileno(),np.ascontiguousarray(data,dtype=np.float32),4*nx*(nz*j1+(self.kz0+kz)*(j2-j1)))
+
+    def __iter__(self):
+        #--- yields (j1, j2, data of rows j1:j2 [coco.nz, j2-j1, coco.nx]); buffers are reused for all bands
+        nz, ny, nx  = self.shape
+        nz_in   = self.interp.dim3_1[0]
+        nrow    = self.interp.nrow
+        hbuf    = np.empty(nz_in*nrow*nx,dtype=np.float32)
+        vbuf    = np.empty(nz*nrow*nx,dtype=np.float32)
+        for j1, j2, table in self.interp.tables :
+            h_interped  = hbuf[:nz_in*(j2-j1)*nx].reshape(nz_in,j2-j1,nx)
+            with span('v_interp',var=self.varname,band=j1) :
+                os.preadv(self.file.fileno(),[h_interped],4*nx*nz_in*j1)
+                #--- levels without ocean grids in the window (NaN in 'FILL') continue the level above
+                for kz in range(nz_in):
+                    if not np.isnan(h_interped[kz].flat[0]) :  continue
+                    if kz==0 :  exit(f'STOP: no ocean grids of {self.varname} in the window of GLORYS12v1 grids')
+                    h_interped[kz]  = h_interped[kz-1]
+                #--- wet levels of COCO grids : the deepest of the 4 neighbor grids
+                nwet    = None
+                if self.nwet is not None :
+                    ix1, ix2, jy1, jy2  = self.interp.lut[:,j1:j2]-1
+                    nwet    = np.maximum.reduce([self.nwet[jy1,ix1],self.nwet[jy2,ix1],self.nwet[jy1,ix2],self.nwet[jy2,ix2]])
+                out = self.interp.vremap.main(h_interped,vbuf[:nz*(j2-j1)*nx].reshape(nz,j2-j1,nx),nwet)
+                self.interp.set_min(self.varname,out)
+            yield j1, j2, out
+
+class FILL :
+    def __init__(self,glorys,cdir=None):
+        #--- sources of undef grids (cached for each land mask; cdir : directory of COCO grid data)
+        self.shape  = (glorys.ny,glorys.nx)
+        self.periodic   = glorys.periodic
+        self.tdir   = f'{cdir}cache/fill_{axes_key(glorys)}/' if cdir is not None else None
+        self.source = {}
+        self.lock   = threading.Lock()
+
+    def set_source(self,valid):
+        #--- same filling as 'remove_undef' in 'mod_interp.f90'
+        # bit-identical if periodic (the Fortran routine always connects 0 ~ 360E); regional windows are not connected
+        # (changed on purpose) without all-undef rows on a semisphere, its rows are kept as they are
+        # ('remove_undef' reuses s_undef of the other semisphere (undefined if none), and overwrites the rows from there)
+        ny, nx  = valid.shape
+        row_on  = valid.any(axis=1)
+        jy      = np.arange(ny)[:,None]
+
+        #--- remove undef grids in longitudinal direction
+        idx     = np.arange(2*nx)
+        if self.periodic :
+            # nearest non-undef grids on the left & right sides (connect 0 ~ 360 ~ 720)
+            conn    = np.concatenate([valid,valid],axis=1)
+            left    = np.maximum.accumulate(np.where(conn,idx,-1),axis=1)[:,nx:]-nx
+            right   = np.minimum.accumulate(np.where(conn,idx,4*nx)[:,::-1],axis=1)[:,::-1][:,:nx]
+        else :
+            # nearest non-undef grids in the window (only one side near the edges of the window)
+            left    = np.maximum.accumulate(np.where(valid,idx[:nx],-2*nx),axis=1)
+            right   = np.minimum.accumulate(np.where(valid,idx[:nx],4*nx)[:,::-1],axis=1)[:,::-1]
+            left, right = np.where(left<0,right,left), np.where(right>=nx,left,right)
+
+        # substitute left/right edge into undef grids on the left/right side (average at the center)
+        pos     = idx[:nx]-left-1       # position in the undef grids
+        counts  = right-left-1          # number of the undef grids
+        src_l   = jy*nx+left%nx
+        src_r   = jy*nx+right%nx
+        center  = (counts%2==1)&(pos==counts//2)
+        src1    = np.where((pos<counts//2)|center,src_l,src_r)
+        src2    = np.where(center,src_r,-1)
+        src1    = np.where(valid|~row_on[:,None],jy*nx+idx[:nx],src1)
+        src2    = np.where(valid|~row_on[:,None],-1,src2)
+
+        #--- remove undef grids in latitudinal direction
+        # srow : row of the source of each row
+        srow        = np.arange(ny)
+        all_undef   = np.flatnonzero(~row_on)
+        south       = all_undef[all_undef<=int((ny+1)/2)-1]
+        north       = all_undef[all_undef>=int((ny+1)/2)-1]
+        # substitute southest non-undef grids into undef grids on the southern semisphere
+        if len(south)>0 :
+            src1[:south[-1]+1]  = src1[south[-1]+1]
+            src2[:south[-1]+1]  = src2[south[-1]+1]
+            srow[:south[-1]+1]  = south[-1]+1
+        # substitute northest non-undef grids into undef grids on the northern semisphere
+        if len(north)>0 :
+            src1[north[0]:] = src1[north[0]-1]
+            src2[north[0]:] = src2[north[0]-1]
+            srow[north[0]:] = north[0]-1
+
+        #--- check undef grids (the source row must have non-undef grids)
+        if not row_on[srow].all() : exit('STOP: undef grids still exist!')
+
+        #--- sources of undef grids (ordered as np.flatnonzero(~valid))
+        undef   = ~valid.ravel()
+        avg     = np.flatnonzero(src2.ravel()>=0)
+        return {'src'   :   src1.ravel()[undef].astype(np.int32),\
+                'avg'   :   avg.astype(np.int32),\
+                'src2'  :   src2.ravel()[avg].astype(np.int32)}
+
+    def get_source(self,valid):
+        #--- key : land mask
+        key = hashlib.sha1(np.packbits(valid)).hexdigest()[:16]
+        if key in self.source : return self.source[key]
+
+        fname   = f'{self.tdir}{key}.npz' if self.tdir is not None else None
+        if fname is not None and os.path.isfile(fname) :
+            with np.load(fname) as fin :
+                source  = {name: fin[name] for name in fin.files}
+        else :
+            source  = self.set_source(valid)
+            if fname is not None :
+                # write into a temporary file, then rename it (safe for concurrent runs)
+                os.makedirs(self.tdir,exist_ok=True)
+                tmpname = f'{fname}.tmp{os.getpid()}_{threading.get_ident()}.npz'
+                np.savez(tmpname,**source)
+                os.replace(tmpname,fname)
+
+        with self.lock :    self.source[key]    = source
+        return source
+
+    def main(self,in_data,out=None):
+        #--- fill undef grids with a gather of precomputed sources
+        valid   = ~np.ma.getmaskarray(in_data)
+        if out is None :    out = np.empty(self.shape,dtype=np.float32)
+        #--- no ocean grids at this level of the window : NaN (the level above is used in 'INTERP.finish')
+        if not valid.any() :
+            out[:]  = np.nan
+            return out
+        source  = self.get_source(valid)
+        np.copyto(out,np.ma.getdata(in_data),casting='unsafe')
+
+        flat    = out.reshape(-1)
+        flat[np.flatnonzero(~valid)]    = flat[source['src']]
+        flat[source['avg']] = (flat[source['avg']].astype('f8')+flat[source['src2']])/2
+
+        return out
+
+class VREMAP :
+    BLOCK   = 1024
+
+    def __init__(self,lev_in,lev_out):
+        #--- levels & weights for the linear interpolation in vertical (computed only once)
+        lev_in  = np.array(lev_in,dtype='f8')
+        lev_out = np.array(lev_out,dtype='f8')
+
+        # if target depth exceeds the deepest grids in input data, continue using the upper value
+        for kz in range(1,len(lev_out)):
+            if lev_out[kz]>=lev_in[-1]  :   lev_out[kz] = lev_out[kz-1]
+
+        kz1 = np.searchsorted(lev_in,lev_out,side='right')-1
+        kz1 = np.clip(kz1,0,len(lev_in)-2)
+        kz2 = kz1+1
+        dz  = np.clip((lev_out-lev_in[kz1])/(lev_in[kz2]-lev_in[kz1]),0,1)
+
+        self.kz1    = kz1
+        self.kz2    = kz2
+        self.wgt1   = (1-dz).astype(np.float32)
+        self.wgt2   = dz.astype(np.float32)
+
+    def get_bottom(self,nwet):
+        #--- deepest output level above the bottom of each column (nwet : number of wet input levels)
+        # -1 if the column has no wet level
+        return np.where(nwet>0,np.searchsorted(self.kz2,nwet-1,side='right')-1,-1)
+
+    def main(self,in_data,out=None,nwet=None):
+        #--- gather upper & lower levels of all columns (out : caller-supplied buffer [nz_out, ny, nx])
+        nz  = len(self.kz1)
+        if out is None :    out = np.empty((nz,)+in_data.shape[1:],dtype=np.float32)
+        buf = np.empty(in_data.shape[1:],dtype=np.float32)
+        if nwet is None :
+            for kz in range(nz):
+                np.multiply(in_data[self.kz1[kz]],self.wgt1[kz],out=out[kz])
+                np.multiply(in_data[self.kz2[kz]],self.wgt2[kz],out=buf)
+                out[kz] += buf
+            return out
+
+        #--- columns are computed only down to their bottom, and continue the deepest value above the bottom below it
+        # columns are split into blocks of BLOCK columns, and each level is computed only in spans of blocks with wet columns
+        # (columns without wet levels are computed at all levels)
+        kbot    = self.get_bottom(nwet).ravel()
+        kend    = np.where(kbot<0,nz,kbot).astype(np.int16)
+        starts  = np.arange(0,kend.size,self.BLOCK)
+        kmax    = np.maximum.reduceat(kend,starts)
+        kmin    = np.minimum.reduceat(kend,starts)
+        flat    = out.reshape(nz,-1)
+        data    = in_data.reshape(len(in_data),-1)
+        buf     = buf.reshape(-1)
+        for kz in range(nz):
+            if kz>0 :   flat[kz] = flat[kz-1]
+            # spans of consecutive blocks with columns above the bottom
+            edges   = np.flatnonzero(np.diff(np.concatenate([[0],kmax>=kz,[0]]).astype(np.int8)))
+            for b1, b2 in edges.reshape(-1,2):
+                span    = slice(b1*self.BLOCK,min(b2*self.BLOCK,kend.size))
+                if kmin[b1:b2].min()<kz :
+                    # blocks with columns below the bottom : copied only where the columns are above the bottom
+                    np.multiply(data[self.kz1[kz],span],self.wgt1[kz],out=buf[span])
+                    buf[span]  += data[self.kz2[kz],span]*self.wgt2[kz]
+                    np.copyto(flat[kz,span],buf[span],where=kend[span]>=kz)
+                else :
+                    np.multiply(data[self.kz1[kz],span],self.wgt1[kz],out=flat[kz,span])
+                    np.multiply(data[self.kz2[kz],span],self.wgt2[kz],out=buf[span])
+                    flat[kz,span]  += buf[span]
+
+        return out
 
 class INTERP :
-    def __init__(self,coco,glorys,lut):
+    def __init__(self,coco,glorys,lut,backend='fortran',workers=1,cdir=None,bottom=False,cache=None,depth=0,tile=0):
         ndir    = os.path.dirname(os.path.abspath(__file__))
 
         #--- shared variables
-        self.mytool = np.ctypeslib.load_library('mod_interp.so',ndir)
+        self.backend    = backend
+        self.workers    = workers
         self.coco   = coco
-        self.glorys = glorys
-        self.lut    = lut
+        # input grids are GLORYS12v1 grids in the window covering COCO grids
+        self.glorys = lut.window
+        # python index -> fortran index
+        self.lut    = np.ascontiguousarray(lut.lut+1,dtype=np.int32)
+        self.wgt    = np.ascontiguousarray(lut.wgt,dtype=np.float32)
         self.dim2   = (coco.ny,coco.nx)
         self.dim3_1 = (glorys.nz-1,coco.ny,coco.nx) # all Nan at kz=49 in GLORYS12v1
         self.dim3_2 = (coco.nz,coco.ny,coco.nx)
+        self.fill   = FILL(self.glorys,cdir)
+        self.vremap = VREMAP(glorys.lev[:self.dim3_1[0]],coco.lev)
+        # flag for continuing the deepest value below the bottom of GLORYS12v1 data
+        self.bottom = bottom
+        # buffers of horizontally interpolated data (two variables are processed at once)
+        self.hbuf   = []
+        # number of slabs read ahead in the reader thread (0 : read in the caller)
+        self.depth  = depth
+        # size of the buffer of bands in the tiled mode [byte] (0 : not tiled)
+        self.tile   = tile
 
-    def remove_undef(self,io_data,undef=-32767.0):
-        io_data = np.array(io_data.filled(undef),dtype=np.float32)
+        #--- backend setting (the numpy backend is used if the shared object is not built)
+        if backend=='fortran' and load_mytool(ndir) is None :
+            print(f'WARN: {lib_name(ndir)} is not built; numpy backend is used')
+            self.backend    = 'numpy'
+        match self.backend :
+            case 'fortran' :
+                self.mytool = load_mytool(ndir)
+                # arguments passed by reference are made only once
+                self.nxy_in     = (byref(c_int32(self.glorys.nx)),byref(c_int32(self.glorys.ny)))
+                self.nxy_out    = (byref(c_int32(self.coco.nx)),byref(c_int32(self.coco.ny)))
+            case 'numpy' :
+                self.set_hmatrix(lut)
+            case _ :
+                exit(f'STOP: unknown backend \'{backend}\'')
 
-        self.mytool.remove_undef.argtypes   = [\
-            np.ctypeslib.ndpointer(dtype=np.float32),\
-            POINTER(c_int32),\
-            POINTER(c_int32),\
-            POINTER(c_float)]
-        self.mytool.remove_undef(\
-            io_data,\
-            byref(c_int32(self.glorys.nx)),\
-            byref(c_int32(self.glorys.ny)),\
-            byref(c_float(undef)))
+        # cache of interpolated data (keyed with the source file, variable & the following settings)
+        self.cache  = cache
+        window      = self.glorys
+        self.settings   = [self.backend,bottom,window.ix0,window.nx,window.jy0,window.ny,\
+                           cache.source_key(coco.gname) if cache is not None else None]
 
-        return io_data
+        #--- thread pool for levels (kernels run without GIL)
+        self.pool   = ThreadPoolExecutor(max_workers=workers) if workers>1 else None
+        self.local  = threading.local()
+        self.lock   = threading.Lock()
 
-    def h_interp(self,in_data):
-        out_data    = np.zeros(self.dim2,dtype=np.float32)
-
-        self.mytool.h_interp.argtypes   = [\
-            np.ctypeslib.ndpointer(dtype=np.float32),\
-            np.ctypeslib.ndpointer(dtype=np.float32),\
-            np.ctypeslib.ndpointer(dtype=np.int32),\
-            np.ctypeslib.ndpointer(dtype=np.float32),\
-            np.ctypeslib.ndpointer(dtype=np.float32),\
-            np.ctypeslib.ndpointer(dtype=np.float32),\
-            np.ctypeslib.ndpointer(dtype=np.float32),\
-            POINTER(c_int32),\
-            POINTER(c_int32),\
-            POINTER(c_int32),\
-            POINTER(c_int32)]
-        self.mytool.h_interp(\
-            np.array(in_data,dtype=np.float32),\
-            out_data,\
-            # python index -> fortran index
-            np.array(self.lut+1,dtype=np.int32),\
-            np.array(self.glorys.lon,dtype=np.float32),\
-            np.array(self.glorys.lat,dtype=np.float32),\
-            np.array(self.coco.lon,dtype=np.float32),\
-            np.array(self.coco.lat,dtype=np.float32),\
-            byref(c_int32(self.glorys.nx)),\
-            byref(c_int32(self.glorys.ny)),\
-            byref(c_int32(self.coco.nx)),\
-            byref(c_int32(self.coco.ny)))
+        #--- tiled mode : bands of COCO rows within the buffer size
+        if tile>0 : self.set_tables()
 
-        return out_data
+    def h_interp(self,in_data,out_data=None):
+        if out_data is None :   out_data    = np.zeros(self.dim2,dtype=np.float32)
 
-    def v_interp(self,in_data):
-        out_data    = np.zeros(self.dim3_2,dtype=np.float32)
-
-        self.mytool.v_interp.argtypes   = [\
-            np.ctypeslib.ndpointer(dtype=np.float32),\
-            np.ctypeslib.ndpointer(dtype=np.float32),\
-            np.ctypeslib.ndpointer(dtype=np.float32),\
-            np.ctypeslib.ndpointer(dtype=np.float32),\
-            POINTER(c_int32),\
-            POINTER(c_int32),\
-            POINTER(c_int32),\
-            POINTER(c_int32)]
-        self.mytool.v_interp(\
-            np.array(in_data,dtype=np.float32),\
+        #--- apply bilinear weights precomputed in 'LUT'
+        self.mytool.h_interp_wgt(\
+            np.ascontiguousarray(in_data,dtype=np.float32),\
             out_data,\
-            np.array(self.glorys.lev,dtype=np.float32),\
-            np.array(self.coco.lev,dtype=np.float32),\
-            byref(c_int32(self.coco.nx)),\
-            byref(c_int32(self.coco.ny)),\
-            byref(c_int32(self.glorys.nz)),\
-            byref(c_int32(self.coco.nz)))
+            self.lut,\
+            self.wgt,\
+            *self.nxy_in,\
+            *self.nxy_out)
 
         return out_data
 
-    def main(self,ifname,varname):
-        fin         = nc.Dataset(ifname,'r')
-        h_interped  = np.zeros(self.dim3_1,dtype='f4')
-        for kz in range(self.dim3_1[0]):
-            #--- remove undef grids with the neighbor grids (important for grids near coastlines)
-            not_undef       = self.remove_undef(fin.variables[varname][0,kz])
-            #--- horizontal interpolation
-            h_interped[kz]  = self.h_interp(not_undef)
-        fin.close()
+    def set_hmatrix(self,lut):
+        #--- sparse matrix of bilinear weights [coco.nx*coco.ny, glorys.nx*glorys.ny]
+        # scipy is imported only for the numpy backend
+        from scipy  import sparse
+        ix1, ix2, jy1, jy2  = np.asarray(lut.lut,dtype=np.int64).reshape(4,-1)
+        ncol    = self.glorys.nx*self.glorys.ny
+        nrow    = self.coco.nx*self.coco.ny
+        rows    = np.tile(np.arange(nrow),4)
+        cols    = np.concatenate([\
+            jy1*self.glorys.nx+ix1,\
+            jy2*self.glorys.nx+ix1,\
+            jy1*self.glorys.nx+ix2,\
+            jy2*self.glorys.nx+ix2])
+        self.hmat   = sparse.csr_matrix(\
+            (np.asarray(lut.wgt,dtype=np.float32).ravel(),(rows,cols)),shape=(nrow,ncol))
+
+    def remove_undef_np(self,in_data):
+        #--- same as 'remove_undef', but all levels of the slab (sources are precomputed in 'FILL')
+        io_data = np.empty(in_data.shape,dtype=np.float32)
+        for kz in range(len(in_data)):
+            self.fill.main(in_data[kz],out=io_data[kz])
+
+        return io_data
+
+    def h_interp_np(self,in_data):
+        #--- one sparse matrix product for all levels
+        nz      = len(in_data)
+        out_data    = self.hmat@in_data.reshape(nz,-1).T
+
+        return np.ascontiguousarray(out_data.T,dtype=np.float32).reshape(nz,*self.dim2)
+
+    def read_slabs(self,fin,varname):
+        #--- read levels of the window in chunk-aligned slabs (a 3-D block if the variable is not chunked)
+        var     = fin.variables[varname]
+        nz      = self.dim3_1[0]
+        chunk   = var.chunking()
+        if self.tile>0 :
+            # tiled mode : level by level (only levels of the window are in memory)
+            dz  = 1
+        elif chunk=='contiguous' or self.backend=='numpy' :
+            dz  = nz
+        else :
+            dz  = chunk[1]
+        for kz in range(0,nz,dz):
+            with span('netcdf_read',var=varname,level=kz) as info :
+                in_data = self.glorys.read(var,kz,min(kz+dz,nz))
+                info['bytes_read']  = in_data.nbytes
+            yield kz, in_data
+
+    def read_all(self,fin,varnames):
+        #--- slabs of all variables (None at the end of each variable)
+        for varname in varnames :
+            yield from self.read_slabs(fin,varname)
+            yield None
+
+    def h_bands(self,in_data,bands):
+        #--- tiled mode : each band of COCO rows is interpolated from the filled level(s) into a buffer of the band
+        nx  = self.coco.nx
+        for kz, level in enumerate(np.reshape(in_data,(-1,)+self.fill.shape)) :
+            level   = np.ascontiguousarray(level,dtype=np.float32)
+            for j1, j2, table in self.tables :
+                match self.backend :
+                    case 'fortran' :
+                        #--- per-thread buffer for one level of a band
+                        if not hasattr(self.local,'band') :
+                            self.local.band = np.empty(self.nrow*nx,dtype=np.float32)
+                        out = self.local.band[:(j2-j1)*nx].reshape(j2-j1,nx)
+                        self.mytool.h_interp_wgt(level,out,*table)
+                    case 'numpy' :
+                        out = table@level.ravel()
+                bands.put(kz,j1,j2,out)
+
+    def h_level(self,in_data,out_data,nwet=None,varname=None,kz=0,targets=None):
+        #--- targets : INTERP of COCO grids sharing the window (out_data : list of their buffers; None : this grid only)
+        if targets is None :    targets, out_data   = [self], [out_data]
+
+        #--- count wet levels of each column (used for the bottom in vertical interpolation)
+        if nwet is not None :
+            wet = (~np.ma.getmaskarray(in_data)).reshape((-1,)+self.fill.shape).sum(axis=0,dtype=np.int16)
+            with self.lock :    nwet += wet
+
+        match self.backend :
+            case 'fortran' :
+                #--- per-thread buffer for the input level
+                if not hasattr(self.local,'buf') :
+                    self.local.buf  = np.empty(self.fill.shape,dtype=np.float32)
+                #--- remove undef grids with the neighbor grids (important for grids near coastlines)
+                with span('remove_undef',var=varname,level=kz) :
+                    not_undef   = self.fill.main(in_data,out=self.local.buf)
+                #--- horizontal interpolation
+                with span('h_interp',var=varname,level=kz) :
+                    for target, out in zip(targets,out_data) :
+                        if target.tile>0 :  target.h_bands(not_undef,out)
+                        else :              target.h_interp(not_undef,out)
+            case 'numpy' :
+                with span('remove_undef',var=varname,level=kz,nlev=len(in_data)) :
+                    not_undef   = self.remove_undef_np(in_data)
+                with span('h_interp',var=varname,level=kz,nlev=len(in_data)) :
+                    for target, out in zip(targets,out_data) :
+                        if target.tile>0 :  target.h_bands(not_undef,out)
+                        else :              out[:] = target.h_interp_np(not_undef)
+
+    def h_slab(self,in_data,out_data,nwet=None,varname=None,kz0=0,targets=None):
+        #--- fortran : one task per level, numpy : levels are split into the number of workers
+        # varname & kz0 (the first level of the slab) are used only for profiling
+        # targets : same as 'h_level' (each level is filled only once for all targets)
+        if targets is None :    targets, out_data   = [self], [out_data]
+        match self.backend :
+            case 'fortran' :
+                tasks   = [(in_data[kz],[out[kz] for out in out_data],nwet,varname,kz0+kz,targets) for kz in range(len(in_data))]
+            case 'numpy' :
+                bounds  = np.linspace(0,len(in_data),min(self.workers,len(in_data))+1).astype(int)
+                tasks   = [(in_data[k1:k2],[out[k1:k2] for out in out_data],nwet,varname,kz0+int(k1),targets) for k1, k2 in zip(bounds[:-1],bounds[1:])]
+
+        if self.pool is None :
+            for args in tasks : self.h_level(*args)
+            return []
+        return [self.pool.submit(self.h_level,*args) for args in tasks]
 
-        #--- vertical interpolation
-        v_interped  = self.v_interp(h_interped)
+    def get_hbuf(self,ii,varname=None):
+        #--- tiled mode : a new temporary file of bands for each variable (removed when the result is deleted)
+        if self.tile>0 :    return BANDS(self,varname)
 
+        #--- reuse buffers of horizontally interpolated data (ii : number of the variable)
+        while len(self.hbuf)<2 :    self.hbuf.append(np.empty(self.dim3_1,dtype=np.float32))
+        return self.hbuf[ii%2]
+
+    def band_rows(self):
+        #--- rows of COCO grids in a band of the tiled mode (buffers of each variable within 'tile' [byte])
+        # fixed : levels of the window read ahead (data & mask) & those filled by each thread (with masks & indices of undef grids)
+        #         (& wet levels of the window counted by each thread)
+        # each row : levels of horizontally & vertically interpolated data, a work level, a level of each thread
+        #            (& wet levels of COCO grids with indices of their 4 neighbor grids)
+        nthread = max(self.workers,1)
+        level   = self.fill.shape[0]*self.fill.shape[1]
+        fixed   = level*(5*(self.depth+1)+21*nthread+(2+3*nthread if self.bottom else 0))
+        row     = self.coco.nx*(4*(self.dim3_1[0]+self.coco.nz+1+nthread)+(26 if self.bottom else 0))
+        nrow    = (self.tile-fixed)//row
+        if nrow<1 : exit(f'STOP: tile must be at least {(fixed+row)/1024**3:.3g} GB for the window of GLORYS12v1 grids')
+        return int(min(nrow,self.coco.ny))
+
+    def set_tables(self):
+        #--- tiled mode : bands of COCO rows & their tables of horizontal interpolation (made only once)
+        nx      = self.coco.nx
+        self.nrow   = self.band_rows()
+        self.tables = []
+        for j1 in range(0,self.coco.ny,self.nrow) :
+            j2  = min(j1+self.nrow,self.coco.ny)
+            match self.backend :
+                case 'fortran' :
+                    table   = (np.ascontiguousarray(self.lut[:,j1:j2]),np.ascontiguousarray(self.wgt[:,j1:j2]),\
+                               *self.nxy_in,byref(c_int32(nx)),byref(c_int32(j2-j1)))
+                case 'numpy' :
+                    table   = self.hmat[j1*nx:j2*nx]
+            self.tables.append((j1,j2,table))
+
+    def set_min(self,varname,data):
         #--- minimum value to avoid unrealistic values
         match varname :
             case 'to' :
-                v_interped  = np.where(v_interped<-1.8,-1.8,v_interped)
+                np.maximum(data,-1.8,out=data)
             case 'so' :
-                v_interped  = np.where(v_interped<10.0,10.0,v_interped)
-        
-        return v_interped
+                np.maximum(data,10.0,out=data)
+
+    def finish(self,varname,h_interped,futures,nwet=None,out=None,key=None):
+        for future in futures : future.result()
+
+        #--- tiled mode : levels without ocean grids, wet levels & vertical interpolation are done band by band when the result is used
+        if self.tile>0 :
+            h_interped.nwet = nwet
+            return varname, h_interped
+
+        #--- levels without ocean grids in the window (NaN in 'FILL') continue the level above
+        for kz in range(len(h_interped)):
+            if not np.isnan(h_interped[kz].flat[0]) :  continue
+            if kz==0 :  exit(f'STOP: no ocean grids of {varname} in the window of GLORYS12v1 grids')
+            h_interped[kz]  = h_interped[kz-1]
+
+        #--- wet levels of COCO grids : the deepest of the 4 neighbor grids
+        if nwet is not None :
+            ix1, ix2, jy1, jy2  = self.lut-1
+            nwet    = np.maximum.reduce([nwet[jy1,ix1],nwet[jy2,ix1],nwet[jy1,ix2],nwet[jy2,ix2]])
+
+        # out : buffer or BUFFERS (a buffer is taken only now, so it can be written while the next one is made)
+        if isinstance(out,BUFFERS) :    out = out.get()
+        with span('v_interp',var=varname) :
+            v_interped  = self.vremap.main(h_interped,out,nwet)
+        self.set_min(varname,v_interped)
+
+        if key is not None :    self.cache.put(key,v_interped)
+        return varname, v_interped
+
+    def finish_all(self,varname,targets,res,h_interped,futures,nwet,outs,keys):
+        #--- vertical interpolation of targets which are not cached (res : cached data or None)
+        for future in futures : future.result()
+        res = list(res)
+        for ii, buf in h_interped.items() :
+            _, res[ii]  = targets[ii].finish(varname,buf,[],nwet,outs[ii],keys[ii])
+        return varname, res
+
+    def main_multi(self,ifname,varnames,targets,outs=None):
+        #--- interpolate into COCO grids of all targets (INTERP sharing the window of this one)
+        # each level is read & filled only once, then interpolated into all grids
+        # outs : buffer of each target reused for all variables (each result must be used before the next one)
+        for target in targets :
+            if target.fill.shape!=self.fill.shape or target.settings[2:6]!=self.settings[2:6] :
+                exit('STOP: windows of GLORYS12v1 grids are different')
+        outs    = [None]*len(targets) if outs is None else outs
+
+        #--- open the input file only once for all variables
+        with nc.Dataset(ifname,'r') as fin :
+            #--- cached data are mapped from files (variables are yielded in order)
+            keys    = {}
+            cached  = {}
+            for varname in varnames :
+                keys[varname]   = [target.cache.key(ifname,varname,target.settings) if target.cache is not None else None for target in targets]
+                cached[varname] = [target.cache.get(key) if key is not None else None for target, key in zip(targets,keys[varname])]
+            reads   = [varname for varname in varnames if not all([data is not None for data in cached[varname]])]
+
+            #--- slabs of all variables are read ahead in the reader thread (at most 'depth' slabs)
+            slabs   = prefetch(self.read_all(fin,reads),self.depth)
+            try :
+                pending = []
+                for ii, varname in enumerate(varnames) :
+                    res = cached[varname]
+                    if varname not in reads :
+                        while len(pending)>0 :  yield self.finish_all(*pending.pop(0))
+                        yield varname, res
+                        continue
+
+                    todo        = [jj for jj in range(len(targets)) if res[jj] is None]
+                    h_interped  = {jj: targets[jj].get_hbuf(ii,varname) for jj in todo}
+                    nwet        = np.zeros(self.fill.shape,dtype=np.int16) if self.bottom else None
+                    futures     = []
+                    for kz, in_data in iter(slabs.__next__,None) :
+                        futures += self.h_slab(in_data,[h_interped[jj][kz:kz+len(in_data)] for jj in todo],\
+                                               nwet,varname,kz,[targets[jj] for jj in todo])
+                        # tiled mode : at most 'workers' levels are processed at once (levels read ahead are bounded by 'depth')
+                        if self.tile>0 :    wait(futures[:len(futures)-self.workers+1])
+                    pending.append((varname,targets,res,h_interped,futures,nwet,outs,keys[varname]))
+
+                    #--- finish the previous variable while levels of this variable are processed
+                    if len(pending)>1 or self.pool is None :   yield self.finish_all(*pending.pop(0))
+
+                while len(pending)>0 :  yield self.finish_all(*pending.pop(0))
+            finally :
+                slabs.close()
+
+    def main_iter(self,ifname,varnames,out=None):
+        #--- open the input file only once for all variables
+        # out : buffer reused for all variables (each result must be used before the next one)
+        #       or BUFFERS (a buffer is taken for each variable & must be released after used)
+        for varname, res in self.main_multi(ifname,varnames,[self],[out]) :
+            yield varname, res[0]
+
+    def main_all(self,ifname,varnames):
+        return dict(self.main_iter(ifname,varnames))
 
+    def main(self,ifname,varname,out=None):
+        return dict(self.main_iter(ifname,[varname],out))[varname]
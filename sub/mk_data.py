@@ -1,18 +1,117 @@
 import os
 import sys
+import queue
+import threading
 import numpy as np
+from datetime   import datetime, timedelta
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from common         import *
 from interpolation  import *
+from cache          import CACHE
+from spans          import span
+
+def get_days(ymdh1,ymdh2):
+    #--- dates of daily data necessary for times from ymdh1 to ymdh2 (daily data is regarded as data at 00Z)
+    time2   = datetime.strptime(ymdh2,'%Y%m%d%H')
+    days    = [datetime.strptime(ymdh1[:8],'%Y%m%d')]
+    while days[-1]<time2 :
+        days.append(days[-1]+timedelta(days=1))
+    return days
+
+def get_series(ymdh1,ymdh2,every=6):
+    #--- output times & daily data before/after each time (weight of the latter)
+    time1   = datetime.strptime(ymdh1,'%Y%m%d%H')
+    time2   = datetime.strptime(ymdh2,'%Y%m%d%H')
+    series  = []
+    while time1<=time2 :
+        day1    = datetime(time1.year,time1.month,time1.day)
+        wgt     = (time1-day1)/timedelta(days=1)
+        day2    = day1+timedelta(days=1) if wgt>0 else day1
+        series.append((time1,day1,day2,wgt))
+        time1   += timedelta(hours=every)
+    return series
+
+def get_inits(ymdhs,tspan=10):
+    #--- initialized times (ymdh1 -> ymdh2) & nudging times (ymdh2 -> ymdh1)
+    inits   = {}
+    targets = {}
+    for ymdh1 in sorted(set(ymdhs)) :
+        ymdh2   = datetime.strftime(datetime.strptime(ymdh1,'%Y%m%d%H')+timedelta(days=tspan),'%Y%m%d%H')
+        inits[ymdh1]    = ymdh2
+        targets.setdefault(ymdh2,[]).append(ymdh1)
+    return inits, targets
+
+class WRITER :
+    def __init__(self,depth=2):
+        #--- records are encoded & written in order by one thread (depth : number of waiting records, 0 : written by the caller)
+        self.depth  = depth
+        self.queue  = queue.Queue(maxsize=max(depth,1))
+        self.thread = None
+        self.error  = None
+
+    def put(self,func,args,done=None):
+        #--- func(*args) in the writer thread, then done() (e.g. release of the buffer)
+        if self.depth<=0 :
+            func(*args)
+            if done is not None :   done()
+            return
+        if self.error is not None : raise self.error
+        if self.thread is None :
+            self.thread = threading.Thread(target=self.run,daemon=True)
+            self.thread.start()
+        self.queue.put((func,args,done))
+
+    def run(self):
+        while True :
+            item    = self.queue.get()
+            if item is None :   break
+            func, args, done    = item
+            try :
+                if self.error is None : func(*args)
+            except BaseException as err :
+                self.error  = err
+            finally :
+                if done is not None :   done()
+
+    def join(self):
+        #--- wait until all records are written (an error in the writer thread is raised here)
+        if self.thread is not None :
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.error is not None :
+            error, self.error   = self.error, None
+            raise error
+
+    def reset(self):
+        #--- wait for the writer thread & forget its error (e.g. after a failed job)
+        try :
+            self.join()
+        except BaseException :
+            pass
 
 class CONVERT :
-    def __init__(self,topdir,ymdh1,ymdh2):
+    def __init__(self,topdir,ymdh1,ymdh2,backend='fortran',workers=1,bottom=False,csize=0,grid='',cover=None,depth=2,tile=0):
+        #--- directories of the resolution (grid : subdirectory of data/long-run/, data/init/ & data/nudge/; '' : not used)
+        sdir        = f'{grid}/' if grid else ''
+        self.ldir   = f'{topdir}/data/long-run/{sdir}'
+        self.idir   = f'{topdir}/data/init/{sdir}'
+        self.ndir   = f'{topdir}/data/nudge/{sdir}'
+        self.tag    = f'_{grid}' if grid else ''
+        os.makedirs(self.idir,exist_ok=True)
+        os.makedirs(self.ndir,exist_ok=True)
+
         #--- get basic information
-        header  = HEADER(topdir+'/data/long-run/',ymdh1)
-        coco    = COCO(topdir+'/data/GRID/',header)
+        # cover : COCO grids of all resolutions made together (the window of GLORYS12v1 grids covers all of them)
+        header  = HEADER(self.ldir,ymdh1)
+        coco    = COCO(topdir+'/data/GRID/',header) if cover is None else cover[grid]
         glorys  = GLORYS12v1(topdir+'/data/GLORYS12v1/',ymdh1)
-        lut     = LUT(coco,glorys).lut
+        lut     = LUT(coco,glorys,topdir+'/data/GRID/',cover=None if cover is None else list(cover.values()))
+        # cache of interpolated data (csize : limit of the total size [GB], 0 : not used)
+        # not used in the tiled mode (tile : size of the buffer of bands [GB], 0 : not tiled)
+        if csize>0 and tile>0 : print('WARN: cache of interpolated data is not used in the tiled mode')
+        cache   = CACHE(topdir+'/data/cache/',int(csize*1024**3)) if csize>0 and tile==0 else None
 
         #--- shared variables
         self.topdir = topdir
@@ -20,64 +119,122 @@ class CONVERT :
         self.glorys = glorys
         self.lut    = lut
         self.header = header
+        self.interp = INTERP(coco,glorys,lut,backend,workers,topdir+'/data/GRID/',bottom,cache,depth,int(tile*1024**3))
         self.ymdh1  = ymdh1
         self.ymdh2  = ymdh2
         self.odim2  = (coco.ny,coco.nx)
         self.odim3  = (coco.nz,coco.ny,coco.nx)
+        # buffers of interpolated data reused for all variables (pages are allocated when used)
+        # two buffers if pipelined (one is written while the other is made); vbuf is used only while nothing is written
+        self.vbufs  = BUFFERS(self.odim3,2 if depth>0 else 1)
+        self.vbuf   = self.vbufs.bufs[0]
+        # writer thread of records (depth : number of records waiting to be written)
+        self.writer = WRITER(depth)
+
+    def set_time(self,ymdh1,ymdh2):
+        #--- change target times (grids, LUT & interpolation tables are kept)
+        header  = HEADER(self.ldir,ymdh1)
+        for ii in [1,30,33,36] :
+            if header.value[0][ii]!=self.header.value[0][ii] :
+                exit(f'STOP: grid of coco_restart_{ymdh1}.gt3 is different')
+
+        self.header = header
+        self.ymdh1  = ymdh1
+        self.ymdh2  = ymdh2
+
+    def BATCH(self,ymdhs,tspan=10,uv_on=True,dt=72,check=False,every=0):
+        #--- initialized times (ymdh1 -> ymdh2) & nudging times (ymdh2 -> ymdh1)
+        inits, targets  = get_inits(ymdhs,tspan)
+
+        #--- time-interpolated nudging data are made instead of NUDGE (every : interval [hours])
+        if every>0 :    targets = {}
+
+        #--- each GLORYS12v1 file is interpolated only once, even if used for INIT & NUDGE
+        # initialized times at 00Z are made in SERIES with its daily data (every>0)
+        for ymdh in sorted(set(inits)|set(targets)) :
+            if every>0 and ymdh[8:]=='00' : continue
+            res_in  = None
+            if ymdh in inits and ymdh in targets :
+                ifname  = f'{self.topdir}/data/GLORYS12v1/{ymdh[:4]}/uvts_{ymdh}.nc'
+                res_in  = self.interp.main_all(ifname,['to','so'])
+
+            if ymdh in inits :
+                self.set_time(ymdh,inits[ymdh])
+                self.INIT(uv_on,check,res_in)
+            for ymdh1 in targets.get(ymdh,[]) :
+                self.set_time(ymdh1,ymdh)
+                self.NUDGE(dt,check,res_in)
+
+        #--- time-interpolated nudging data of all initialized times (daily data are shared)
+        if every>0 :    self.SERIES(every,dt,sorted(inits.items()),lambda day: self.get_daily(day,inits,uv_on,check))
 
-    def write_data(self,tfout,hidx,odata):
+    def write_data(self,tfout,hidx,odata,done=None):
+        #--- records are written in order by the writer thread (header values are copied now)
+        # done : called after the record is written (e.g. release of the buffer)
+        dsize   = int(self.header.value[hidx][-1])
+        if not np.isscalar(odata) : assert np.size(odata)==dsize
+        self.writer.put(self.write_record,(self.header,tfout,hidx,list(self.header.value[hidx]),odata,dsize),done)
+
+    def write_record(self,header,tfout,hidx,value,odata,dsize):
         #--- write header
-        self.header.write(tfout,hidx)
-        dsize   = np.size(odata)
-        assert int(self.header.value[hidx][-1])==dsize
-        #--- output binary data
-        np.array([8*dsize],dtype='>i4').tofile(tfout)
-        np.array(odata,dtype='>f8').tofile(tfout)
-        np.array([8*dsize],dtype='>i4').tofile(tfout)
-
-    def INIT(self,uv_on=True,check=False):
-        #--- read ice data (used for calculating SHO and copying ice variables)
-        var_ice = {}
-        ifname  = f'{self.topdir}/data/long-run/coco_restart_{self.ymdh1}.gt3'
-        fin     = open(ifname,'rb')
-        for ii in range(24):
-            #--- header
-            top = np.fromfile(fin,dtype='>i4',count=1)[0]
-            tmp = np.fromfile(fin,dtype='>i1',count=np.int32(top))
-            bot = np.fromfile(fin,dtype='>i4',count=1)[0]
-            assert top==bot
-
-            header  = [''.join([chr(jj) for jj in tmp[jj*16:(jj+1)*16]]) for jj in range(64)]
-
-            #--- data
-            top = np.fromfile(fin,dtype='>i4',count=1)[0]
-            var = np.fromfile(fin,dtype='>f8',count=int(top/8))
-            bot = np.fromfile(fin,dtype='>i4',count=1)[0]
-            assert top==bot
-
-            varname = header[2].replace(' ','')
-            if varname in ['AI','HI','TI','HS','TSI'] :
-                var_ice[varname]    = var.reshape(5,self.coco.ny,self.coco.nx)
-        fin.close()
-
-        #--- output file setting
-        ofname  = f'{self.topdir}/data/init/coco_init_{self.ymdh1}.gt3'
-        fout    = open(ofname,'wb')
+        header.write(tfout,hidx,value)
+        #--- output binary data (streamed; a scalar is written as a constant field)
+        with span('write_data',item=value[2].strip()) as info :
+            if np.isscalar(odata) :
+                header.writer.write_const(tfout,float(odata),dsize)
+            elif isinstance(odata,BANDS) :
+                # tiled mode : each band is written into its rows of the record
+                header.writer.write_bands(tfout,odata)
+            else :
+                header.writer.write_data(tfout,odata)
+            info['bytes_written']   = 8*dsize
+
+    def reset(self):
+        #--- writer & buffers of interpolated data are reset after a failed run (CONVERT is reused in 'serve.py')
+        self.writer.reset()
+        self.vbufs  = BUFFERS(self.odim3,len(self.vbufs.bufs))
+        self.vbuf   = self.vbufs.bufs[0]
+
+    def close(self,fout,ofname):
+        #--- all records are written before closing
+        self.writer.join()
+        fout.close()
+        print(f'finished making {ofname}')
+
+    def INIT(self,uv_on=True,check=False,res_in=None):
+        #--- output file setting (U & V are filled with zero if not uv_on)
+        fout    = self.open_init(uv_on)
 
         #--- U, V, T, S (interpolated with ocean reanalysis data)
         ifname  = f'{self.topdir}/data/GLORYS12v1/{self.ymdh1[:4]}/uvts_{self.ymdh1}.nc'
-        for ii, vname in enumerate(['uo','vo','to','so']):
-            # U & V are interpolated
-            if uv_on :
-                res = INTERP(self.coco,self.glorys,self.lut).main(ifname,vname)
-            # U & V are not interpolated (filled with zero)
-            else :
-                # T & S are always interpolated
-                if vname in ['to','so'] :
-                    res = INTERP(self.coco,self.glorys,self.lut).main(ifname,vname)
-                else :
-                    res = np.zeros(self.odim3)
-            self.write_data(fout,ii,res)
+        # T & S are always interpolated, U & V are interpolated only if uv_on
+        vnames  = ['uo','vo','to','so'] if uv_on else ['to','so']
+        # some variables may be already interpolated (res_in : dictionary of interpolated data)
+        res_in  = {} if res_in is None else res_in
+        # the input file is read only once for all variables (each result is written before the next one)
+        # with the writer thread, the next variable is interpolated while the previous one is written
+        interped    = self.interp.main_iter(ifname,[vname for vname in vnames if vname not in res_in],self.vbufs)
+        for vname in vnames :
+            res = res_in[vname] if vname in res_in else next(interped)[1]
+            self.write_init(fout,vname,res)
+
+        self.close_init(fout,check)
+
+    def open_init(self,uv_on=True):
+        #--- records of U, V, T, S are written next ('write_init'), then others ('close_init')
+        fout    = open(f'{self.idir}coco_init_{self.ymdh1}.gt3','wb')
+        if not uv_on :
+            for vname in ['uo','vo'] :  self.write_init(fout,vname,0.0)
+        return fout
+
+    def write_init(self,fout,vname,res):
+        #--- the buffer is released after written (if it is one of the buffers of interpolated data)
+        self.write_data(fout,['uo','vo','to','so'].index(vname),res,lambda res=res: self.vbufs.release(res))
+
+    def close_init(self,fout,check=False):
+        #--- ice data (used for calculating SHO and copying ice variables; read lazily from COCO restart file)
+        var_ice = {varname: self.header.reader[varname] for varname in ['AI','HI','TI','HS','TSI']}
+        ofname  = f'{self.idir}coco_init_{self.ymdh1}.gt3'
 
         #--- SHO (calculated with ice data in COCO restart file)
         res = np.zeros(self.odim2)
@@ -86,68 +243,232 @@ class CONVERT :
         self.write_data(fout,4,res)
 
         #--- others (fill zero or copy COCO restart file)
-        self.write_data(fout,5,np.zeros(self.odim2))    # UBTO
-        self.write_data(fout,6,np.zeros(self.odim2))    # VBTO
-        self.write_data(fout,7,np.zeros(self.odim3))    # WO
+        self.write_data(fout,5,0.0)                     # UBTO
+        self.write_data(fout,6,0.0)                     # VBTO
+        self.write_data(fout,7,0.0)                     # WO
         self.write_data(fout,8,var_ice['AI'])           # AI
         self.write_data(fout,9,var_ice['HI'])           # HI
-        self.write_data(fout,10,np.zeros(self.odim2))   # UI
-        self.write_data(fout,11,np.zeros(self.odim2))   # VI
+        self.write_data(fout,10,0.0)                    # UI
+        self.write_data(fout,11,0.0)                    # VI
         self.write_data(fout,12,var_ice['TI'])          # TI
         self.write_data(fout,13,var_ice['HS'])          # HS
-        self.write_data(fout,14,np.zeros(self.odim2))   # FT
-        self.write_data(fout,15,np.zeros(self.odim2))   # SWABS
-        self.write_data(fout,16,np.zeros(self.odim2))   # FW
-        self.write_data(fout,17,np.zeros(self.odim2))   # FS
-        self.write_data(fout,18,np.zeros(self.odim2))   # TAUX
-        self.write_data(fout,19,np.zeros(self.odim2))   # TAUY
-        self.write_data(fout,20,np.zeros(self.odim3))   # AMV
-        self.write_data(fout,21,np.zeros(self.odim3))   # AHV
-        self.write_data(fout,22,np.zeros(self.odim2))   # PTOP
+        self.write_data(fout,14,0.0)                    # FT
+        self.write_data(fout,15,0.0)                    # SWABS
+        self.write_data(fout,16,0.0)                    # FW
+        self.write_data(fout,17,0.0)                    # FS
+        self.write_data(fout,18,0.0)                    # TAUX
+        self.write_data(fout,19,0.0)                    # TAUY
+        self.write_data(fout,20,0.0)                    # AMV
+        self.write_data(fout,21,0.0)                    # AHV
+        self.write_data(fout,22,0.0)                    # PTOP
         self.write_data(fout,23,var_ice['TSI'])         # TSI
-        fout.close()
-        print(f'finished making {ofname}')
+        self.close(fout,ofname)
 
-        #--- compare original data and created data
+        #--- compare original data and created data (figures of all variables are made in parallel)
         if check :
+            ifname  = f'{self.topdir}/data/GLORYS12v1/{self.ymdh1[:4]}/uvts_{self.ymdh1}.nc'
+            tlev    = 0 # [m]
+            check_all([((ifname,ofname,vname,self.glorys,self.coco,tlev),f'check_{vname}_init{self.tag}.png') for vname in ['to','so']])
+
+    def NUDGE(self,dt=72,check=False,res_in=None):
+        #--- nudging data (interpolated with ocean reanalysis data, the input file is read only once)
+        ifname  = f'{self.topdir}/data/GLORYS12v1/{self.ymdh2[:4]}/uvts_{self.ymdh2}.nc'
+        res_in  = self.interp.main_all(ifname,['to','so']) if res_in is None else res_in
+
+        for vname in ['to','so'] :
+            self.write_nudge(vname,res_in[vname])
+            self.write_coeff(vname,dt)
+
+        #--- compare original data and created data (figures of all variables are made in parallel)
+        if check :
+            tlev    = 0 # [m]
+            check_all([((ifname,self.nudge_name(vname),vname,self.glorys,self.coco,tlev),f'check_{vname}_nudge{self.tag}.png') for vname in ['to','so']])
+
+    def SERIES(self,every=6,dt=72,times=None,daily=None):
+        #--- time-interpolated nudging data from ymdh1 to ymdh2 (every : interval [hours])
+        # times : list of (ymdh1, ymdh2) made together (default : current times)
+        # daily : function returning interpolated data of T & S of a day (default : both variables are interpolated at once)
+        if self.interp.tile>0 : exit('STOP: time-interpolated nudging data are not made in the tiled mode')
+        times   = [(self.ymdh1,self.ymdh2)] if times is None else times
+        daily   = self.get_daily if daily is None else daily
+
+        #--- daily data in order of days (each daily file is interpolated only once for all initialized times)
+        series  = self.open_series(times,every)
+        for day in series['days'] :
+            self.write_series(series,day,daily(day))
+        self.close_series(series,dt)
+
+    def open_series(self,times,every=6):
+        #--- header & nudging files (one record for each time) of each initialized time
+        # records are made when the daily data after them are given ('write_series')
+        series  = {'states':[],'fouts':[],'records':{},'data':{}}
+        for tidx, (ymdh1, ymdh2) in enumerate(times) :
+            self.set_time(ymdh1,ymdh2)
+            series['states'].append((self.header,ymdh1,ymdh2))
+            series['fouts'].append({vname: open(self.series_name(vname),'wb') for vname in ['to','so']})
+            for now, day1, day2, wgt in get_series(ymdh1,ymdh2,every) :
+                series['records'].setdefault(day2,[]).append((now,tidx,day1,wgt))
+        series['days']  = sorted({day for day2, records in series['records'].items() for day in [day2]+[record[2] for record in records]})
+        return series
+
+    def write_series(self,series,day,res_in):
+        #--- records up to the day (days are given in order; data of the previous day are kept)
+        # records of each file are still in order of time
+        data        = series['data']
+        data[day]   = {vname: res_in[vname] for vname in ['to','so']}
+        for old in [old for old in data if old<day-timedelta(days=1)] :
+            data.pop(old)
+
+        for now, tidx, day1, wgt in sorted(series['records'].get(day,[])) :
+            self.header, self.ymdh1, self.ymdh2 = series['states'][tidx]
+            for vname in ['to','so'] :
+                hidx    = ['to','so'].index(vname)+2
+                #--- linear interpolation in time (level by level in the buffer)
+                res = self.vbufs.get()
+                for kz in range(len(res)):
+                    np.multiply(data[day1][vname][kz],1-wgt,out=res[kz])
+                    if wgt>0 :  res[kz] += data[day][vname][kz]*wgt
+
+                self.set_nudge_header(hidx,datetime.strftime(now,'%Y%m%d%H'))
+                self.write_data(series['fouts'][tidx][vname],hidx,res,lambda res=res: self.vbufs.release(res))
+
+    def close_series(self,series,dt=72):
+        #--- close nudging files & make coefficient files
+        for (self.header, self.ymdh1, self.ymdh2), fout in zip(series['states'],series['fouts']) :
             for vname in ['to','so'] :
-                figname = f'check_{vname}_init.png'
-                tlev    = 0 # [m]
-                CHECK(ifname,ofname,vname,self.glorys,self.coco,tlev).main(figname)
-
-    def NUDGE(self,dt=72,check=False):
-        yyyy        = self.ymdh2[:4]
-        yyyymmdd    = self.ymdh2[:8]
-        hh          = self.ymdh2[8:]
-        odir        = f'{self.topdir}/data/nudge/'
-
-        for ii, vname in enumerate(['to','so']) :
-            #--- modify header
-            self.header.value[ii+2][26] = f'{yyyymmdd} {hh}0000 '
-            self.header.value[ii+2][47] = f'{yyyymmdd} {hh}0000 '
-            self.header.value[ii+2][48] = f'{yyyymmdd} {hh}0000 '
-            self.header.value[ii+2][49] = f'00{self.ymdh2}0000'
-
-            #--- nudging file (interpolated with ocean reanalysis data)
-            ifname  = f'{self.topdir}/data/GLORYS12v1/{yyyy}/uvts_{self.ymdh2}.nc'
-            res     = INTERP(self.coco,self.glorys,self.lut).main(ifname,vname)
-
-            ofname  = f'{odir}{vname}_nudge_{self.ymdh2}.gt3'
-            fout    = open(ofname,'wb')
-            self.write_data(fout,ii+2,res)
-            fout.close()
-            print(f'finished making {ofname}')
-
-            #--- compare original data and created data
-            if check :
-                figname = f'check_{vname}_nudge.png'
-                tlev    = 0 # [m]
-                CHECK(ifname,ofname,vname,self.glorys,self.coco,tlev).main(figname)
-
-            #--- body forcing coefficient file [1/s]
-            ofname  = f'{odir}{vname}_coeff_{self.ymdh2}.gt3'
-            fout    = open(ofname,'wb')
-            self.write_data(fout,ii+2,np.full(self.odim3,1/(dt*3600)))
-            fout.close()
-            print(f'finished making {ofname}')
+                self.close(fout[vname],self.series_name(vname))
+                self.write_coeff(vname,dt)
+
+    def get_daily(self,day,inits={},uv_on=True,check=False):
+        #--- interpolated data of T & S of daily data (the input file is read only once)
+        # initialized times of the day (inits : ymdh1 -> ymdh2) are made with the same data
+        ymdh    = datetime.strftime(day,'%Y%m%d%H')
+        ifname  = f'{self.topdir}/data/GLORYS12v1/{day.year}/uvts_{ymdh}.nc'
+        if ymdh not in inits :  return self.interp.main_all(ifname,['to','so'])
+
+        res_in  = self.interp.main_all(ifname,['uo','vo','to','so'] if uv_on else ['to','so'])
+        self.set_time(ymdh,inits[ymdh])
+        self.INIT(uv_on,check,res_in)
+        return res_in
+
+    def set_nudge_header(self,hidx,ymdh=None):
+        ymdh        = self.ymdh2 if ymdh is None else ymdh
+        yyyymmdd    = ymdh[:8]
+        hh          = ymdh[8:]
+
+        #--- modify header
+        self.header.value[hidx][26] = f'{yyyymmdd} {hh}0000 '
+        self.header.value[hidx][47] = f'{yyyymmdd} {hh}0000 '
+        self.header.value[hidx][48] = f'{yyyymmdd} {hh}0000 '
+        self.header.value[hidx][49] = f'00{ymdh}0000'
+
+    def nudge_name(self,vname):
+        return f'{self.ndir}{vname}_nudge_{self.ymdh2}.gt3'
+
+    def series_name(self,vname):
+        return f'{self.ndir}{vname}_nudge_{self.ymdh1}-{self.ymdh2}.gt3'
+
+    def coeff_name(self,vname):
+        return f'{self.ndir}{vname}_coeff_{self.ymdh2}.gt3'
+
+    def outputs(self,every=0):
+        #--- files made for the current times (ymdh1 -> ymdh2)
+        names   = [f'{self.idir}coco_init_{self.ymdh1}.gt3']
+        for vname in ['to','so'] :
+            names   += [self.nudge_name(vname) if every==0 else self.series_name(vname),self.coeff_name(vname)]
+        return names
+
+    def write_nudge(self,vname,res,check=False):
+        hidx    = ['to','so'].index(vname)+2
+        self.set_nudge_header(hidx)
+
+        #--- nudging file
+        ofname  = self.nudge_name(vname)
+        fout    = open(ofname,'wb')
+        self.write_data(fout,hidx,res)
+        self.close(fout,ofname)
+
+        #--- compare original data and created data
+        if check :
+            ifname  = f'{self.topdir}/data/GLORYS12v1/{self.ymdh2[:4]}/uvts_{self.ymdh2}.nc'
+            tlev    = 0 # [m]
+            check_all([((ifname,ofname,vname,self.glorys,self.coco,tlev),f'check_{vname}_nudge{self.tag}.png')])
+
+    def write_coeff(self,vname,dt=72):
+        hidx    = ['to','so'].index(vname)+2
+        self.set_nudge_header(hidx)
+
+        #--- body forcing coefficient file [1/s]
+        ofname  = self.coeff_name(vname)
+        fout    = open(ofname,'wb')
+        self.write_data(fout,hidx,1/(dt*3600))
+        self.close(fout,ofname)
+
+class MULTI :
+    def __init__(self,topdir,ymdh1,ymdh2,grids,backend='fortran',workers=1,bottom=False,csize=0,depth=2):
+        #--- COCO grids of all resolutions (grids : e.g. ['100','025','010'], restart files in data/long-run/[grid]/)
+        cover   = {}
+        for grid in grids :
+            header  = HEADER(f'{topdir}/data/long-run/{grid}/',ymdh1)
+            if header.value[0][1].split()[0]!=f'COCO{grid}' :
+                exit(f'STOP: {topdir}/data/long-run/{grid}/coco_restart_{ymdh1}.gt3 is not COCO{grid}')
+            cover[grid] = COCO(topdir+'/data/GRID/',header)
+
+        #--- CONVERT of each resolution (all of them share the window of GLORYS12v1 grids)
+        self.topdir     = topdir
+        self.converts   = [CONVERT(topdir,ymdh1,ymdh2,backend,workers,bottom,csize,grid,cover,depth) for grid in grids]
+        self.interp     = self.converts[0].interp
+        self.targets    = [convert.interp for convert in self.converts]
+
+    def interp_all(self,ymdh,vnames,inits={},uv_on=True,check=False,keep=True):
+        #--- each level is read & filled only once for all resolutions
+        # INIT of all resolutions (if ymdh is initialized) is written while the next variable is interpolated
+        # T & S are returned in memory if kept (keep), otherwise the buffers of each resolution are reused
+        ifname  = f'{self.topdir}/data/GLORYS12v1/{ymdh[:4]}/uvts_{ymdh}.nc'
+        fouts   = [None]*len(self.converts)
+        if ymdh in inits :
+            for convert in self.converts :  convert.set_time(ymdh,inits[ymdh])
+            fouts   = [convert.open_init(uv_on) for convert in self.converts]
+
+        outs    = None if keep else [convert.vbufs for convert in self.converts]
+        res_ins = [{} for _ in self.converts]
+        for vname, res in self.interp.main_multi(ifname,vnames,self.targets,outs) :
+            for convert, fout, data, res_in in zip(self.converts,fouts,res,res_ins) :
+                if keep and vname in ['to','so'] :  res_in[vname]   = data
+                if fout is not None :   convert.write_init(fout,vname,data)
+
+        for convert, fout in zip(self.converts,fouts) :
+            if fout is not None :   convert.close_init(fout,check)
+        return res_ins
+
+    def BATCH(self,ymdhs,tspan=10,uv_on=True,dt=72,check=False,every=0):
+        #--- same as CONVERT(...).BATCH(...) for all resolutions
+        inits, targets  = get_inits(ymdhs,tspan)
+        if every>0 :    targets = {}
+
+        #--- each GLORYS12v1 file is interpolated only once for INIT & NUDGE of all resolutions
+        # initialized times at 00Z are made in SERIES with its daily data (every>0)
+        for ymdh in sorted(set(inits)|set(targets)) :
+            if every>0 and ymdh[8:]=='00' : continue
+            vnames  = ['uo','vo','to','so'] if uv_on and ymdh in inits else ['to','so']
+            res_ins = self.interp_all(ymdh,vnames,inits,uv_on,check,ymdh in targets)
+            for convert, res_in in zip(self.converts,res_ins) :
+                for ymdh1 in targets.get(ymdh,[]) :
+                    convert.set_time(ymdh1,ymdh)
+                    convert.NUDGE(dt,check,res_in)
+
+        #--- time-interpolated nudging data of all initialized times (daily data are shared by all resolutions)
+        if every>0 :    self.SERIES(every,dt,inits,uv_on,check)
+
+    def SERIES(self,every=6,dt=72,inits={},uv_on=True,check=False):
+        #--- same as CONVERT(...).SERIES(...) for all resolutions (each daily file is interpolated only once)
+        series  = [convert.open_series(sorted(inits.items()),every) for convert in self.converts]
+        for day in series[0]['days'] :
+            ymdh    = datetime.strftime(day,'%Y%m%d%H')
+            vnames  = ['uo','vo','to','so'] if uv_on and ymdh in inits else ['to','so']
+            res_ins = self.interp_all(ymdh,vnames,inits,uv_on,check)
+            for convert, state, res_in in zip(self.converts,series,res_ins) :
+                convert.write_series(state,day,res_in)
 
+        for convert, state in zip(self.converts,series) :
+            convert.close_series(state,dt)
@@ -12,7 +12,14 @@
 !   real(4), dimension(nx_in),              intent(in)  :: lon_in
 !   real(4), dimension(ny_in),              intent(in)  :: lat_in
 !   real(4), dimension(nx_out,ny_out),      intent(out) :: out_data, lon_out, lat_out
-
+!
+! h_interp_wgt(in_data, out_data, lut, wgt, nx_in, ny_in, nx_out, ny_out)
+!   integer(4),                             intent(in)  :: nx_in, ny_in, nx_out, ny_out
+!   integer(4), dimension(nx_out,ny_out,4), intent(in)  :: lut
+!   real(4), dimension(nx_out,ny_out,4),    intent(in)  :: wgt
+!   real(4), dimension(nx_in,ny_in),        intent(in)  :: in_data
+!   real(4), dimension(nx_out,ny_out),      intent(out) :: out_data
+!
 ! v_interp(in_data, out_data, lev_in, lev_out, nx, ny, nz_in, nz_out)
 !   integer(4),                       intent(in)    :: nx, ny, nz_in, nz_out
 !   real(4), dimension(nx,ny,nz_in),  intent(in)    :: in_data
@@ -188,6 +195,36 @@ subroutine h_interp(in_data, out_data, lut, lon_in, lat_in, lon_out, lat_out, nx
 
 end subroutine h_interp
 
+subroutine h_interp_wgt(in_data, out_data, lut, wgt, nx_in, ny_in, nx_out, ny_out) bind(C)
+    implicit none
+
+    integer(4),                             intent(in)  :: nx_in, ny_in, nx_out, ny_out
+    integer(4), dimension(nx_out,ny_out,4), intent(in)  :: lut
+    real(4), dimension(nx_out,ny_out,4),    intent(in)  :: wgt
+    real(4), dimension(nx_in,ny_in),        intent(in)  :: in_data
+    real(4), dimension(nx_out,ny_out),      intent(out) :: out_data
+
+    integer :: ix1, ix2, jy1, jy2,&
+               ix, jy
+
+    do jy = 1, ny_out
+    do ix = 1 ,nx_out
+
+        !--- indices in input data grids
+        ix1 = lut(ix,jy,1); ix2 = lut(ix,jy,2)
+        jy1 = lut(ix,jy,3); jy2 = lut(ix,jy,4)
+
+        !--- horizontal interpolation with precomputed weights
+        out_data(ix,jy) = in_data(ix1,jy1)*wgt(ix,jy,1)+&
+                          in_data(ix1,jy2)*wgt(ix,jy,2)+&
+                          in_data(ix2,jy1)*wgt(ix,jy,3)+&
+                          in_data(ix2,jy2)*wgt(ix,jy,4)
+
+    enddo   ! ix loop
+    enddo   ! jy loop
+
+end subroutine h_interp_wgt
+
 subroutine v_interp(in_data, out_data, lev_in, lev_out, nx, ny, nz_in, nz_out) bind(C)
     implicit none
 
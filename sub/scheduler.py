@@ -0,0 +1,161 @@
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+from datetime   import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import download
+import spans
+from mk_data    import CONVERT, get_days
+
+#--- state of each process (grids, LUT & interpolation tables)
+# made in the parent process before starting workers, so forked workers share it (copy-on-write);
+# other workers make it once from the cached LUT (memory-mapped files in data/GRID/cache/)
+state   = {}
+
+def get_convert(key,ymdh1=None,ymdh2=None):
+    topdir, backend, bottom, csize, symdh1, symdh2  = key
+    if key not in state :   state[key]  = CONVERT(topdir,symdh1,symdh2,backend,bottom=bottom,csize=csize)
+    if ymdh1 is not None :  state[key].set_time(ymdh1,ymdh2)
+    return state[key]
+
+def run_task(func,args):
+    #--- run a task & return spans recorded in this process (empty if not profiled)
+    func(*args)
+    return spans.flush()
+
+def run_download(topdir,ymdh,zlib=False,bbox=None,pack=False,stream=False):
+    download.GLORYS12v1(topdir+'/data/GLORYS12v1/',datetime.strptime(ymdh,'%Y%m%d%H'),zlib,bbox=bbox,pack=pack,stream=stream).main()
+
+def run_interp(key,ymdh,vname,tfname):
+    #--- interpolated data are passed to other tasks through a .npy file (memory-mapped)
+    topdir  = key[0]
+    ifname  = f'{topdir}/data/GLORYS12v1/{ymdh[:4]}/uvts_{ymdh}.nc'
+    convert = get_convert(key)
+    np.save(tfname,convert.interp.main(ifname,vname,convert.vbuf))
+
+def run_init(key,ymdh1,ymdh2,uv_on,check,tfnames):
+    res_in  = {vname: np.load(tfname,mmap_mode='r') for vname, tfname in tfnames.items()}
+    get_convert(key,ymdh1,ymdh2).INIT(uv_on,check,res_in)
+
+def run_nudge(key,ymdh1,ymdh2,vname,check,tfname):
+    get_convert(key,ymdh1,ymdh2).write_nudge(vname,np.load(tfname,mmap_mode='r'),check)
+
+def run_series(key,ymdh1,ymdh2,every,dt,tfnames):
+    #--- daily data interpolated in other tasks (tfnames : files of each day & variable)
+    fmt     = lambda day: datetime.strftime(day,'%Y%m%d%H')
+    daily   = lambda day: {vname: np.load(tfnames[fmt(day),vname],mmap_mode='r') for vname in ['to','so']}
+    get_convert(key,ymdh1,ymdh2).SERIES(every,dt,daily=daily)
+
+def run_coeff(key,ymdh1,ymdh2,vname,dt):
+    get_convert(key,ymdh1,ymdh2).write_coeff(vname,dt)
+
+class SCHEDULER :
+    def __init__(self,topdir,ymdhs,tspan=10,backend='fortran',jobs=1,zlib=False,bbox=None,bottom=False,csize=0,pack=False,stream=False):
+        #--- initialized times (ymdh1 -> ymdh2)
+        self.inits  = {}
+        for ymdh1 in sorted(set(ymdhs)) :
+            self.inits[ymdh1]   = datetime.strftime(datetime.strptime(ymdh1,'%Y%m%d%H')+timedelta(days=tspan),'%Y%m%d%H')
+        symdh1  = min(self.inits)
+
+        #--- shared variables
+        self.topdir = topdir
+        self.jobs   = jobs
+        self.zlib   = zlib
+        self.pack   = pack
+        self.stream = stream
+        self.bbox   = bbox
+        self.key    = (topdir,backend,bottom,csize,symdh1,self.inits[symdh1])
+        self.tasks  = {}
+        self.after  = {}
+
+    def add(self,name,func,args,deps=[],after=None):
+        #--- task (name : unique name, deps : names of necessary tasks, after : function called when all dependents finish)
+        self.tasks[name]    = (func,args,set(deps))
+        if after is not None :  self.after[name]    = after
+
+    def mk_tasks(self,uv_on=True,dt=72,check=False,every=0):
+        tmpdir  = self.tmpdir
+        symdh1  = self.key[4]
+        vnames  = ['uo','vo','to','so'] if uv_on else ['to','so']
+
+        #--- download (the first initialized time is downloaded before starting workers)
+        # daily data from ymdh1 to ymdh2 are necessary for time-interpolated nudging data
+        fmt     = lambda day: datetime.strftime(day,'%Y%m%d%H')
+        days    = {ymdh1: [fmt(day) for day in get_days(ymdh1,ymdh2)] for ymdh1, ymdh2 in self.inits.items()}
+        ymdhs   = set(self.inits)|set(self.inits.values()) if every==0 else set(self.inits)
+        if every>0 :
+            for ymdh1 in self.inits :   ymdhs  |= set(days[ymdh1])
+        ymdhs   = sorted(ymdhs)
+        for ymdh in ymdhs :
+            if ymdh!=symdh1 :   self.add(('download',ymdh),run_download,(self.topdir,ymdh,self.zlib,self.bbox,self.pack,self.stream))
+        dl  = lambda ymdh: [] if ymdh==symdh1 else [('download',ymdh)]
+
+        #--- interpolation (each variable of each file only once)
+        need    = set()
+        for ymdh1, ymdh2 in self.inits.items() :
+            need    |= {(ymdh1,vname) for vname in vnames}
+            if every==0 :   need    |= {(ymdh2,vname) for vname in ['to','so']}
+            else :          need    |= {(ymdh,vname) for ymdh in days[ymdh1] for vname in ['to','so']}
+        tfname  = lambda ymdh, vname: f'{tmpdir}/{vname}_{ymdh}.npy'
+        for ymdh, vname in sorted(need) :
+            self.add(('interp',ymdh,vname),run_interp,(self.key,ymdh,vname,tfname(ymdh,vname)),dl(ymdh),\
+                     after=lambda fname=tfname(ymdh,vname): os.remove(fname))
+
+        #--- INIT, NUDGE & coefficient files
+        for ymdh1, ymdh2 in self.inits.items() :
+            tfnames = {vname: tfname(ymdh1,vname) for vname in vnames}
+            self.add(('init',ymdh1),run_init,(self.key,ymdh1,ymdh2,uv_on,check,tfnames),\
+                     [('interp',ymdh1,vname) for vname in vnames])
+            #--- time-interpolated nudging data use daily data interpolated only once for all initialized times
+            if every>0 :
+                need    = [(ymdh,vname) for ymdh in days[ymdh1] for vname in ['to','so']]
+                self.add(('series',ymdh1),run_series,(self.key,ymdh1,ymdh2,every,dt,{item: tfname(*item) for item in need}),\
+                         [('interp',*item) for item in need])
+                continue
+            for vname in ['to','so'] :
+                self.add(('nudge',ymdh1,vname),run_nudge,(self.key,ymdh1,ymdh2,vname,check,tfname(ymdh2,vname)),\
+                         [('interp',ymdh2,vname)])
+                self.add(('coeff',ymdh1,vname),run_coeff,(self.key,ymdh1,ymdh2,vname,dt))
+
+    def run(self):
+        #--- users of each task (used for removing intermediate files)
+        users   = {name: set() for name in self.tasks}
+        for name, (_, _, deps) in self.tasks.items() :
+            for dep in deps :   users[dep].add(name)
+
+        done    = set()
+        running = {}
+        with ProcessPoolExecutor(max_workers=self.jobs) as pool :
+            while len(done)<len(self.tasks) :
+                #--- submit all tasks whose dependencies are finished
+                for name, (func, args, deps) in self.tasks.items() :
+                    if name not in done and name not in running.values() and deps<=done :
+                        running[pool.submit(run_task,func,args)]    = name
+
+                finished, _ = wait(running,return_when=FIRST_COMPLETED)
+                for future in finished :
+                    name    = running.pop(future)
+                    spans.merge(future.result())
+                    done.add(name)
+                    print(f'finished task {name}')
+
+                    #--- clean up after all users finished
+                    for dep in self.tasks[name][2]|{name} :
+                        if dep in self.after and users[dep]<=done :
+                            self.after.pop(dep)()
+
+    def main(self,uv_on=True,dt=72,check=False,every=0):
+        #--- first data & state shared with workers
+        run_download(self.topdir,self.key[4],self.zlib,self.bbox,self.pack,self.stream)
+        get_convert(self.key)
+
+        self.tmpdir = tempfile.mkdtemp(prefix='tmp_',dir=self.topdir+'/data/')
+        try :
+            self.mk_tasks(uv_on,dt,check,every)
+            self.run()
+        finally :
+            shutil.rmtree(self.tmpdir,ignore_errors=True)
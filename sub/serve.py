@@ -0,0 +1,216 @@
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import argparse
+import threading
+import traceback
+import socketserver
+from datetime   import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import download
+from mk_data        import CONVERT, COCO, HEADER, get_days
+from interpolation  import build_mytool
+
+class HANDLER(socketserver.StreamRequestHandler) :
+    def handle(self):
+        #--- one JSON request per line, one JSON reply per line
+        for line in self.rfile :
+            try :
+                reply   = self.server.owner.request(json.loads(line))
+            except (ValueError,KeyError,TypeError) as err :
+                reply   = {'error':f'bad request ({err})'}
+            self.wfile.write((json.dumps(reply)+'\n').encode())
+
+class SERVER :
+    def __init__(self,topdir,sname,backend='fortran',workers=1,bottom=False,csize=0,zlib=False,pack=False,stream=False,djobs=4):
+        #--- settings shared by all jobs
+        self.topdir     = topdir
+        self.sname      = sname
+        self.backend    = backend
+        self.workers    = workers
+        self.bottom     = bottom
+        self.csize      = csize
+        self.download   = (zlib,pack,stream,djobs)
+
+        #--- warm state of each COCO grid (grid, region of GLORYS12v1 data & CONVERT with LUT & interpolation tables)
+        self.state  = {}
+        #--- jobs (status of each job & queue of job IDs; jobs run one by one in the worker thread)
+        self.jobs   = {}
+        self.queue  = queue.Queue()
+        self.lock   = threading.Lock()
+        self.count  = 0
+
+    def get_state(self,ymdh1):
+        #--- key : COCO grid in the restart file (resolution & grid numbers)
+        header  = HEADER(self.topdir+'/data/long-run/',ymdh1)
+        key     = tuple([header.value[0][ii] for ii in [1,30,33,36]])
+        if key not in self.state :
+            coco    = COCO(self.topdir+'/data/GRID/',header)
+            self.state[key] = {'coco':coco,'bbox':coco.get_bbox(),'convert':None}
+        return self.state[key]
+
+    def run(self,job):
+        #--- same as 'driver.py' for one initialized time (grids & interpolation tables are reused)
+        time1   = datetime.strptime(job['stime'],'%Y%m%d%H')
+        time2   = time1+timedelta(days=job['tspan'])
+        ymdh1   = datetime.strftime(time1,'%Y%m%d%H')
+        ymdh2   = datetime.strftime(time2,'%Y%m%d%H')
+        state   = self.get_state(ymdh1)
+
+        #--- download necessary data
+        zlib, pack, stream, djobs   = self.download
+        nows    = {time1,time2} if job['every']==0 else {time1}|set(get_days(ymdh1,ymdh2))
+        download.prefetch(self.topdir+'/data/GLORYS12v1/',nows,zlib,state['bbox'],djobs,pack,stream)
+
+        #--- INIT & NUDGE (CONVERT is made only for the first job of the grid)
+        if state['convert'] is None :
+            state['convert']    = CONVERT(self.topdir,ymdh1,ymdh2,self.backend,self.workers,self.bottom,self.csize,cover={'':state['coco']})
+        convert = state['convert']
+        try :
+            convert.BATCH([ymdh1],job['tspan'],job['uv_on'],job['dt'],job['check'],job['every'])
+        except BaseException :
+            # an error of the writer (e.g. disk full) is not raised again in later jobs
+            convert.reset()
+            raise
+        return convert.outputs(job['every'])
+
+    def update(self,jid,**items):
+        with self.lock :    self.jobs[jid].update(items)
+
+    def work(self):
+        #--- run queued jobs one by one ('exit' of a failed job is reported as its error)
+        while True :
+            jid = self.queue.get()
+            if jid is None :    break
+            self.update(jid,status='running',start=time.time())
+            try :
+                outputs = self.run(self.jobs[jid]['request'])
+                self.update(jid,status='done',end=time.time(),outputs=outputs)
+            except (Exception,SystemExit) as err :
+                traceback.print_exc()
+                self.update(jid,status='failed',end=time.time(),error=str(err) if str(err) else repr(err))
+            print(f'finished job {jid} ({self.jobs[jid]["status"]})')
+
+    def submit(self,msg):
+        #--- request : stime (yyyymmddHH), tspan=10, check=False, uv_on=True, dt=72, every=0
+        job = { 'stime' :   str(msg['stime']),\
+                'tspan' :   int(msg.get('tspan',10)),\
+                'check' :   bool(msg.get('check',False)),\
+                'uv_on' :   bool(msg.get('uv_on',True)),\
+                'dt'    :   int(msg.get('dt',72)),\
+                'every' :   int(msg.get('every',0)) }
+        if len(job['stime'])!=10 :  return {'error':'\'stime\' must be yyyymmddHH'}
+        datetime.strptime(job['stime'],'%Y%m%d%H')
+
+        with self.lock :
+            self.count  += 1
+            jid = self.count
+            self.jobs[jid]  = {'id':jid,'status':'queued','submit':time.time(),'request':job}
+        self.queue.put(jid)
+        return dict(self.jobs[jid])
+
+    def request(self,msg):
+        #--- cmd : submit, status (all jobs if id is not given) or shutdown
+        match msg.get('cmd','submit') :
+            case 'submit' :
+                return self.submit(msg)
+            case 'status' :
+                with self.lock :
+                    if 'id' not in msg :    return {'jobs':[dict(job) for job in self.jobs.values()]}
+                    if msg['id'] not in self.jobs : return {'error':f'unknown job {msg["id"]}'}
+                    return dict(self.jobs[msg['id']])
+            case 'shutdown' :
+                # queued jobs are finished before the worker stops
+                self.queue.put(None)
+                threading.Thread(target=self.server.shutdown).start()
+                return {'status':'shutdown'}
+            case cmd :
+                return {'error':f'unknown command \'{cmd}\''}
+
+    def main(self):
+        #--- a stale socket file of a stopped server is removed
+        if os.path.exists(self.sname) : os.remove(self.sname)
+        self.server         = socketserver.ThreadingUnixStreamServer(self.sname,HANDLER)
+        self.server.owner   = self
+        worker  = threading.Thread(target=self.work)
+        worker.start()
+        print(f'serving on {self.sname}')
+        try :
+            self.server.serve_forever()
+        finally :
+            self.server.server_close()
+            if os.path.exists(self.sname) : os.remove(self.sname)
+            self.queue.put(None)
+            worker.join()
+
+def send(sname,msg):
+    #--- one request to the server (returns its reply)
+    with socket.socket(socket.AF_UNIX,socket.SOCK_STREAM) as sock :
+        try :
+            sock.connect(sname)
+        except (FileNotFoundError,ConnectionRefusedError) :
+            exit(f'STOP: server is not running on {sname}')
+        sock.sendall((json.dumps(msg)+'\n').encode())
+        return json.loads(sock.makefile('r').readline())
+
+def main(topdir,cmd,argv):
+    #--- python driver.py serve|submit|status|shutdown [options]
+    parser  = argparse.ArgumentParser(prog=f'driver.py {cmd}',description='*** server of driver.py with warm grids & interpolation tables ***')
+    parser.add_argument('--socket',dest='sname',type=str,default=topdir+'/data/serve.sock',help='Unix socket of the server (default : data/serve.sock)')
+    match cmd :
+        case 'serve' :
+            parser.add_argument('--backend',type=str,default='fortran',choices=['fortran','numpy'],help='interpolation backend (default : fortran)')
+            parser.add_argument('--workers','-W',type=int,default=1,help='number of threads for interpolation (default : 1)')
+            parser.add_argument('--bottom',action='store_true',help='continue the deepest value of GLORYS12v1 below its bottom in each column')
+            parser.add_argument('--cache-size',dest='csize',type=float,default=0,help='limit of the cache of interpolated data in data/cache/ [GB] (default : 0, not used)')
+            parser.add_argument('--compress',action='store_true',help='store downloaded data with zlib compression (chunked by level)')
+            parser.add_argument('--pack',action='store_true',help='store downloaded data as int16 with scale_factor & add_offset')
+            parser.add_argument('--stream',action='store_true',help='convert data level by level from the lazily opened dataset (no temporary file)')
+            parser.add_argument('--download-jobs',dest='djobs',type=int,default=4,help='number of processes for downloading data of a job (default : 4)')
+        case 'submit' :
+            parser.add_argument('stime',type=str,nargs='+',help='initialized time(s) (yyyymmddHH; one job for each time)')
+            parser.add_argument('--tspan','-T',type=int,default=10,help='spin-up span [days] (default : 10)')
+            parser.add_argument('--check',action='store_true',help='check flag for interpolation')
+            parser.add_argument('--no-uv',dest='uv_on',action='store_false',help='U & V are filled with zero')
+            parser.add_argument('--nudge-every',dest='every',type=int,default=0,help='interval of time-interpolated nudging data [hours] (default : 0)')
+            parser.add_argument('--wait',action='store_true',help='wait until all jobs finish')
+        case 'status' :
+            parser.add_argument('id',type=int,nargs='?',default=None,help='job ID (all jobs if not given)')
+    args    = parser.parse_args(argv)
+
+    match cmd :
+        case 'serve' :
+            backend = args.backend
+            if backend=='fortran' and build_mytool() is None :
+                print('WARN: numpy backend is used')
+                backend = 'numpy'
+            SERVER(topdir,args.sname,backend,args.workers,args.bottom,args.csize,\
+                   args.compress,args.pack,args.stream,args.djobs).main()
+        case 'submit' :
+            jids    = []
+            for stime in args.stime :
+                reply   = send(args.sname,{'cmd':'submit','stime':stime,'tspan':args.tspan,'check':args.check,\
+                                           'uv_on':args.uv_on,'every':args.every})
+                print(json.dumps(reply))
+                if 'error' in reply :   exit(f'STOP: {reply["error"]}')
+                jids.append(reply['id'])
+            #--- poll the status until all jobs finish
+            failed  = False
+            while args.wait and len(jids)>0 :
+                time.sleep(1)
+                for jid in list(jids) :
+                    reply   = send(args.sname,{'cmd':'status','id':jid})
+                    if reply['status'] in ['done','failed'] :
+                        print(json.dumps(reply))
+                        failed  |= reply['status']=='failed'
+                        jids.remove(jid)
+            if failed : exit('STOP: some jobs failed')
+        case 'status' :
+            msg = {'cmd':'status'} if args.id is None else {'cmd':'status','id':args.id}
+            print(json.dumps(send(args.sname,msg),indent=1))
+        case 'shutdown' :
+            print(json.dumps(send(args.sname,{'cmd':'shutdown'})))
@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import threading
+import tracemalloc
+
+#--- state of this process (spans are recorded only if enabled)
+enabled = False
+records = []
+local   = threading.local()
+lock    = threading.Lock()
+
+class SPAN :
+    def __init__(self,name,args):
+        self.name   = name
+        self.args   = args
+
+    def __enter__(self):
+        #--- the peak of tracemalloc is process-wide, so it is recorded only in the main thread
+        # (spans in other threads, e.g. workers & the writer, do not reset the peak of the main thread)
+        self.traced = threading.current_thread() is threading.main_thread()
+        self.stime  = time.perf_counter()
+        if not self.traced :    return self.args
+
+        #--- peak allocation of the parent span so far is kept before the peak is reset
+        stack   = local.__dict__.setdefault('stack',[])
+        current, peak   = tracemalloc.get_traced_memory()
+        if len(stack)>0 :   stack[-1].peak  = max(stack[-1].peak,peak)
+        tracemalloc.reset_peak()
+        self.start  = current
+        self.peak   = current
+        stack.append(self)
+        self.stime  = time.perf_counter()
+        return self.args
+
+    def __exit__(self,*exc):
+        etime   = time.perf_counter()
+        if self.traced :
+            stack   = local.stack
+            _, peak = tracemalloc.get_traced_memory()
+            self.peak   = max(self.peak,peak)
+            stack.pop()
+            if len(stack)>0 :   stack[-1].peak  = max(stack[-1].peak,self.peak)
+            tracemalloc.reset_peak()
+
+        record  = { 'name'  :   self.name,\
+                    'ts'    :   self.stime,\
+                    'dur'   :   etime-self.stime,\
+                    'pid'   :   os.getpid(),\
+                    'tid'   :   threading.get_ident(),\
+                    'alloc' :   self.peak-self.start if self.traced else None,\
+                    'args'  :   self.args }
+        with lock : records.append(record)
+        return False
+
+class NULLSPAN :
+    #--- no-op span (used if not enabled)
+    def __enter__(self):
+        return {}
+
+    def __exit__(self,*exc):
+        return False
+
+NULL    = NULLSPAN()
+
+def enable():
+    global enabled
+    enabled = True
+    if not tracemalloc.is_tracing() :   tracemalloc.start()
+
+def span(name,**args):
+    #--- with span(name,key=value) as info : ... (info['bytes_read'] & info['bytes_written'] are summed up)
+    if not enabled :    return NULL
+    return SPAN(name,args)
+
+def flush():
+    #--- spans of this process recorded after the last flush (a forked process has records of its parent)
+    global records
+    with lock :
+        mine    = [record for record in records if record['pid']==os.getpid()]
+        records = []
+    return mine
+
+def merge(others):
+    #--- spans recorded in other processes
+    with lock : records.extend(others)
+
+def summary():
+    #--- total of each span name
+    table   = {}
+    for record in records :
+        row = table.setdefault(record['name'],{'count':0,'time':0.0,'read':0,'written':0,'alloc':None})
+        row['count']    += 1
+        row['time']     += record['dur']
+        row['read']     += record['args'].get('bytes_read',0)
+        row['written']  += record['args'].get('bytes_written',0)
+        # peak of spans in the main thread (None if all spans ran in other threads)
+        if record['alloc'] is not None :    row['alloc']    = max(row['alloc'] or 0,record['alloc'])
+    return table
+
+def report(fname=None):
+    if not enabled :    return
+    MB  = 1024**2
+    print('')
+    print('==================================')
+    print('=====  PROFILE OF EACH STAGE =====')
+    print('==================================')
+    print('(peak alloc : process-wide peak during spans in the main thread, - : spans in other threads only;')
+    print(' tracemalloc slows down allocations, so times are longer than those without --profile)')
+    print(f'{"stage":>22} {"count":>7} {"time [s]":>10} {"mean [ms]":>10} {"read [MB]":>10} {"written [MB]":>12} {"peak alloc [MB]":>16}')
+    for name, row in sorted(summary().items(),key=lambda item: -item[1]['time']) :
+        alloc   = f'{row["alloc"]/MB:>16.1f}' if row['alloc'] is not None else f'{"-":>16}'
+        print(f'{name:>22} {row["count"]:>7} {row["time"]:>10.3f} {row["time"]/row["count"]*1e3:>10.3f} '\
+              f'{row["read"]/MB:>10.1f} {row["written"]/MB:>12.1f} {alloc}')
+
+    #--- Chrome trace (chrome://tracing or https://ui.perfetto.dev)
+    if fname :
+        t0      = min([record['ts'] for record in records],default=0.0)
+        events  = [{'name'  :   record['name'],\
+                    'cat'   :   'stage',\
+                    'ph'    :   'X',\
+                    'ts'    :   (record['ts']-t0)*1e6,\
+                    'dur'   :   record['dur']*1e6,\
+                    'pid'   :   record['pid'],\
+                    'tid'   :   record['tid'],\
+                    'args'  :   dict(record['args'],alloc=record['alloc'])} for record in records]
+        with open(fname,'w') as fout :
+            json.dump({'traceEvents':events,'displayTimeUnit':'ms'},fout,default=str)
+        print(f'finished making {fname}')
@@ -0,0 +1,70 @@
+import os
+import sys
+import types
+import shutil
+import pytest
+import numpy as np
+import netCDF4 as nc
+from types  import SimpleNamespace
+
+#--- modules in sub/ are imported as in 'driver.py'
+ndir    = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/sub'
+sys.path.append(ndir)
+
+#--- 'copernicusmarine' is replaced in tests of 'download.py' (no network access)
+if 'copernicusmarine' not in sys.modules :
+    try :
+        import copernicusmarine
+    except ImportError :
+        sys.modules['copernicusmarine'] = types.ModuleType('copernicusmarine')
+
+import interpolation
+from common import GLORYS12v1, LUT
+from interpolation  import INTERP
+
+@pytest.fixture(scope='session')
+def mytool(tmp_path_factory):
+    #--- 'mod_interp.f90' built once per session in a temporary directory (sub/build/ is not touched)
+    # skipped if the compiler is not found; INTERP of the 'fortran' backend loads this shared object
+    if shutil.which(interpolation.FC) is None : pytest.skip(f'{interpolation.FC} is not found')
+    tdir    = str(tmp_path_factory.mktemp('mytool'))
+    shutil.copy(f'{ndir}/mod_interp.f90',tdir)
+    exename = interpolation.build_mytool(tdir)
+    if exename is None :    pytest.skip('mod_interp.f90 is not built')
+    load    = interpolation.load_mytool
+    with pytest.MonkeyPatch.context() as patch :
+        patch.setattr(interpolation,'load_mytool',lambda _ : load(tdir))
+        yield exename
+
+@pytest.fixture(params=['numpy','fortran'])
+def backend(request):
+    #--- interpolation backends ('fortran' : skipped if 'mod_interp.f90' is not built)
+    if request.param=='fortran' :   request.getfixturevalue('mytool')
+    return request.param
+
+@pytest.fixture
+def mk_interp(tmp_path):
+    #--- INTERP of regional COCO grids & the GLORYS12v1-like file in tmp_path (returns INTERP & the file name)
+    # levels in 'land' have no ocean grids; the deepest level is undef
+    def make(backend,land=(),**kwargs):
+        (tmp_path/'2020').mkdir(exist_ok=True)
+        fname   = f'{tmp_path}/2020/uvts_2020070100.nc'
+        lon, lat, lev   = np.arange(100,120,0.25), np.arange(0,20,0.25), [0.5,10,20,30,40,50]
+        nz, ny, nx  = len(lev), len(lat), len(lon)
+        with nc.Dataset(fname,'w') as fout :
+            for name, axis in [('time',[0.0]),('lev',lev),('lat',lat),('lon',lon)] :
+                fout.createDimension(name,len(axis))
+                fout.createVariable(name,'f4',(name,))[:]   = axis
+            for vname in ['uo','vo','to','so'] :
+                var     = fout.createVariable(vname,'f4',('time','lev','lat','lon'),fill_value=np.float32(-9.99E30))
+                data    = np.ma.masked_array(20+np.cos(np.radians(lat))[None,:,None]*np.sin(np.radians(lon))-0.01*np.asarray(lev)[:,None,None]+np.zeros((nz,ny,nx)))
+                data[:,:,:3]    = np.ma.masked
+                for kz in list(land)+[nz-1] :  data[kz] = np.ma.masked
+                var[0]  = data
+
+        glorys  = GLORYS12v1(f'{tmp_path}/','2020070100')
+        lon, lat    = np.meshgrid(np.arange(105,115,0.5),np.arange(5,15,0.5))
+        np.concatenate([lon,lat]).tofile(f'{tmp_path}/grid')
+        coco    = SimpleNamespace(lon=lon,lat=lat,nx=lon.shape[1],ny=lon.shape[0],nz=4,lev=np.array([1,10,20,35.0]),gname=f'{tmp_path}/grid')
+        return INTERP(coco,glorys,LUT(coco,glorys),backend,**kwargs), fname
+    return make
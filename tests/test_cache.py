@@ -0,0 +1,80 @@
+import os
+import json
+import time
+import numpy as np
+from cache  import CACHE
+
+def test_key(tmp_path):
+    #--- key changes with the contents of the source file, the variable & settings
+    cache   = CACHE(f'{tmp_path}/cache/',10**6)
+    fname   = tmp_path/'uvts.nc'
+    fname.write_bytes(b'a')
+    key     = cache.key(fname,'to',['COCO100',False])
+    assert key==cache.key(fname,'to',['COCO100',False])
+    assert key!=cache.key(fname,'so',['COCO100',False])
+    assert key!=cache.key(fname,'to',['COCO100',True])
+    fname.write_bytes(b'b')
+    os.utime(fname,ns=(0,10**9))
+    assert key!=cache.key(fname,'to',['COCO100',False])
+
+def test_source_key(tmp_path):
+    #--- sha1 in the manifest of 'download.py' if it is made for the file (otherwise, the first/last blocks)
+    cache   = CACHE(f'{tmp_path}/cache/',10**6)
+    fname   = tmp_path/'uvts_2020070100.nc'
+    fname.write_bytes(bytes(3*1024))
+    stat    = os.stat(fname)
+    with open(tmp_path/'uvts_2020070100.json','w') as fout :
+        json.dump({'size':stat.st_size,'mtime':stat.st_mtime_ns,'sha1':'0123'},fout)
+    assert cache.source_key(fname)=='0123'
+
+    #--- a file touched after the manifest : only the first & last blocks are read
+    os.utime(fname,ns=(0,10**9))
+    key     = cache.source_key(fname,bsize=1024)
+    assert key!='0123'
+    with open(fname,'r+b') as fout :
+        fout.seek(1024)
+        fout.write(b'x')
+    os.utime(fname,ns=(0,10**9))
+    assert CACHE(f'{tmp_path}/cache/',10**6).source_key(fname,bsize=1024)==key
+    with open(fname,'r+b') as fout :
+        fout.seek(3*1024-1)
+        fout.write(b'x')
+    os.utime(fname,ns=(0,10**9))
+    assert CACHE(f'{tmp_path}/cache/',10**6).source_key(fname,bsize=1024)!=key
+
+def test_get_put(tmp_path):
+    cache   = CACHE(f'{tmp_path}/cache/',10**6)
+    data    = np.arange(12,dtype='f4').reshape(3,4)
+    assert cache.get('a') is None
+    cache.put('a',data)
+    np.testing.assert_array_equal(cache.get('a'),data)
+    assert not any(['.tmp' in name for name in os.listdir(cache.tdir)])
+
+def test_evict(tmp_path):
+    #--- least recently used data are removed until the total size is within the limit (get() is a use)
+    data    = np.zeros(1000,dtype='f4')
+    np.save(tmp_path/'size.npy',data)
+    size    = os.path.getsize(tmp_path/'size.npy')
+    cache   = CACHE(f'{tmp_path}/cache/',3*size)
+    for key in ['a','b','c'] :
+        cache.put(key,data)
+        time.sleep(0.01)
+    assert cache.get('a') is not None
+    time.sleep(0.01)
+    cache.put('d',data)
+    assert sorted(os.listdir(cache.tdir))==['a.npy','c.npy','d.npy']
+
+    #--- a smaller limit is applied when the cache is opened
+    CACHE(f'{tmp_path}/cache/',size)
+    assert os.listdir(cache.tdir)==['d.npy']
+
+def test_interp(tmp_path,mk_interp):
+    #--- interpolated data are reused (same as the data made without the cache)
+    cache   = CACHE(f'{tmp_path}/cache/',10**8)
+    interp, fname   = mk_interp('numpy',cache=cache)
+    res     = np.array(interp.main(fname,'to'))
+    assert len(os.listdir(cache.tdir))==1
+    cached  = interp.main(fname,'to')
+    assert isinstance(cached,np.memmap)
+    np.testing.assert_array_equal(cached,res)
+    np.testing.assert_array_equal(mk_interp('numpy')[0].main(fname,'to'),res)
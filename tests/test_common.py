@@ -0,0 +1,145 @@
+import os
+import numpy as np
+import netCDF4 as nc
+from types  import SimpleNamespace
+from gtool3 import GT3WRITER
+from common import is_global, circular_span, COCO, WINDOW, LUT, CHECK, check_all
+
+def test_is_global_float32():
+    #--- 1/12 degree from 180W (float32 axis : nx*dlon is not exactly 360)
+    lon = np.arange(-180,180,1/12).astype(np.float32)
+    assert is_global(lon)
+    assert is_global(np.mod(lon,360))
+
+def test_is_global_region():
+    lon = np.arange(100,160,1/12).astype(np.float32)
+    assert not is_global(lon)
+    assert not is_global(np.arange(0,359,1/12))
+
+def mk_glorys(lon0=0.0,dlon=1/12,nz=3):
+    #--- global GLORYS12v1-like axes (float32 as in downloaded files)
+    lon = np.arange(lon0,lon0+360-dlon/2,dlon).astype(np.float32)
+    lat = np.arange(-80,90+1/24,1/12).astype(np.float32)
+    return SimpleNamespace(lon=lon,lat=lat,lev=np.arange(nz,dtype='f8'),nx=len(lon),ny=len(lat),nz=nz,npad=0)
+
+def mk_coco(west,east,south,north,dres,gname='grid'):
+    lon, lat    = np.meshgrid(np.arange(west+dres/2,east,dres),np.arange(south+dres/2,north,dres))
+    return SimpleNamespace(lon=lon,lat=lat,nx=lon.shape[1],ny=lon.shape[0],nz=3,gname=gname)
+
+def test_window_global_coco():
+    #--- a global 1 degree grid leaves a gap of about one COCO grid : all longitudes are wrapped around
+    glorys  = mk_glorys()
+    window  = LUT(mk_coco(0,360,-70,70,1.0),glorys).window
+    assert (window.ix0,window.nx,window.periodic)==(0,glorys.nx,True)
+
+def test_window_region():
+    #--- a regional grid crossing 0E : the smallest window (not periodic)
+    glorys  = mk_glorys()
+    window  = LUT(mk_coco(-20,30,-10,10,0.5),glorys).window
+    assert not window.periodic
+    assert window.nx<glorys.nx//2
+    assert window.lon[0]<=340.25 and window.lon[-1]>=389.75
+
+def test_circular_span():
+    occ = np.zeros(12,dtype=bool)
+    occ[[3,4,6]]    = True
+    assert circular_span(occ)==(3,4)
+    assert circular_span(occ,halo=1)==(2,6)
+    #--- across the end of bins (the largest gap is used)
+    occ = np.zeros(12,dtype=bool)
+    occ[[0,1,10]]   = True
+    assert circular_span(occ)==(10,4)
+    #--- all bins are covered with the halo
+    assert circular_span(np.arange(12)%3==0,halo=1) is None
+
+def test_bbox():
+    #--- west & east in 180W - 180E (None if all longitudes or crossing 180E)
+    bbox    = lambda *args: COCO.get_bbox(mk_coco(*args))
+    assert bbox(100,160,-10,10,0.5)==(99.5,160.5,-10.25,10.25)
+    assert bbox(-20,30,-10,10,0.5)==(-20.5,30.5,-10.25,10.25)
+    assert bbox(170,190,80,89.9,0.5)==(None,None,79.75,90.0)
+    assert bbox(0,360,-70,70,1.0)==(None,None,-70.0,70.0)
+
+def test_window_read():
+    #--- a window across 360E is read in two parts (longitudes are continuous)
+    glorys  = mk_glorys(dlon=30.0)
+    var     = np.ma.masked_array(np.arange(glorys.ny*glorys.nx).reshape(1,1,glorys.ny,glorys.nx))
+    window  = WINDOW(glorys,10,4,2,3)
+    np.testing.assert_array_equal(window.lon,[300,330,360,390])
+    np.testing.assert_array_equal(window.read(var,0,1),var[0,:,2:5,[10,11,0,1]].transpose(1,2,0))
+
+def test_lut_cache(tmp_path):
+    #--- the window, table & weights are reused; a changed COCO grid file makes them again
+    glorys  = mk_glorys()
+    coco    = mk_coco(100,120,-10,10,0.5,gname=f'{tmp_path}/grid_050_z3.stream')
+    np.concatenate([coco.lon,coco.lat]).tofile(coco.gname)
+    made    = LUT(coco,glorys,f'{tmp_path}/')
+    tdir    = made.cache_dir(f'{tmp_path}/',coco,glorys)
+    assert os.path.isfile(tdir+'meta.json')
+
+    cached  = LUT(coco,glorys,f'{tmp_path}/')
+    assert isinstance(cached.lut,np.memmap)
+    np.testing.assert_array_equal(cached.lut,made.lut)
+    np.testing.assert_array_equal(cached.wgt,made.wgt)
+    window  = lambda lut: (lut.window.ix0,lut.window.nx,lut.window.jy0,lut.window.ny,lut.window.periodic)
+    assert window(cached)==window(made)
+
+    #--- touched but same contents : reused; different contents : made again
+    os.utime(coco.gname,ns=(0,10**9))
+    assert cached.load(tdir,coco,glorys)
+    (coco.lon+0.1).tofile(coco.gname)
+    assert not cached.load(tdir,coco,glorys) and not os.path.isdir(tdir)
+
+def test_raster():
+    #--- average in each cell (the same for regular & 2-D grids; cells without valid grids are masked)
+    fig     = SimpleNamespace(dres=1.0,nlon=360,nlat=180)
+    grid    = SimpleNamespace(lon=np.arange(100,102,0.25),lat=np.arange(-10,-8,0.25))
+    var     = np.random.default_rng(0).random((len(grid.lat),len(grid.lon)))
+    valid   = np.ones(var.shape,dtype=bool)
+    valid[0,0]  = False
+    ras1    = CHECK.raster(fig,var,valid,grid)
+    lon, lat    = np.meshgrid(grid.lon,grid.lat)
+    ras2    = CHECK.raster(fig,var,valid,SimpleNamespace(lon=lon,lat=lat))
+    np.testing.assert_allclose(ras1.filled(np.nan),ras2.filled(np.nan))
+    assert ras1.count()==4
+    np.testing.assert_allclose(ras1[80,100],var[:4,:4][valid[:4,:4]].mean())
+    np.testing.assert_allclose(ras1[81,101],var[4:,4:].mean())
+
+def test_raster_curvilinear():
+    #--- grids sparser than the average (about 1.35 degree) : no empty cells at the default resolution
+    lon, lat    = np.meshgrid(np.arange(0.5,360,1.0),np.arange(-59.5,60,1.0))
+    lon, lat    = lon+20*np.sin(np.radians(lon)), lat+10*np.sin(np.radians(3*lat))+0.4*np.sin(np.radians(3*lon))
+    grid    = SimpleNamespace(lon=lon,lat=lat)
+    check   = CHECK.__new__(CHECK)
+    ones    = np.ones(lon.shape)
+    for dres, nempty in [(1.0,True),(0,False)] :
+        check.dres  = check.resolution(grid,grid,dres)
+        check.nlon, check.nlat  = int(np.ceil(360/check.dres)), int(np.ceil(180/check.dres))
+        ras     = check.raster(ones,ones>0,grid)
+        jy1, jy2    = int(np.ceil((lat.min()+90)/check.dres)), int((lat.max()+90)/check.dres)
+        assert (np.sum(ras.mask[jy1:jy2])>0)==nempty
+    assert np.isclose(360/check.dres,round(360/check.dres)) and check.dres>2
+
+def test_check_all(tmp_path):
+    #--- figures are drawn in processes from data read in the main process
+    lon, lat, lev   = np.arange(100,110,0.5), np.arange(0,10,0.5), np.array([0.5,10])
+    with nc.Dataset(tmp_path/'uvts.nc','w') as fout :
+        for name, axis in [('time',[0.0]),('lev',lev),('lat',lat),('lon',lon)] :
+            fout.createDimension(name,len(axis))
+        for vname in ['to','so'] :
+            fout.createVariable(vname,'f4',('time','lev','lat','lon'))[:]  = 20.0
+    glorys  = SimpleNamespace(lon=lon,lat=lat,lev=lev,nx=len(lon),ny=len(lat),nz=len(lev))
+    coco    = mk_coco(100,110,0,10,1.0)
+    coco.lev    = lev
+    with open(tmp_path/'data.gt3','wb') as fout :
+        for vname in ['TO','SO'] :
+            header  = [' '*16]*64
+            for ii, value in [(2,vname),(30,coco.nx),(33,coco.ny),(36,2),(37,'UR8'),(63,2*coco.nx*coco.ny)] :
+                header[ii]  = f'{value:<16}'
+            GT3WRITER().write_header(fout,header)
+            GT3WRITER().write_data(fout,np.full((2,coco.ny,coco.nx),21.0))
+    checks  = [((str(tmp_path/'uvts.nc'),str(tmp_path/'data.gt3'),vname,glorys,coco,0),str(tmp_path/f'check_{vname}.png')) for vname in ['to','so']]
+    check_all(checks,workers=2)
+    assert all(os.path.getsize(figname)>0 for args, figname in checks)
+    title, panels   = CHECK(*checks[0][0]).figure()
+    assert len(panels)==3 and np.allclose(panels[2]['data'].compressed(),1.0)
@@ -0,0 +1,145 @@
+import os
+import json
+import numpy as np
+import netCDF4 as nc
+import pytest
+from datetime   import datetime
+from types      import SimpleNamespace
+import download
+
+NOW = datetime(2020,7,1)
+
+def mk_raw(fname,lon,lat,nz=2):
+    #--- synthetic file of 'copernicusmarine.subset' (land : NaN at the first grid)
+    with nc.Dataset(fname,'w') as fout :
+        for name, axis in [('time',[0.0]),('depth',np.arange(1,nz+1)*10.0),('latitude',lat),('longitude',lon)] :
+            fout.createDimension(name,len(axis))
+            fout.createVariable(name,'f4',(name,))[:]   = axis
+        for ii, vname in enumerate(['uo','vo','thetao','so']) :
+            var = fout.createVariable(vname,'f4',('time','depth','latitude','longitude'),fill_value=np.float32(np.nan))
+            data    = np.broadcast_to(ii+np.mod(np.asarray(lon,dtype='f8'),360)/360,(1,nz,len(lat),len(lon))).copy()
+            data[:,:,0,0]   = np.nan
+            var[:]  = data
+
+@pytest.fixture
+def raw(tmp_path,monkeypatch):
+    #--- 'subset' copies the synthetic file (calls are counted)
+    calls   = []
+    def subset(output_filename,**kwargs):
+        calls.append(kwargs)
+        with open(raw.fname,'rb') as fin, open(output_filename,'wb') as fout :
+            fout.write(fin.read())
+    monkeypatch.setattr(download.cm,'subset',subset,raising=False)
+    raw.fname   = str(tmp_path/'raw.nc')
+    raw.calls   = calls
+    return raw
+
+def test_global_float32(tmp_path,raw):
+    #--- 1/12 degree from 180W in float32 : rotated to 0 - 360E & reused in the next run
+    lon = np.arange(-180,180,1/12).astype(np.float32)
+    mk_raw(raw.fname,lon,np.linspace(-10,10,3))
+    download.GLORYS12v1(str(tmp_path),NOW,bbox=(None,None,-10.0,10.0)).main()
+    with nc.Dataset(f'{tmp_path}/2020/uvts_2020070100.nc') as fin :
+        olon    = fin.variables['lon'][:]
+        data    = fin.variables['uo'][0,0]
+    assert abs(olon[0])<1e-4 and olon[-1]<360
+    assert np.all(np.diff(olon)>0)
+    np.testing.assert_allclose(data[1],np.mod(olon,360)/360,atol=1e-6)
+
+    download.GLORYS12v1(str(tmp_path),NOW,bbox=(None,None,-10.0,10.0)).main()
+    assert len(raw.calls)==1
+
+def test_south_padding(tmp_path,raw):
+    #--- data from 80S without the North Pole : 90S - 80S are padded with the same interval
+    lat = np.arange(-80,20,1/12).astype(np.float32)
+    mk_raw(raw.fname,np.arange(100,110,1/12).astype(np.float32),lat)
+    download.GLORYS12v1(str(tmp_path),NOW,bbox=(100.0,110.0,-90.0,20.0)).main()
+    with nc.Dataset(f'{tmp_path}/2020/uvts_2020070100.nc') as fin :
+        olat    = np.array(fin.variables['lat'][:],dtype='f8')
+        data    = fin.variables['to'][0,0]
+    assert len(olat)==len(lat)+120
+    np.testing.assert_allclose(olat[0],-90,atol=1e-4)
+    np.testing.assert_allclose(np.diff(olat),1/12,atol=1e-4)
+    assert data[:120].mask.all() and not data[121].mask.any()
+
+def read_all(fname):
+    with nc.Dataset(fname) as fin :
+        return {vname: fin.variables[vname][:] for vname in ['lon','lat','lev','uo','vo','to','so']}
+
+@pytest.mark.parametrize('options',[{'kchunk':1},{'zlib':True},{'pack':True},{'stream':True}])
+def test_modes(tmp_path,raw,monkeypatch,options):
+    #--- converted data are the same in all modes (packed data : about 1E-3 of error)
+    mk_raw(raw.fname,np.arange(100,110,1/4).astype(np.float32),np.arange(-10,10,1/4).astype(np.float32),nz=11)
+    def open_dataset(**kwargs):
+        #--- lazily opened dataset (indexed data have 'values' as xarray.DataArray)
+        fin = nc.Dataset(raw.fname)
+        class DS :
+            variables   = list(fin.variables)
+            def __getitem__(self,name):
+                return ARRAY(fin.variables[name])
+            def close(self):
+                fin.close()
+        return DS()
+    class ARRAY :
+        def __init__(self,var):
+            self.var    = var
+            self.shape  = var.shape
+        def __getitem__(self,idx):
+            return SimpleNamespace(values=np.ma.filled(self.var[idx].astype('f4'),np.nan))
+    monkeypatch.setattr(download.cm,'open_dataset',open_dataset,raising=False)
+
+    bbox    = (100.0,110.0,-10.0,10.0)
+    download.GLORYS12v1(f'{tmp_path}/normal',NOW,bbox=bbox).main()
+    download.GLORYS12v1(f'{tmp_path}/mode',NOW,bbox=bbox,**options).main()
+    normal  = read_all(f'{tmp_path}/normal/2020/uvts_2020070100.nc')
+    mode    = read_all(f'{tmp_path}/mode/2020/uvts_2020070100.nc')
+    for vname in normal :
+        assert (normal[vname].mask==mode[vname].mask).all()
+        np.testing.assert_allclose(mode[vname],normal[vname],atol=1e-3 if options.get('pack') else 0)
+    assert len(raw.calls)==(1 if options.get('stream') else 2)
+
+@pytest.mark.parametrize('south',[-80,-10])
+def test_compact_lat(tmp_path,raw,south):
+    #--- latitudes of compact files (padded grids are implicit) are the same as those of normal files
+    from common import GLORYS12v1 as GRID
+    mk_raw(raw.fname,np.arange(100,110,1/12).astype(np.float32),np.arange(south,20,1/12).astype(np.float32))
+    bbox    = (100.0,110.0,-90.0,20.0)
+    download.GLORYS12v1(f'{tmp_path}/normal',NOW,bbox=bbox).main()
+    download.GLORYS12v1(f'{tmp_path}/compact',NOW,bbox=bbox,pack=True).main()
+    normal  = GRID(f'{tmp_path}/normal/','2020070100')
+    compact = GRID(f'{tmp_path}/compact/','2020070100')
+    np.testing.assert_array_equal(normal.lat,compact.lat)
+    assert compact.npad==(120 if south==-80 else 0)
+
+def test_interrupted(tmp_path,raw,monkeypatch):
+    #--- an interrupted conversion leaves no output, and the next run downloads & completes it
+    mk_raw(raw.fname,np.arange(100,110,1/12).astype(np.float32),np.linspace(-10,10,3))
+    bbox    = (100.0,110.0,-10.0,10.0)
+    ofname  = f'{tmp_path}/2020/uvts_2020070100.nc'
+    modify  = download.GLORYS12v1.modify_data
+    def broken(self,tfin,tfout,iname):
+        if iname=='so' :    raise KeyboardInterrupt
+        modify(self,tfin,tfout,iname)
+    monkeypatch.setattr(download.GLORYS12v1,'modify_data',broken)
+    with pytest.raises(KeyboardInterrupt) :
+        download.GLORYS12v1(str(tmp_path),NOW,bbox=bbox).main()
+    assert sorted(os.listdir(f'{tmp_path}/2020'))==[]
+
+    monkeypatch.setattr(download.GLORYS12v1,'modify_data',modify)
+    download.GLORYS12v1(str(tmp_path),NOW,bbox=bbox).main()
+    with open(f'{tmp_path}/2020/uvts_2020070100.json') as fin :
+        meta    = json.load(fin)
+    assert meta['sha1']==download.checksum(ofname)
+    assert len(raw.calls)==2
+
+    #--- complete data is reused, and a modified file is downloaded again
+    download.GLORYS12v1(str(tmp_path),NOW,bbox=bbox).main()
+    assert len(raw.calls)==2
+    with open(ofname,'ab') as fout :    fout.write(b'0')
+    download.GLORYS12v1(str(tmp_path),NOW,bbox=bbox).main()
+    assert len(raw.calls)==3
+
+def test_tmpname(tmp_path):
+    #--- temporary files are unique for each process
+    dl  = download.GLORYS12v1(str(tmp_path),NOW)
+    assert str(download.os.getpid()) in dl.tmpname and str(download.os.getpid()) in dl.partname
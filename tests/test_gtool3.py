@@ -0,0 +1,75 @@
+import numpy as np
+from gtool3 import GT3READER, GT3WRITER
+
+def mk_header(name,nx,ny,nz):
+    header      = [' '*16]*64
+    header[2]   = f'{name:<16}'
+    header[30]  = f'{nx:<16}'
+    header[33]  = f'{ny:<16}'
+    header[36]  = f'{nz:<16}'
+    header[37]  = f'{"UR8":<16}'
+    header[63]  = f'{nx*ny*nz:<16}'
+    return header
+
+class BANDS :
+    #--- rows of data in bands (same interface as 'interpolation.BANDS')
+    def __init__(self,data,nrow):
+        self.data   = data
+        self.shape  = data.shape
+        self.nrow   = nrow
+
+    def __iter__(self):
+        for j1 in range(0,self.shape[1],self.nrow) :
+            yield j1, min(j1+self.nrow,self.shape[1]), self.data[:,j1:j1+self.nrow]
+
+def test_round_trip(tmp_path):
+    #--- data, constant & bands (small buffer : data are written in several chunks)
+    nz, ny, nx  = 3, 7, 5
+    data    = np.random.default_rng(0).random((nz,ny,nx)).astype(np.float32)
+    writer  = GT3WRITER(bsize=8*16)
+    with open(tmp_path/'test.gt3','wb') as fout :
+        writer.write_header(fout,mk_header('TO',nx,ny,nz))
+        writer.write_data(fout,data)
+        writer.write_header(fout,mk_header('FT',nx,ny,1))
+        writer.write_const(fout,1.5,nx*ny)
+        writer.write_header(fout,mk_header('SO',nx,ny,nz))
+        writer.write_bands(fout,BANDS(data*2,3))
+        writer.write_header(fout,mk_header('AI',nx,ny,1))
+        writer.write_data(fout,data[0])
+
+    reader  = GT3READER(str(tmp_path/'test.gt3'))
+    assert [record['name'] for record in reader.records]==['TO','FT','SO','AI']
+    np.testing.assert_array_equal(reader['TO'],data)
+    np.testing.assert_array_equal(reader['FT'],1.5)
+    np.testing.assert_array_equal(reader['SO'],data*2)
+    np.testing.assert_array_equal(reader['AI'][0],data[0])
+
+def test_reader_index(tmp_path):
+    #--- UR4 & UR8 records (the first record of each name is indexed; data are memory-mapped)
+    nz, ny, nx  = 2, 3, 4
+    data    = np.arange(nz*ny*nx,dtype='>f4').reshape(nz,ny,nx)
+    with open(tmp_path/'test.gt3','wb') as fout :
+        header      = mk_header('TO',nx,ny,nz)
+        header[37]  = f'{"UR4":<16}'
+        GT3WRITER().write_header(fout,header)
+        marker      = np.array([4*data.size],dtype='>i4').tobytes()
+        fout.write(marker+data.tobytes()+marker)
+        GT3WRITER().write_header(fout,mk_header('TO',nx,ny,1))
+        GT3WRITER().write_data(fout,data[0]*2)
+
+    reader  = GT3READER(str(tmp_path/'test.gt3'))
+    assert len(reader.records)==2 and 'TO' in reader and 'SO' not in reader
+    assert isinstance(reader['TO'],np.memmap) and reader['TO'].dtype==np.dtype('>f4')
+    np.testing.assert_array_equal(reader['TO'],data)
+    assert reader.records[1]['offset']==reader.records[0]['offset']+4*data.size+4+(4+1024+4)+4
+
+def test_writer_bytes(tmp_path):
+    #--- the same bytes as the whole data converted at once (buffer smaller than the data)
+    data    = np.random.default_rng(0).random((3,5,7)).astype(np.float32)
+    marker  = np.array([8*data.size],dtype='>i4').tobytes()
+    with open(tmp_path/'data.bin','wb') as fout :
+        GT3WRITER(bsize=8*10).write_data(fout,data)
+    assert (tmp_path/'data.bin').read_bytes()==marker+data.astype('>f8').tobytes()+marker
+    with open(tmp_path/'const.bin','wb') as fout :
+        GT3WRITER(bsize=8*10).write_const(fout,0.5,data.size)
+    assert (tmp_path/'const.bin').read_bytes()==marker+np.full(data.size,0.5,dtype='>f8').tobytes()+marker
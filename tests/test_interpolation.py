@@ -0,0 +1,253 @@
+import os
+import shutil
+import threading
+import tracemalloc
+import numpy as np
+import pytest
+from ctypes import CDLL, POINTER, byref, c_int32, c_float
+from types  import SimpleNamespace
+from common import GLORYS12v1, LUT
+from interpolation  import FILL, VREMAP, INTERP, BANDS, BUFFERS, prefetch, lib_name, build_mytool, load_mytool
+
+def mk_fill(ny,nx,periodic=False):
+    return FILL(SimpleNamespace(ny=ny,nx=nx,periodic=periodic,lon=np.arange(nx),lat=np.arange(ny),lev=[0]))
+
+def test_fill_row():
+    #--- undef grids in a row : edge values (average at the center)
+    fill    = mk_fill(1,7)
+    data    = np.ma.masked_array([[1,0,0,0,0,0,2]],mask=[[0,1,1,1,1,1,0]],dtype='f4')
+    np.testing.assert_allclose(fill.main(data)[0],[1,1,1,1.5,2,2,2])
+
+def test_fill_pole():
+    #--- all undef rows near the poles : the nearest non-undef row
+    fill    = mk_fill(5,3)
+    data    = np.ma.masked_all((5,3),dtype='f4')
+    data[1:4]   = np.arange(9).reshape(3,3)
+    out     = fill.main(data)
+    np.testing.assert_array_equal(out[0],out[1])
+    np.testing.assert_array_equal(out[4],out[3])
+
+def test_fill_no_source():
+    #--- all undef rows whose source row is also undef : STOP (same as 'remove_undef')
+    fill    = mk_fill(5,3)
+    data    = np.ma.masked_all((5,3),dtype='f4')
+    data[0] = 1.0
+    with pytest.raises(SystemExit) :    fill.main(data)
+
+def test_fill_land_level():
+    #--- no ocean grids at the level : NaN
+    out = mk_fill(4,3).main(np.ma.masked_all((4,3),dtype='f4'))
+    assert np.isnan(out).all()
+
+def test_lib_name(tmp_path):
+    #--- a new shared object is built if the source changes
+    (tmp_path/'mod_interp.f90').write_text('! version 1\n')
+    name1   = lib_name(str(tmp_path))
+    assert name1==lib_name(str(tmp_path)) and name1.startswith(f'{tmp_path}/build/mod_interp_')
+    (tmp_path/'mod_interp.f90').write_text('! version 2\n')
+    assert lib_name(str(tmp_path))!=name1
+
+def test_build(tmp_path,mytool):
+    #--- built only once for each version
+    shutil.copy(os.path.dirname(mytool)+'/../mod_interp.f90',tmp_path)
+    exename = build_mytool(str(tmp_path))
+    mtime   = os.stat(exename).st_mtime_ns
+    assert build_mytool(str(tmp_path))==exename and os.stat(exename).st_mtime_ns==mtime
+    assert load_mytool(str(tmp_path)) is not None
+
+def remove_undef(exename,data,undef):
+    #--- 'remove_undef' in 'mod_interp.f90' (not bound in 'load_mytool' as it is not called by INTERP)
+    mytool  = CDLL(exename)
+    mytool.remove_undef.argtypes    = [np.ctypeslib.ndpointer(dtype=np.float32,flags='C_CONTIGUOUS')]+[POINTER(c_int32)]*2+[POINTER(c_float)]
+    mytool.remove_undef.restype     = None
+    ny, nx  = data.shape
+    mytool.remove_undef(data,byref(c_int32(nx)),byref(c_int32(ny)),byref(c_float(undef)))
+
+def test_fill_fortran(mytool):
+    #--- same as 'remove_undef' in 'mod_interp.f90' (bit-identical for periodic windows)
+    rng     = np.random.default_rng(0)
+    ny, nx  = 40, 60
+    data    = np.ma.masked_array(rng.normal(10,5,(ny,nx)).astype('f4'),mask=rng.random((ny,nx))<0.6)
+    data[:3]    = np.ma.masked          # undef rows near the south pole
+    data[-2:]   = np.ma.masked          # undef rows near the north pole
+    data[10,5:] = np.ma.masked          # undef grids across 0/360E
+    data[20,:]  = np.ma.masked
+    data[20,7]  = 1.0                   # only one non-undef grid in a row
+    out     = mk_fill(ny,nx,periodic=True).main(data)
+
+    undef   = -32767.0
+    ref     = np.ma.filled(data,undef).astype('f4')
+    remove_undef(mytool,ref,undef)
+    np.testing.assert_array_equal(out,ref)
+    # regional windows are not connected across their edges (different from 'remove_undef')
+    assert (mk_fill(ny,nx).main(data)!=ref).any()
+
+def no_undef_rows(ny,nx):
+    #--- all-undef rows only on the southern semisphere
+    rng     = np.random.default_rng(0)
+    data    = np.ma.masked_array(rng.normal(10,5,(ny,nx)).astype('f4'),mask=rng.random((ny,nx))<0.3)
+    data[:2]    = np.ma.masked
+    return data
+
+def test_fill_no_undef_rows():
+    #--- without all-undef rows on the northern semisphere, its rows are kept (changed on purpose from 'remove_undef')
+    ny, nx  = 20, 30
+    data    = no_undef_rows(ny,nx)
+    out     = mk_fill(ny,nx,periodic=True).main(data)
+    np.testing.assert_array_equal(out[:2],np.broadcast_to(out[2],(2,nx)))
+    np.testing.assert_array_equal(out[~np.ma.getmaskarray(data)],data.compressed())
+    assert len(np.unique(out[2:],axis=0))==ny-2
+
+def test_fill_no_undef_rows_fortran(mytool):
+    #--- 'remove_undef' overwrites all rows from s_undef of the southern semisphere
+    ny, nx  = 20, 30
+    data    = no_undef_rows(ny,nx)
+    out     = mk_fill(ny,nx,periodic=True).main(data)
+    ref     = np.ma.filled(data,-32767.0).astype('f4')
+    remove_undef(mytool,ref,-32767.0)
+    np.testing.assert_array_equal(ref,np.broadcast_to(out[2],(ny,nx)))
+
+def test_vremap():
+    #--- linear interpolation in vertical (same as np.interp of each column; deeper levels continue the deepest one)
+    lev_in  = [0.5,10,20,30,40,50]
+    lev_out = [0.0,5,15,25,45,60,80]
+    data    = np.random.default_rng(0).random((len(lev_in),3,4)).astype('f4')
+    out     = VREMAP(lev_in,lev_out).main(data)
+    ref     = np.apply_along_axis(lambda col: np.interp(lev_out[:5]+[45,45],lev_in,col),0,data)
+    np.testing.assert_allclose(out,ref,rtol=1e-6)
+
+def test_vremap_bottom():
+    #--- below the bottom of each column (nwet : number of wet input levels), the deepest value above it continues
+    lev_in  = [0.5,10,20,30,40,50]
+    lev_out = [0.0,5,15,25,35,45]
+    data    = np.random.default_rng(0).random((len(lev_in),1,3)).astype('f4')
+    nwet    = np.array([[6,3,0]])
+    vremap  = VREMAP(lev_in,lev_out)
+    out     = vremap.main(data,nwet=nwet)
+    np.testing.assert_array_equal(vremap.get_bottom(nwet),[[5,2,-1]])
+    np.testing.assert_array_equal(out[:,0,0],vremap.main(data)[:,0,0])
+    np.testing.assert_array_equal(out[3:,0,1],out[2,0,1])
+    np.testing.assert_array_equal(out[:,0,2],vremap.main(data)[:,0,2])
+
+def test_vremap_blocks(monkeypatch):
+    #--- computed only in blocks above the bottom, same as computing all columns & continuing the deepest value
+    # (NaN below the bottom of input data is never used)
+    monkeypatch.setattr(VREMAP,'BLOCK',4)
+    rng     = np.random.default_rng(0)
+    lev_in  = [0.5,10,20,30,40,50]
+    lev_out = [0.0,5,15,25,35,45]
+    nwet    = np.where(rng.random((5,7))<0.3,0,rng.integers(2,7,(5,7)))
+    nwet[:2]    = 6
+    data    = rng.random((len(lev_in),5,7)).astype('f4')
+    vremap  = VREMAP(lev_in,lev_out)
+    ref     = vremap.main(data)
+    kbot    = vremap.get_bottom(nwet)
+    for kz in range(1,len(lev_out)):
+        np.copyto(ref[kz],ref[kz-1],where=(kbot>=0)&(kbot<kz))
+    data[np.arange(len(lev_in))[:,None,None]>=np.where(nwet>0,nwet,len(lev_in))+1] = np.nan
+    np.testing.assert_array_equal(vremap.main(data,nwet=nwet),ref)
+
+@pytest.mark.parametrize('depth',[0,2])
+def test_prefetch(depth):
+    #--- items in order; an error in the thread is raised in the caller
+    assert list(prefetch(iter(range(10)),depth))==list(range(10))
+    def fail():
+        yield 1
+        raise OSError('read error')
+    with pytest.raises(OSError) :   list(prefetch(fail(),depth))
+
+def test_prefetch_stop():
+    #--- the thread stops even if the caller stops in the middle
+    made    = []
+    count   = threading.active_count()
+    def items():
+        for ii in range(100) :
+            made.append(ii)
+            yield ii
+    for item in prefetch(items(),2) :
+        if item==3 :    break
+    assert threading.active_count()==count and len(made)<=3+2+2
+
+def test_buffers():
+    #--- get() waits until a buffer is released (other arrays are not returned to the pool)
+    bufs    = BUFFERS((2,3),2)
+    buf1, buf2  = bufs.get(), bufs.get()
+    assert buf1 is not buf2 and bufs.free.empty()
+    bufs.release(np.empty((2,3),dtype=np.float32))
+    assert bufs.free.empty()
+    threading.Timer(0.05,bufs.release,(buf1,)).start()
+    assert bufs.get() is buf1
+
+def test_interp_land_level(mk_interp,backend):
+    #--- a level without ocean grids in the window continues the level above
+    interp, fname   = mk_interp(backend,land=[2])
+    res = interp.main(fname,'to')
+    assert np.isfinite(res).all()
+    np.testing.assert_array_equal(res[1],res[2])
+    assert (res[0]>res[1]).all() and (res[2]>res[3]).all()
+
+def test_backends(tmp_path,mk_interp,mytool):
+    #--- 'numpy' & 'fortran' backends give the same results (except rounding)
+    res = [mk_interp(backend)[0].main_all(f'{tmp_path}/2020/uvts_2020070100.nc',['uo','to']) for backend in ['numpy','fortran']]
+    for vname in ['uo','to'] :
+        assert np.isfinite(res[0][vname]).all()
+        np.testing.assert_allclose(res[0][vname],res[1][vname],rtol=1e-6)
+
+def test_main_all(mk_interp):
+    #--- all variables of a file in one pass are the same as each variable alone
+    interp, fname   = mk_interp('numpy')
+    res     = interp.main_all(fname,['uo','vo','to','so'])
+    assert list(res)==['uo','vo','to','so']
+    for vname in res :  np.testing.assert_array_equal(res[vname],mk_interp('numpy')[0].main(fname,vname))
+
+def test_multi(tmp_path,mk_interp,backend):
+    #--- COCO grids of two resolutions sharing the window are the same as each grid alone
+    interp, fname   = mk_interp(backend)
+    glorys  = GLORYS12v1(f'{tmp_path}/','2020070100')
+    lon, lat    = np.meshgrid(np.arange(103,117,1.0),np.arange(3,17,1.0))
+    coarse  = SimpleNamespace(lon=lon,lat=lat,nx=lon.shape[1],ny=lon.shape[0],nz=4,lev=np.array([1,10,20,35.0]),gname=interp.coco.gname)
+    cover   = [interp.coco,coarse]
+    targets = [INTERP(coco,glorys,LUT(coco,glorys,cover=cover),backend) for coco in cover]
+    res     = dict(targets[0].main_multi(fname,['to','so'],targets))
+    for vname in ['to','so'] :
+        np.testing.assert_array_equal(res[vname][0],interp.main(fname,vname))
+        alone   = INTERP(coarse,glorys,LUT(coarse,glorys),backend).main(fname,vname)
+        np.testing.assert_array_equal(res[vname][1],alone)
+
+def test_workers(tmp_path,mk_interp,backend):
+    #--- levels interpolated by threads are the same as those in turn
+    fname   = f'{tmp_path}/2020/uvts_2020070100.nc'
+    res     = [mk_interp(backend,workers=workers)[0].main(fname,'to') for workers in [1,3]]
+    np.testing.assert_array_equal(res[0],res[1])
+
+@pytest.mark.parametrize('kwargs',[{},{'bottom':True,'workers':2,'depth':2}])
+def test_tiled(mk_interp,backend,kwargs):
+    #--- bands of the tiled mode are the same as the result of the normal mode (a level without ocean grids included)
+    interp, fname   = mk_interp(backend,land=(3,),**kwargs)
+    nthread, level  = kwargs.get('workers',1), interp.fill.shape[0]*interp.fill.shape[1]
+    bottom  = kwargs.get('bottom',False)
+    fixed   = level*(5*(kwargs.get('depth',0)+1)+21*nthread+(2+3*nthread if bottom else 0))
+    row     = 20*(4*(5+4+1+nthread)+(26 if bottom else 0))
+    tiled, _        = mk_interp(backend,land=(3,),tile=fixed+3*row,**kwargs)
+    assert tiled.nrow==3 and [table[:2] for table in tiled.tables]==[(j1,min(j1+3,20)) for j1 in range(0,20,3)]
+    res     = interp.main(fname,'to')
+    bands   = tiled.main(fname,'to')
+    assert isinstance(bands,BANDS) and bands.shape==res.shape
+    out     = np.full(res.shape,np.nan,dtype=np.float32)
+    for j1, j2, data in bands : out[:,j1:j2]   = data
+    np.testing.assert_array_equal(out,res)
+    with pytest.raises(SystemExit,match='tile must be at least') :
+        mk_interp(backend,tile=fixed,**kwargs)
+
+def test_tiled_memory(mk_interp):
+    #--- buffers of a variable (reading, filling & both interpolations of bands) are within the tile
+    # numpy backend : ctypes objects made for each call of the Fortran kernel are not counted in the tile
+    probe, fname    = mk_interp('numpy')
+    tile    = probe.fill.shape[0]*probe.fill.shape[1]*26+2*20*44
+    tiled, _        = mk_interp('numpy',tile=tile)
+    for _ in tiled.main(fname,'to') :   pass
+    tracemalloc.start()
+    for _ in tiled.main(fname,'to') :   pass
+    peak    = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert tiled.nrow==2 and peak<=tile
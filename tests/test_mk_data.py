@@ -0,0 +1,142 @@
+import os
+import time
+import pytest
+import numpy as np
+from types      import SimpleNamespace
+from collections    import Counter
+from datetime   import datetime
+from mk_data    import WRITER, CONVERT, MULTI, get_days, get_series, get_inits
+from interpolation  import BUFFERS
+from scheduler  import SCHEDULER
+
+def test_writer_order():
+    #--- records are written in order, then done() is called
+    out, done   = [], []
+    writer  = WRITER(depth=2)
+    for ii in range(10) :   writer.put(out.append,(ii,),lambda ii=ii: done.append(ii))
+    writer.join()
+    assert out==list(range(10)) and done==list(range(10))
+
+def test_writer_sync():
+    out     = []
+    writer  = WRITER(depth=0)
+    writer.put(out.append,(1,))
+    assert out==[1] and writer.thread is None
+
+def test_writer_reset():
+    #--- an error is raised in join() (records after it are not written), and forgotten by reset()
+    def fail(ii):   raise OSError('disk full')
+    out, done   = [], []
+    writer  = WRITER(depth=2)
+    writer.put(fail,(0,),lambda: done.append(0))
+    writer.put(out.append,(1,),lambda: done.append(1))
+    with pytest.raises(OSError) :   writer.join()
+    assert out==[] and done==[0,1]
+
+    writer.put(fail,(0,))
+    while writer.error is None :    time.sleep(0.01)
+    with pytest.raises(OSError) :   writer.put(out.append,(2,))
+    writer.reset()
+    writer.put(out.append,(3,))
+    writer.join()
+    assert out==[3]
+
+def test_get_series():
+    #--- 06Z -> 12Z of the next day every 6 hours (daily data are regarded as data at 00Z)
+    series  = get_series('2020070106','2020070212',6)
+    assert [now.hour for now, _, _, _ in series]==[6,12,18,0,6,12]
+    for now, day1, day2, wgt in series :
+        assert day1<=now<=day2 and (now-day1).total_seconds()/86400==wgt
+        assert (day2==day1)==(wgt==0)
+    days    = {day for _, day1, day2, _ in series for day in [day1,day2]}
+    assert days<=set(get_days('2020070106','2020070212'))
+    assert get_days('2020070106','2020070212')==[datetime(2020,7,day) for day in [1,2,3]]
+
+def test_series_tasks():
+    #--- daily data shared by initialized times are interpolated only once (SERIES of T & S is one task)
+    sched   = SCHEDULER('.',['2020070112','2020070200'],tspan=2)
+    sched.tmpdir    = 'tmp'
+    sched.mk_tasks(uv_on=False,every=6)
+    interps = sorted([name[1:] for name in sched.tasks if name[0]=='interp'])
+    assert interps==sorted([(f'202007{day:02}00',vname) for day in [1,2,3,4] for vname in ['so','to']]+\
+                           [('2020070112',vname) for vname in ['so','to']])
+    assert sorted([name for name in sched.tasks if name[0]=='series'])==[('series','2020070112'),('series','2020070200')]
+    func, args, deps    = sched.tasks[('series','2020070112')]
+    assert deps=={('interp',f'202007{day:02}00',vname) for day in [1,2,3,4] for vname in ['to','so']}
+    assert args[-1][('2020070300','so')]=='tmp/so_2020070300.npy'
+
+def test_get_inits():
+    #--- duplicated times are made once; a time can be used for both INIT & NUDGE
+    inits, targets  = get_inits(['2020070100','2020062100','2020070100'],tspan=10)
+    assert inits=={'2020062100':'2020070100','2020070100':'2020071100'}
+    assert targets=={'2020070100':['2020062100'],'2020071100':['2020070100']}
+
+def test_nudge_tasks():
+    #--- a file used for INIT & NUDGE is interpolated once; the first initialized time is not downloaded in tasks
+    sched   = SCHEDULER('.',['2020062100','2020070100'],tspan=10)
+    sched.tmpdir    = 'tmp'
+    sched.mk_tasks()
+    names   = set(sched.tasks)
+    assert {name for name in names if name[0]=='download'}=={('download','2020070100'),('download','2020071100')}
+    assert len([name for name in names if name[0]=='interp' and name[1]=='2020070100'])==4
+    assert sched.tasks[('nudge','2020062100','to')][2]=={('interp','2020070100','to')}
+    assert sched.tasks[('init','2020070100')][2]=={('interp','2020070100',vname) for vname in ['uo','vo','to','so']}
+    assert sched.tasks[('interp','2020071100','so')][2]=={('download','2020071100')}
+
+class COUNT :
+    #--- INTERP counting interpolated variables of each file (data : the number of the call)
+    def __init__(self):
+        self.calls  = []
+        self.tile   = 0
+
+    def main_multi(self,ifname,varnames,targets,outs=None):
+        for varname in varnames :
+            self.calls.append((os.path.basename(ifname),varname))
+            yield varname, [np.full((2,3,4),len(self.calls),dtype=np.float32) for _ in targets]
+
+    def main_iter(self,ifname,varnames,out=None):
+        for varname, res in self.main_multi(ifname,varnames,[None]) :   yield varname, res[0]
+
+    def main_all(self,ifname,varnames):
+        return dict(self.main_iter(ifname,varnames))
+
+def mk_convert(tmp_path,interp,written):
+    #--- CONVERT without grids & restart files (records are listed in 'written')
+    convert = CONVERT.__new__(CONVERT)
+    convert.topdir, convert.idir, convert.ndir, convert.tag = str(tmp_path), f'{tmp_path}/', f'{tmp_path}/', ''
+    convert.interp, convert.odim2   = interp, (3,4)
+    convert.vbufs, convert.writer   = BUFFERS((2,3,4),1), WRITER(0)
+    reader  = {name: np.zeros((5,3,4)) for name in ['AI','HI','TI','HS','TSI']}
+    def set_time(ymdh1,ymdh2):
+        convert.header  = SimpleNamespace(value=[[' '*16]*64 for _ in range(24)],reader=reader)
+        convert.ymdh1, convert.ymdh2    = ymdh1, ymdh2
+    def write_data(tfout,hidx,odata,done=None):
+        written.append((os.path.basename(tfout.name),hidx,convert.header.value[hidx][49]))
+        if done is not None :   done()
+    convert.set_time, convert.write_data    = set_time, write_data
+    return convert
+
+def test_batch_series(tmp_path):
+    #--- T & S of a daily file used for INIT & SERIES are interpolated once (U & V of initialized times only)
+    interp, written = COUNT(), []
+    convert = mk_convert(tmp_path,interp,written)
+    convert.BATCH(['2020070100','2020070112','2020070200'],tspan=2,every=6)
+    counts  = Counter(interp.calls)
+    assert set(counts.values())=={1}
+    assert {ymdh for ymdh, vname in counts if vname=='uo'}=={'uvts_2020070100.nc','uvts_2020070112.nc','uvts_2020070200.nc'}
+    assert {ymdh for ymdh, vname in counts if vname=='to'}=={f'uvts_202007{day:02}00.nc' for day in [1,2,3,4]}|{'uvts_2020070112.nc'}
+    assert len([record for record in written if record[0]=='coco_init_2020070100.gt3'])==24
+    times   = [record[2] for record in written if record[0]=='to_nudge_2020070112-2020070312.gt3']
+    assert times==[f'00{ymdh}0000' for ymdh in ['2020070112','2020070118','2020070200','2020070206','2020070212',\
+                   '2020070218','2020070300','2020070306','2020070312']]
+
+def test_multi_series(tmp_path):
+    #--- daily files are interpolated once for all resolutions (INIT is written while the next variable is made)
+    interp, written = COUNT(), []
+    multi   = MULTI.__new__(MULTI)
+    multi.topdir, multi.interp, multi.targets   = str(tmp_path), interp, [None,None]
+    for grid in ['100','025'] : (tmp_path/grid).mkdir()
+    multi.converts  = [mk_convert(tmp_path/grid,interp,written) for grid in ['100','025']]
+    multi.BATCH(['2020070100','2020070112'],tspan=1,uv_on=False,every=12)
+    assert sorted(interp.calls)==sorted([(f'uvts_{ymdh}.nc',vname) for ymdh in ['2020070100','2020070112','2020070200','2020070300'] for vname in ['to','so']])
+    assert len(written)==2*(2*24+2*2*3+2*2)
@@ -0,0 +1,43 @@
+import os
+import time
+import threading
+from serve  import SERVER, send
+
+def test_jobs(tmp_path,monkeypatch):
+    #--- jobs run one by one; a failed job ('exit') is reported and later jobs still run
+    server  = SERVER(str(tmp_path),f'{tmp_path}/serve.sock')
+    def run(job):
+        if job['stime']=='2020070100' : exit('STOP: restart file is not found')
+        return [job['stime']]
+    monkeypatch.setattr(server,'run',run)
+    worker  = threading.Thread(target=server.work)
+    worker.start()
+    jobs    = [server.request({'cmd':'submit','stime':stime,'every':6}) for stime in ['2020070100','2020070200']]
+    assert [job['status'] for job in jobs]==['queued','queued'] and jobs[1]['request']['every']==6
+    server.queue.put(None)
+    worker.join()
+
+    status  = server.request({'cmd':'status'})['jobs']
+    assert [job['status'] for job in status]==['failed','done']
+    assert status[0]['error']=='STOP: restart file is not found'
+    assert server.request({'cmd':'status','id':2})['outputs']==['2020070200']
+
+def test_bad_request(tmp_path):
+    server  = SERVER(str(tmp_path),f'{tmp_path}/serve.sock')
+    assert 'error' in server.request({'cmd':'submit','stime':'20200701'})
+    assert 'error' in server.request({'cmd':'status','id':1})
+    assert 'error' in server.request({'cmd':'restart'})
+    assert server.queue.empty()
+
+def test_socket(tmp_path,monkeypatch):
+    #--- one JSON request & reply per line through the Unix socket; queued jobs finish before shutdown
+    sname   = f'{tmp_path}/serve.sock'
+    server  = SERVER(str(tmp_path),sname)
+    monkeypatch.setattr(server,'run',lambda job: [job['stime']])
+    thread  = threading.Thread(target=server.main)
+    thread.start()
+    while not hasattr(server,'server') :    time.sleep(0.01)
+    assert send(sname,{'cmd':'submit','stime':'2020070100'})['id']==1
+    assert send(sname,{'cmd':'shutdown'})=={'status':'shutdown'}
+    thread.join()
+    assert server.jobs[1]['status']=='done' and not os.path.exists(sname)
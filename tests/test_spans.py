@@ -0,0 +1,27 @@
+import threading
+import tracemalloc
+import numpy as np
+import spans
+
+def test_peaks(monkeypatch):
+    #--- peaks are recorded in the main thread only (nested peaks are kept in the parent)
+    monkeypatch.setattr(spans,'records',[])
+    spans.enable()
+    try :
+        def worker():
+            with spans.span('worker') :
+                np.ones(1<<20)
+        with spans.span('outer') :
+            with spans.span('inner') :
+                data    = np.ones(1<<21)
+                del data
+            thread  = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+        table   = spans.summary()
+    finally :
+        monkeypatch.setattr(spans,'enabled',False)
+        tracemalloc.stop()
+    assert table['worker']['alloc'] is None
+    assert table['inner']['alloc']>=8*(1<<21)
+    assert table['outer']['alloc']>=table['inner']['alloc']